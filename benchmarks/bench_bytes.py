@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+"""
+usage: bench_bytes.py [-h] [--number NUMBER] [--repeat REPEAT]
+
+Measure how many packets per second can be encoded with ByteWriter.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --number NUMBER, -n NUMBER
+                        packets encoded per timing run
+  --repeat REPEAT, -r REPEAT
+                        number of timing runs, the best one is reported
+
+The ByteReader and ByteWriter primitives are benchmarked by run.py.
+"""
+
+import argparse
+import timeit
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader, ByteWriter
+
+from suite import benchmark
+
+# values written and read per call of the primitive benchmarks
+COUNT = 100
+
+
+def block_action():
+    packet = loaders.BlockAction()
+    packet.player_id = 3
+    packet.value = 0
+    packet.x, packet.y, packet.z = 256, 256, 32
+    return packet
+
+
+def world_update_items():
+    packet = loaders.WorldUpdate()
+    packet.items = [((256.0, 256.0, 32.0), (0.0, 1.0, 0.0))] * 32
+    return packet
+
+
+def world_update_data():
+    packet = loaders.WorldUpdate()
+    packet.data = bytes(32 * 24)
+    return packet
+
+
+CASES = [
+    ('BlockAction', block_action),
+    ('WorldUpdate (items)', world_update_items),
+    ('WorldUpdate (buffer)', world_update_data),
+]
+
+
+def encode(packet):
+    writer = ByteWriter()
+    packet.write(writer)
+    return bytes(writer)
+
+
+def _writer_benchmark(name, method, value):
+    @benchmark('ByteWriter.' + name, ops=COUNT)
+    def setup():
+        def run():
+            writer = ByteWriter()
+            write = getattr(writer, method)
+            for _ in range(COUNT):
+                write(value)
+            return bytes(writer)
+        return run
+
+
+def _reader_benchmark(name, method, data, size):
+    @benchmark('ByteReader.' + name, ops=COUNT)
+    def setup():
+        buffer = data * COUNT
+
+        def run():
+            read = getattr(ByteReader(buffer), method)
+            for _ in range(COUNT):
+                read(*size)
+        return run
+
+
+_writer_benchmark('writeByte', 'writeByte', 7)
+_writer_benchmark('writeInt', 'writeInt', 70000)
+_writer_benchmark('writeFloat', 'writeFloat', 1.5)
+_writer_benchmark('writeString', 'writeString', b'Deuce')
+_reader_benchmark('readByte', 'readByte', b'\x07', ())
+_reader_benchmark('readInt', 'readInt', b'\x70\x11\x01\x00', ())
+_reader_benchmark('readFloat', 'readFloat', b'\x00\x00\xc0\x3f', ())
+_reader_benchmark('readString', 'readString', b'Deuce\x00', ())
+_reader_benchmark('read', 'read', b'\x00' * 16, (16,))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how many packets per second can be encoded "
+                    "with ByteWriter.")
+    parser.add_argument("--number", "-n", type=int, default=200000,
+                        help="packets encoded per timing run")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="number of timing runs, the best one is reported")
+    args = parser.parse_args()
+
+    for name, factory in CASES:
+        packet = factory()
+        best = min(timeit.repeat(lambda: encode(packet),
+                                 number=args.number, repeat=args.repeat))
+        print("{:<24} {:>12,.0f} packets/s".format(name, args.number / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Encoding and decoding of every packet in pyspades.contained, run by run.py.
+
+Packets with a ``fields`` layout are filled with sample values generated from
+it, the others are built by hand below.
+"""
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader, ByteWriter
+from pyspades.schema import Flags, FixedString, COLOR, RGB, STRING, BYTES
+
+from suite import benchmark
+
+SAMPLES = {
+    'b': -3, 'B': 200, 'h': -300, 'H': 300, 'i': -70000, 'I': 70000,
+    'f': 1.5,
+}
+
+
+def sample(field_type):
+    if field_type is COLOR:
+        return 0x123456
+    if field_type is RGB:
+        return (0x12, 0x34, 0x56)
+    if field_type is STRING:
+        return 'Deuce'
+    if field_type is BYTES:
+        return bytes(range(256)) * 32  # a map chunk
+    if isinstance(field_type, FixedString):
+        return 'Deuce'
+    return SAMPLES[field_type.code]
+
+
+def from_fields(packet_class):
+    packet = packet_class()
+    for name, field_type in packet_class.fields:
+        if isinstance(field_type, Flags):
+            for bit, flag in enumerate(field_type.names):
+                setattr(packet, flag, bit % 2 == 0)
+        else:
+            setattr(packet, name, sample(field_type))
+    return packet
+
+
+def world_update():
+    packet = loaders.WorldUpdate()
+    packet.items = [((256.0, 256.0, 32.0), (0.0, 1.0, 0.0))] * 32
+    return packet
+
+
+def grenade_packet():
+    packet = loaders.GrenadePacket()
+    packet.player_id = 3
+    packet.value = 3.0
+    packet.position = (256.0, 256.0, 32.0)
+    packet.velocity = (0.5, 0.5, 0.0)
+    return packet
+
+
+def state_data():
+    state = loaders.CTFState()
+    state.team1_score = state.team2_score = 3
+    state.cap_limit = 10
+    state.team1_has_intel = True
+    state.team1_carrier = 5
+    packet = loaders.StateData()
+    packet.player_id = 3
+    packet.fog_color = (128, 232, 255)
+    packet.team1_color = (0, 0, 255)
+    packet.team2_color = (0, 255, 0)
+    packet.team1_name = 'Blue'
+    packet.team2_name = 'Green'
+    packet.state = state
+    return packet
+
+
+def fog_color():
+    packet = loaders.FogColor()
+    packet.color = 0x80E8FF
+    return packet
+
+
+def protocol_extension_info():
+    packet = loaders.ProtocolExtensionInfo()
+    packet.extensions = [(0xC0, 1), (0xC1, 1)]
+    return packet
+
+
+PACKETS = [
+    world_update, grenade_packet, state_data, fog_color,
+    loaders.HandShakeInit, loaders.VersionRequest, protocol_extension_info,
+]
+# payloads of packets whose write() only sends the id
+PAYLOADS = {
+    loaders.HandShakeReturn: b'\x2a\x00\x00\x00',
+    loaders.VersionResponse: b'o\x00\x0a\x03Linux',
+}
+
+
+def encode(packet):
+    writer = ByteWriter()
+    packet.write(writer)
+    return bytes(writer)
+
+
+def encode_benchmark(name, packet):
+    @benchmark('encode ' + name)
+    def setup():
+        return lambda: encode(packet)
+
+
+def decode_benchmark(name, packet_class, payload):
+    @benchmark('decode ' + name)
+    def setup():
+        return lambda: packet_class(ByteReader(payload))
+
+
+def register():
+    packets = [from_fields(value) for value in vars(loaders).values()
+               if isinstance(value, type) and 'fields' in vars(value)]
+    packets.extend(factory() for factory in PACKETS)
+    for packet in sorted(packets, key=lambda packet: packet.id):
+        name = type(packet).__name__
+        encode_benchmark(name, packet)
+        decode_benchmark(name, type(packet), encode(packet)[1:])
+    for packet_class, payload in PAYLOADS.items():
+        decode_benchmark(packet_class.__name__, packet_class, payload)
+
+
+register()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+usage: bench_map_memory.py [-h] [--copies COPIES]
+
+Measure how much memory a loaded map takes, by watching the resident set size
+of the process while map copies are created, and how much a process needs at
+most while it loads a map from a file. Only works on Linux.
+
+Build the extensions with VXL_HASH_COLORS=1 to compare against the old color
+storage.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --copies COPIES, -c COPIES
+                        number of map copies to average over
+
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from pyspades.mapmaker import generate_classic
+from pyspades.vxl import VXLData
+
+MAP_SEED = 1
+
+
+def get_rss():
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def reset_peak_rss():
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5')
+
+
+def get_peak_rss():
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how much memory a loaded map takes.")
+    parser.add_argument("--copies", "-c", type=int, default=5,
+                        help="number of map copies to average over")
+    args = parser.parse_args()
+
+    start = get_rss()
+    map_ = generate_classic(MAP_SEED)
+    print("generated map:  {:>8.1f} MiB".format(
+        (get_rss() - start) / 2 ** 20))
+
+    data = map_.generate()
+    start = get_rss()
+    before = time.perf_counter()
+    copies = [map_.copy() for _ in range(args.copies)]
+    elapsed = time.perf_counter() - before
+    print("per copy:       {:>8.1f} MiB {:>8.1f} ms".format(
+        (get_rss() - start) / args.copies / 2 ** 20,
+        elapsed / args.copies * 1000))
+    del copies
+    print("encoded map:    {:>8.1f} MiB".format(len(data) / 2 ** 20))
+
+    with tempfile.NamedTemporaryFile(suffix='.vxl') as file:
+        file.write(data)
+        file.flush()
+        del map_, data
+        start = get_rss()
+        reset_peak_rss()
+        before = time.perf_counter()
+        with open(file.name, 'rb') as fp:
+            loaded = VXLData(fp)
+        elapsed = time.perf_counter() - before
+        print("loaded map:     {:>8.1f} MiB {:>8.1f} ms".format(
+            (get_rss() - start) / 2 ** 20, elapsed * 1000))
+        print("load peak:      {:>8.1f} MiB".format(
+            (get_peak_rss() - start) / 2 ** 20))
+        del loaded
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+"""
+usage: bench_map_transfer.py [-h] [--players PLAYERS] [--ticks TICKS]
+
+Measure how long world ticks take while players download a map that was just
+changed to, for each way the server can prepare the map data:
+
+  progressive  ProgressiveMapGenerator, compressed while it is sent
+  blocking     MapCache, compressed when the map changes
+  background   MapCache, compressed in background threads
+
+Every tick simulates the world and sends each player up to 10 chunks of map
+data, like the server does while no chunks are in transit.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --players PLAYERS, -p PLAYERS
+                        number of players joining after the map change
+  --ticks TICKS, -t TICKS
+                        number of ticks to simulate
+
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from pyspades import world
+from pyspades.common import Vertex3
+from pyspades.constants import UPDATE_FREQUENCY
+from pyspades.mapgenerator import MapCache, ProgressiveMapGenerator
+from pyspades.mapmaker import generate_classic
+
+MAP_SEEDS = (1, 2)
+CHARACTERS = 32
+CHUNK_SIZE = 8192
+
+
+def fall(damage):
+    pass
+
+
+def make_world(map_):
+    world_ = world.World()
+    world_.map = map_
+    for slot in range(CHARACTERS):
+        x, y = random.randrange(16, 496), random.randrange(16, 496)
+        character = world_.create_object(
+            world.Character, Vertex3(x + 0.5, y + 0.5, map_.get_z(x, y) - 2),
+            Vertex3(1, 0, 0), fall, slot)
+        character.set_walk(*[random.random() < 0.5 for _ in range(4)])
+    return world_
+
+
+def change_map(mode, map_, players):
+    if mode == 'progressive':
+        parent = ProgressiveMapGenerator(map_, parent=True)
+        return [parent.get_child() for _ in range(players)]
+    cache = MapCache(map_)
+    if mode == 'blocking':
+        cache.get_data()
+    else:
+        cache.update()
+    return [cache.get_generator() for _ in range(players)]
+
+
+def run(mode, maps, players, ticks):
+    random.seed(0)
+    world_ = make_world(maps[0])
+    # so that the map of the first change was never serialized
+    map_ = maps[1].copy()
+    generators = []
+    times = []
+    done = None
+    for tick in range(ticks):
+        start = time.perf_counter()
+        if tick == 10:
+            world_.map = map_
+            generators = change_map(mode, map_, players)
+        for generator in generators:
+            for _ in range(10):
+                if not generator.data_left():
+                    break
+                if not generator.read(CHUNK_SIZE):
+                    break
+        world_.update(UPDATE_FREQUENCY)
+        times.append(time.perf_counter() - start)
+        if done is None and generators and not any(
+                generator.data_left() for generator in generators):
+            done = tick - 10
+        # leave the rest of the tick to other threads, like the event loop
+        # does while it waits for packets
+        time.sleep(max(0.0, UPDATE_FREQUENCY - times[-1]))
+    times.sort()
+    return (max(times), times[len(times) * 99 // 100],
+            statistics.median(times), done)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure world tick times during map transfers.")
+    parser.add_argument("--players", "-p", type=int, default=20,
+                        help="number of players joining after the map "
+                        "change")
+    parser.add_argument("--ticks", "-t", type=int, default=300,
+                        help="number of ticks to simulate")
+    args = parser.parse_args()
+
+    maps = [generate_classic(seed) for seed in MAP_SEEDS]
+    print("{:<12} {:>9} {:>9} {:>9} {:>12}".format(
+        "mode", "max", "p99", "median", "sent after"))
+    for mode in ('progressive', 'blocking', 'background'):
+        longest, p99, median, done = run(mode, maps, args.players,
+                                         args.ticks)
+        print("{:<12} {:>6.1f} ms {:>6.1f} ms {:>6.1f} ms {:>6} ticks".format(
+            mode, longest * 1000, p99 * 1000, median * 1000,
+            done if done is not None else '-'))
+
+
+if __name__ == "__main__":
+    main()
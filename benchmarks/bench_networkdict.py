@@ -0,0 +1,51 @@
+"""
+Ban list lookups, run by run.py.
+"""
+
+import random
+
+from piqueserver.networkdict import NetworkDict
+
+from suite import benchmark
+
+BANS = 1000
+LOOKUPS = 100
+
+
+def random_ip():
+    return '{}.{}.{}.{}'.format(*(random.randrange(1, 255) for _ in range(4)))
+
+
+def ban_list():
+    bans = NetworkDict()
+    for index in range(BANS):
+        # mostly single addresses, some ranges
+        if index % 10:
+            network = random_ip()
+        else:
+            network = '{}/{}'.format(random_ip(), random.choice((16, 24)))
+        bans[network] = ['Deuce', 'griefing', None]
+    return bans
+
+
+@benchmark('NetworkDict lookup (miss)', ops=LOOKUPS)
+def lookup_miss():
+    bans = ban_list()
+    addresses = [random_ip() for _ in range(LOOKUPS)]
+
+    def run():
+        for address in addresses:
+            address in bans
+    return run
+
+
+@benchmark('NetworkDict lookup (hit)', ops=LOOKUPS)
+def lookup_hit():
+    bans = ban_list()
+    networks = [str(network.network_address) for network in bans.networks]
+    addresses = [random.choice(networks) for _ in range(LOOKUPS)]
+
+    def run():
+        for address in addresses:
+            bans[address]
+    return run
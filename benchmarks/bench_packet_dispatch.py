@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+"""
+usage: bench_packet_dispatch.py [-h] [--number NUMBER] [--repeat REPEAT]
+
+Measure the cost of decoding and dispatching inbound packets, with and without
+reusable per-connection Loader instances.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --number NUMBER, -n NUMBER
+                        packets dispatched per timing run
+  --repeat REPEAT, -r REPEAT
+                        number of timing runs, the best one is reported
+
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+import enet
+
+from pyspades import contained as loaders
+from pyspades.packet import LoaderCache, call_packet_handler
+# importing the player module registers the server's packet handlers
+from pyspades.player import REUSABLE_LOADERS
+
+from suite import benchmark
+
+
+class Connection:
+    """stand-in for a ServerConnection whose handlers do nothing"""
+    hp = None
+
+
+def make_packets():
+    position = loaders.PositionData()
+    position.x, position.y, position.z = 256.0, 256.0, 32.0
+    orientation = loaders.OrientationData()
+    orientation.x, orientation.y, orientation.z = 0.0, 1.0, 0.0
+    input_data = loaders.InputData()
+    input_data.up = True
+    weapon_input = loaders.WeaponInput()
+    weapon_input.primary = True
+    return [enet.Packet(bytes(packet.generate()), 0) for packet in
+            (position, orientation, input_data, weapon_input)]
+
+
+def dispatch(connection, packets, cache):
+    for packet in packets:
+        call_packet_handler(connection, packet, cache)
+
+
+def peak_memory(connection, packets, cache):
+    """return the peak memory traced while dispatching one round of packets"""
+    dispatch(connection, packets, cache)
+    tracemalloc.start()
+    dispatch(connection, packets, cache)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+@benchmark('dispatch (new Loader per packet)', ops=4)
+def dispatch_new():
+    connection = Connection()
+    packets = make_packets()
+    return lambda: dispatch(connection, packets, None)
+
+
+@benchmark('dispatch (reused Loaders)', ops=4)
+def dispatch_reused():
+    connection = Connection()
+    packets = make_packets()
+    cache = LoaderCache(REUSABLE_LOADERS)
+    return lambda: dispatch(connection, packets, cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cost of decoding and dispatching inbound "
+                    "packets, with and without reusable Loader instances.")
+    parser.add_argument("--number", "-n", type=int, default=50000,
+                        help="packets dispatched per timing run")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="number of timing runs, the best one is reported")
+    args = parser.parse_args()
+
+    connection = Connection()
+    packets = make_packets()
+    rounds = max(args.number // len(packets), 1)
+    count = rounds * len(packets)
+    for name, cache in (('new Loader per packet', None),
+                        ('reused Loaders', LoaderCache(REUSABLE_LOADERS))):
+        best = min(timeit.repeat(
+            lambda: dispatch(connection, packets, cache),
+            number=rounds, repeat=args.repeat))
+        peak = peak_memory(connection, packets, cache)
+        print("{:<24} {:>6.0f} ns/packet {:>6} bytes peak per {} packets"
+              .format(name, best / count * 1e9, peak, len(packets)))
+
+if __name__ == "__main__":
+    main()
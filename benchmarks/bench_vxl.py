@@ -0,0 +1,417 @@
+"""
+Map loading, saving, connectivity checks and map transfer, run by run.py.
+
+All benchmarks use the same generated map, see suite.get_map.
+"""
+
+import io
+import random
+import tempfile
+
+from pyspades.mapgenerator import MapCache, ProgressiveMapGenerator
+from pyspades import vxl
+from pyspades.vxl import VXLData
+
+from suite import benchmark, get_map
+
+# bytes read from the generator at a time, like a map transfer does
+CHUNK_SIZE = 8192
+# points checked per call of the check_node benchmark
+NODES = 100
+# blocks changed between two saves
+EDITS = 1000
+
+
+@benchmark('VXLData load')
+def vxl_load():
+    data = get_map().generate()
+    return lambda: VXLData(io.BytesIO(data))
+
+
+@benchmark('VXLData load (file)')
+def vxl_load_file():
+    # kept open, so the file is only removed when the benchmarks are done
+    file = tempfile.NamedTemporaryFile(suffix='.vxl')
+    file.write(get_map().generate())
+    file.flush()
+
+    def run():
+        with open(file.name, 'rb') as fp:
+            VXLData(fp)
+    return run
+
+
+@benchmark('VXLData load (map cache file)')
+def vxl_load_cache():
+    file = tempfile.NamedTemporaryFile(suffix='.vxlc')
+    file.write(get_map().get_cache_data())
+    file.flush()
+
+    def run():
+        with open(file.name, 'rb') as fp:
+            vxl.load_cache(fp)
+    return run
+
+
+@benchmark('VXLData save (unchanged)')
+def vxl_save():
+    return get_map().generate
+
+
+@benchmark('VXLData copy')
+def vxl_copy():
+    return get_map().copy
+
+
+@benchmark('VXLData copy (10 blocks built)')
+def vxl_copy_edits():
+    map_ = get_map()
+    points = [(x, y, map_.get_z(x, y) - 1) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(10))]
+    color = (128, 128, 128)
+
+    def run():
+        # every change while a copy exists copies the chunk it is in
+        copy = map_.copy()
+        for x, y, z in points:
+            map_.set_point(x, y, z, color)
+    return run
+
+
+@benchmark('VXLData save (full, includes copy)')
+def vxl_save_full():
+    map_ = get_map()
+    # map_ was never saved, so its copies serialize every column on their
+    # first save, like a map that was just loaded
+    return lambda: map_.copy().generate()
+
+
+@benchmark('VXLData save ({} edits)'.format(EDITS))
+def vxl_save_edits():
+    map_ = get_map()
+    map_.generate()
+    points = [(x, y, map_.get_z(x, y) - 1) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(EDITS))]
+    colors = [(128, 128, 128), (64, 64, 64)]
+
+    def run():
+        color = colors.pop()
+        colors.insert(0, color)
+        for x, y, z in points:
+            map_.set_point(x, y, z, color)
+        map_.generate()
+    return run
+
+
+@benchmark('VXLData get_color', ops=NODES)
+def vxl_get_color():
+    map_ = get_map()
+    points = [(x, y, map_.get_z(x, y)) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(NODES))]
+    get_color = map_.get_color
+
+    def run():
+        for x, y, z in points:
+            get_color(x, y, z)
+    return run
+
+
+def island_map():
+    # a few small islands in an empty map
+    map_ = VXLData()
+    for cx, cy in ((60, 80), (300, 400), (450, 100)):
+        for x in range(cx, cx + 8):
+            for y in range(cy, cy + 8):
+                map_.set_column_fast(x, y, 60, 63, 60, 0x808080)
+    return map_
+
+
+@benchmark('VXLData get_random_point (whole map)', ops=NODES)
+def vxl_random_point():
+    map_ = get_map()
+
+    def run():
+        for _ in range(NODES):
+            map_.get_random_point(0, 0, 512, 512)
+    return run
+
+
+@benchmark('VXLData get_random_point (islands)', ops=NODES)
+def vxl_random_point_islands():
+    map_ = island_map()
+
+    def run():
+        for _ in range(NODES):
+            map_.get_random_point(0, 0, 512, 512)
+    return run
+
+
+@benchmark('VXLData get_random_point (spawn area)', ops=NODES)
+def vxl_random_point_area():
+    map_ = get_map()
+
+    def run():
+        for _ in range(NODES):
+            map_.get_random_point(0, 128, 128, 384)
+    return run
+
+
+@benchmark('VXLData count_land')
+def vxl_count_land():
+    map_ = get_map()
+    return lambda: map_.count_land(0, 0, 512, 512)
+
+
+@benchmark('VXLData get_overview')
+def vxl_get_overview():
+    return get_map().get_overview
+
+
+@benchmark('VXLData get_z (every column)')
+def vxl_get_z():
+    map_ = get_map()
+    get_z = map_.get_z
+
+    def run():
+        for y in range(512):
+            for x in range(512):
+                get_z(x, y)
+    return run
+
+
+@benchmark('VXLData get_height (every column)')
+def vxl_get_height():
+    map_ = get_map()
+    get_height = map_.get_height
+
+    def run():
+        for y in range(512):
+            for x in range(512):
+                get_height(x, y)
+    return run
+
+
+@benchmark('VXLData get_height_map')
+def vxl_get_height_map():
+    return get_map().get_height_map
+
+
+@benchmark('VXLData get_color_map')
+def vxl_get_color_map():
+    return get_map().get_color_map
+
+
+@benchmark('VXLData get_solid_mask')
+def vxl_get_solid_mask():
+    map_ = get_map()
+    return lambda: map_.get_solid_mask(40)
+
+
+@benchmark('VXLData set_point/remove_point', ops=NODES)
+def vxl_set_point():
+    map_ = get_map()
+    points = [(x, y, map_.get_z(x, y) - 1) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(NODES))]
+    color = (128, 128, 128)
+
+    def run():
+        for x, y, z in points:
+            map_.set_point(x, y, z, color)
+        for x, y, z in points:
+            map_.remove_point(x, y, z)
+    return run
+
+
+@benchmark('VXLData check_node', ops=NODES)
+def vxl_check_node():
+    map_ = get_map()
+    points = []
+    while len(points) < NODES:
+        x, y = random.randrange(512), random.randrange(512)
+        z = map_.get_z(x, y)
+        # a block that is above the ground and connected to it
+        if z < 62:
+            points.append((x, y, z))
+    check_node = map_.check_node
+
+    def run():
+        for x, y, z in points:
+            check_node(x, y, z)
+    return run
+
+
+@benchmark('VXLData check_node (floating 32x32)')
+def vxl_check_node_floating():
+    map_ = get_map()
+    # a platform high up in the air, so every block of it is visited
+    for x in range(240, 272):
+        for y in range(240, 272):
+            map_.set_point(x, y, 5, (128, 128, 128))
+    return lambda: map_.check_node(256, 256, 5)
+
+
+def tower(map_, x1, y1, x2, y2, z):
+    # hollow tower with walls of one block, standing on the ground
+    for x in range(x1, x2):
+        for y in range(y1, y2):
+            if x in (x1, x2 - 1) or y in (y1, y2 - 1):
+                map_.set_column_fast(x, y, z, 63, z, 0x808080)
+
+
+def bridge_map(index):
+    # two towers joined by a bridge high above the ground
+    map_ = VXLData()
+    for y in range(255, 258):
+        for x in (50, 451):
+            map_.set_column_fast(x, y, 10, 63, 10, 0x808080)
+        for x in range(51, 451):
+            map_.set_point(x, y, 10, (128, 128, 128))
+    map_.enable_connectivity_index(index)
+    return map_
+
+
+@benchmark('VXLData check_node (tower 32x32x60)')
+def vxl_check_node_tower():
+    map_ = VXLData()
+    tower(map_, 240, 240, 272, 272, 2)
+    # a roof, checked from the middle so the walls are far away
+    for x in range(240, 272):
+        for y in range(240, 272):
+            map_.set_point(x, y, 1, (128, 128, 128))
+    return lambda: map_.check_node(256, 256, 1)
+
+
+@benchmark('VXLData check_node (floating tower 32x32x60)')
+def vxl_check_node_floating_tower():
+    map_ = VXLData()
+    tower(map_, 240, 240, 272, 272, 2)
+    # cut off from the ground, so every block of it is visited
+    for x in range(240, 272):
+        for y in range(240, 272):
+            map_.remove_point(x, y, 61)
+    return lambda: map_.check_node(240, 240, 2)
+
+
+@benchmark('VXLData check_node (bridge 400x3)')
+def vxl_check_node_bridge():
+    map_ = bridge_map(False)
+    return lambda: map_.check_node(250, 256, 10)
+
+
+def destroy_and_rebuild(map_, points):
+    color = (128, 128, 128)
+
+    def run():
+        for x, y, z in points:
+            map_.destroy_point(x, y, z)
+            map_.set_point(x, y, z, color)
+    return run
+
+
+@benchmark('VXLData destroy_point (bridge 400x3)', ops=NODES)
+def vxl_destroy_bridge():
+    points = [(random.randrange(100, 400), random.randrange(255, 258), 10)
+              for _ in range(NODES)]
+    return destroy_and_rebuild(bridge_map(False), points)
+
+
+@benchmark('VXLData destroy_point (bridge 400x3, connectivity index)',
+           ops=NODES)
+def vxl_destroy_bridge_index():
+    points = [(random.randrange(100, 400), random.randrange(255, 258), 10)
+              for _ in range(NODES)]
+    return destroy_and_rebuild(bridge_map(True), points)
+
+
+def tower_points():
+    # blocks in the walls, above and below the cut
+    points = []
+    while len(points) < NODES:
+        x, y = random.randrange(240, 272), random.choice((240, 271))
+        points.append((x, y, random.randrange(3, 60)))
+    return points
+
+
+@benchmark('VXLData destroy_point (tower 32x32x60)', ops=NODES)
+def vxl_destroy_tower():
+    map_ = VXLData()
+    tower(map_, 240, 240, 272, 272, 2)
+    return destroy_and_rebuild(map_, tower_points())
+
+
+@benchmark('VXLData destroy_point (tower 32x32x60, connectivity index)',
+           ops=NODES)
+def vxl_destroy_tower_index():
+    map_ = VXLData()
+    tower(map_, 240, 240, 272, 272, 2)
+    map_.enable_connectivity_index()
+    return destroy_and_rebuild(map_, tower_points())
+
+
+@benchmark('VXLData destroy_point (terrain)', ops=NODES)
+def vxl_destroy_terrain():
+    map_ = get_map()
+    points = [(x, y, map_.get_z(x, y)) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(NODES))]
+    return destroy_and_rebuild(map_, points)
+
+
+@benchmark('VXLData destroy_point (terrain, connectivity index)', ops=NODES)
+def vxl_destroy_terrain_index():
+    map_ = get_map()
+    map_.enable_connectivity_index()
+    points = [(x, y, map_.get_z(x, y)) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(NODES))]
+    return destroy_and_rebuild(map_, points)
+
+
+@benchmark('VXLData get_generator_data (whole map)')
+def vxl_generator():
+    map_ = get_map()
+
+    def run():
+        generator = map_.get_generator()
+        while generator.get_data(CHUNK_SIZE) is not None:
+            pass
+    return run
+
+
+@benchmark('ProgressiveMapGenerator (whole map)')
+def map_generator():
+    map_ = get_map()
+
+    def run():
+        generator = ProgressiveMapGenerator(map_)
+        while generator.data_left():
+            generator.read(CHUNK_SIZE)
+    return run
+
+
+@benchmark('MapCache get_data (unchanged)')
+def map_cache_hit():
+    cache = MapCache(get_map())
+    cache.get_data()
+    return cache.get_data
+
+
+@benchmark('MapCache get_data (10 blocks built)')
+def map_cache_edits():
+    map_ = get_map()
+    cache = MapCache(map_)
+    cache.get_data()
+    points = [(x, y, map_.get_z(x, y) - 1) for x, y in
+              ((random.randrange(512), random.randrange(512))
+               for _ in range(10))]
+    color = (128, 128, 128)
+
+    def run():
+        for x, y, z in points:
+            map_.set_point(x, y, z, color)
+        cache.get_data()
+    return run
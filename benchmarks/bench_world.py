@@ -0,0 +1,93 @@
+"""
+World simulation, run by run.py.
+"""
+
+import random
+
+from pyspades import world
+from pyspades.common import Vertex3
+from pyspades.constants import TORSO, UPDATE_FREQUENCY, HIT_TOLERANCE
+
+from suite import benchmark, get_map
+
+PLAYERS = 32
+GRENADES = 8
+# ticks simulated per call of the World.update benchmark
+TICKS = 60
+LINES = 100
+
+
+def surface_point(map_):
+    x, y = random.randrange(16, 496), random.randrange(16, 496)
+    return x + 0.5, y + 0.5, map_.get_z(x, y) - 2.0
+
+
+@benchmark('World.update ({} characters, {} grenades)'.format(
+    PLAYERS, GRENADES), ops=TICKS)
+def world_update():
+    map_ = get_map()
+    players = []
+    for slot in range(PLAYERS):
+        keys = [random.random() < 0.5 for _ in range(4)]
+        angle = random.uniform(-1.0, 1.0)
+        players.append((surface_point(map_), (angle, 1.0 - abs(angle), 0.0),
+                        keys, slot))
+    grenades = [(surface_point(map_),
+                 (random.uniform(-1.0, 1.0), random.uniform(-1.0, 1.0), -0.5))
+                for _ in range(GRENADES)]
+
+    def fall(damage):
+        pass
+
+    def run():
+        # start from the same state every time, so every call simulates the
+        # same ticks
+        world_ = world.World()
+        world_.map = map_
+        for position, orientation, keys, slot in players:
+            character = world_.create_object(
+                world.Character, Vertex3(*position), Vertex3(*orientation),
+                fall, slot)
+            character.set_walk(*keys)
+        for position, velocity in grenades:
+            # the fuse outlasts the benchmark
+            world_.create_object(world.Grenade, TICKS, Vertex3(*position),
+                                 None, Vertex3(*velocity), None)
+        for _ in range(TICKS):
+            world_.update(UPDATE_FREQUENCY)
+    return run
+
+
+@benchmark('cube_line', ops=LINES)
+def cube_line():
+    lines = [(random.randrange(512), random.randrange(512),
+              random.randrange(64), random.randrange(512),
+              random.randrange(512), random.randrange(64))
+             for _ in range(LINES)]
+    # the server limits block lines to 50 blocks
+    lines = [(x1, y1, z1, x1 + (x2 - x1) // 20, y1 + (y2 - y1) // 20,
+              z1 + (z2 - z1) // 20) for x1, y1, z1, x2, y2, z2 in lines]
+    cube_line = world.cube_line
+
+    def run():
+        for line in lines:
+            cube_line(*line)
+    return run
+
+
+@benchmark('Character.validate_hit', ops=PLAYERS)
+def validate_hit():
+    world_ = world.World()
+    world_.map = get_map()
+    shooter = world_.create_object(world.Character, Vertex3(256, 256, 30),
+                                   Vertex3(1, 0, 0))
+    targets = [world_.create_object(
+        world.Character,
+        Vertex3(256 + random.uniform(5, 100), 256 + random.uniform(-20, 20),
+                30 + random.uniform(-5, 5)),
+        Vertex3(1, 0, 0)) for _ in range(PLAYERS)]
+
+    def run():
+        for target in targets:
+            shooter.validate_hit(target, TORSO, HIT_TOLERANCE, 3.0)
+    return run
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+"""
+usage: run.py [-h] [-k PATTERN] [--list] [--repeat REPEAT]
+              [--min-time MIN_TIME] [--cpu CPU] [--output FILE]
+              [--compare FILE] [--threshold THRESHOLD]
+
+Run the benchmarks registered by the bench_*.py modules in this directory.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -k PATTERN            only run benchmarks whose name contains PATTERN, may
+                        be given more than once
+  --list                list the benchmarks and exit
+  --repeat REPEAT, -r REPEAT
+                        number of timing runs, the best one is reported
+  --min-time MIN_TIME   minimum duration of a timing run, in seconds
+  --cpu CPU             pin the process to this CPU for less noisy results
+  --output FILE, -o FILE
+                        save the results as JSON
+  --compare FILE, -c FILE
+                        compare the results with a JSON file saved earlier
+  --threshold THRESHOLD
+                        relative change reported as faster or slower
+
+Typical use is to save the results of the base commit and compare the work
+tree against them::
+
+    git stash && python benchmarks/run.py -o base.json && git stash pop
+    python benchmarks/run.py -c base.json
+
+Remember to rebuild the Cython extensions in between.
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# benchmark the work tree, not an installed copy
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from suite import BENCHMARKS  # noqa: E402
+
+
+def load_modules():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(directory, 'bench_*.py'))):
+        importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+
+
+def get_git_rev():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_time(seconds):
+    for unit, scale in (('ns', 1e9), ('us', 1e6), ('ms', 1e3)):
+        if seconds * scale < 1000:
+            return '{:.1f} {}'.format(seconds * scale, unit)
+    return '{:.2f} s'.format(seconds)
+
+
+def compare(result, old, threshold):
+    change = result.best / old['best'] - 1.0
+    # changes within the noise of either run are not significant
+    noise = max(threshold, result.spread, old['spread'])
+    if change < -noise:
+        verdict = 'faster'
+    elif change > noise:
+        verdict = 'slower'
+    else:
+        verdict = ''
+    return '{:>12} {:>+7.1%} {}'.format(format_time(old['best']), change,
+                                        verdict)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the benchmarks registered by the bench_*.py modules "
+                    "in this directory.")
+    parser.add_argument("-k", dest="patterns", metavar="PATTERN",
+                        action="append",
+                        help="only run benchmarks whose name contains "
+                             "PATTERN, may be given more than once")
+    parser.add_argument("--list", action="store_true",
+                        help="list the benchmarks and exit")
+    parser.add_argument("--repeat", "-r", type=int, default=5,
+                        help="number of timing runs, the best one is reported")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="minimum duration of a timing run, in seconds")
+    parser.add_argument("--cpu", type=int,
+                        help="pin the process to this CPU for less noisy "
+                             "results")
+    parser.add_argument("--output", "-o", metavar="FILE",
+                        help="save the results as JSON")
+    parser.add_argument("--compare", "-c", metavar="FILE",
+                        help="compare the results with a JSON file saved "
+                             "earlier")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="relative change reported as faster or slower")
+    args = parser.parse_args()
+
+    load_modules()
+    benchmarks = [bench for bench in BENCHMARKS
+                  if not args.patterns or
+                  any(pattern in bench.name for pattern in args.patterns)]
+    if args.list:
+        for bench in benchmarks:
+            print(bench.name)
+        return 0
+    if not benchmarks:
+        print("no benchmarks match")
+        return 1
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+
+    width = max(len(bench.name) for bench in benchmarks)
+    results = {}
+    for bench in benchmarks:
+        result = bench.run(args.repeat, args.min_time)
+        results[bench.name] = result._asdict()
+        line = '{:<{}} {:>12} {:>6.1%}'.format(
+            bench.name, width, format_time(result.best), result.spread)
+        if bench.name in baseline:
+            line += ' ' + compare(result, baseline[bench.name],
+                                  args.threshold)
+        print(line, flush=True)
+
+    if args.output:
+        meta = {
+            'revision': get_git_rev(),
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+            'min_time': args.min_time,
+        }
+        with open(args.output, 'w') as fp:
+            json.dump({'meta': meta, 'results': results}, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+The benchmark registry used by ``run.py``.
+
+A benchmark is a setup function decorated with :func:`benchmark`. The setup
+function builds whatever state it needs and returns a callable without
+arguments, which is then timed::
+
+    @benchmark('cube_line', ops=100)
+    def cube_line_short():
+        def run():
+            for _ in range(100):
+                world.cube_line(0, 0, 0, 10, 10, 10)
+        return run
+
+``ops`` is the number of operations one call performs, so results are
+reported per operation. Setup functions should be deterministic (use fixed
+seeds) so results can be compared across commits.
+"""
+
+import random
+import statistics
+import timeit
+from collections import namedtuple
+
+BENCHMARKS = []
+
+MAP_SEED = 1
+
+Result = namedtuple('Result', 'name best median spread number repeat')
+
+
+class Benchmark:
+    def __init__(self, name, setup, ops=1):
+        self.name = name
+        self.setup = setup
+        self.ops = ops
+
+    def run(self, repeat=5, min_time=0.2):
+        """time the benchmark and return a :class:`Result` with times per
+        operation, in seconds
+
+        Every timing run lasts at least ``min_time`` seconds. The best run is
+        the most stable statistic, ``spread`` is the relative difference
+        between the median and the best run.
+        """
+        # the setup may use random numbers, keep them the same every run
+        random.seed(0)
+        func = self.setup()
+        func()  # warm up caches and lazy initialisation
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        if elapsed < min_time:
+            number = max(int(number * min_time / elapsed), number)
+        times = [t / number / self.ops for t in timer.repeat(repeat, number)]
+        best = min(times)
+        median = statistics.median(times)
+        return Result(self.name, best, median, median / best - 1.0, number,
+                      repeat)
+
+
+def benchmark(name, ops=1):
+    """register a setup function as the benchmark ``name``"""
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup, ops))
+        return setup
+    return decorator
+
+
+_map_data = None
+
+
+def get_map():
+    """return a copy of the map used by all benchmarks"""
+    global _map_data
+    if _map_data is None:
+        from pyspades.mapmaker import generate_classic
+        _map_data = generate_classic(MAP_SEED)
+    return _map_data.copy()
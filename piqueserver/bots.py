@@ -0,0 +1,165 @@
+"""
+Load testing with headless bots, see :mod:`pyspades.client`.
+
+``piqueserver-bots`` spreads the requested number of bots over several
+processes, lets them play against a server for a while and then reports the
+bandwidth they used and how fast they received the map. If the server runs
+its status server, its tick statistics are fetched before and after the run
+and reported as well.
+"""
+
+import argparse
+import json
+import multiprocessing
+import queue
+import sys
+import urllib.request
+
+PROCESS_TIMEOUT = 30
+
+
+def run_swarm(host, port, count, duration, name, options, results):
+    """run ``count`` bots for ``duration`` seconds in this process and put
+    their stats into ``results``"""
+    import asyncio
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install(asyncio.get_event_loop())
+    from twisted.internet import reactor
+    from pyspades.client import ClientProtocol
+
+    protocol = ClientProtocol(host, port, count, name,
+                              connect_interval=options['connect_interval'])
+    protocol.movement = options['movement']
+    protocol.shooting = options['shooting']
+    protocol.building = options['building']
+    reactor.callLater(duration, reactor.stop)
+    reactor.run()
+    results.put(protocol.get_stats())
+
+
+def fetch_status(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read().decode())
+    except (OSError, ValueError) as e:
+        print('could not fetch {}: {}'.format(url, e))
+        return None
+
+
+def print_server_stats(before, after):
+    before = before['network']
+    after = after['network']
+    ticks = after['service']['ticks'] - before['service']['ticks']
+    if not ticks:
+        return
+    service_time = after['service']['time'] - before['service']['time']
+    simulation_time = after['simulationTime'] - before['simulationTime']
+    print('server ticks: {}'.format(ticks))
+    print('server event handling: {:.3f}ms/tick'.format(
+        service_time / ticks * 1000))
+    print('server simulation: {:.3f}ms/tick'.format(
+        simulation_time / ticks * 1000))
+    print('server ticks over event budget: {}'.format(
+        after['service']['deferred'] - before['service']['deferred']))
+    print('server event queue depth: max {}'.format(
+        after['service']['maxQueueDepth']))
+
+
+def print_stats(stats, duration):
+    print('bots: {}, joined: {}'.format(stats['bots'], stats['joined']))
+    print('sent: {} packets, {:.1f} KiB/s'.format(
+        stats['packets_sent'], stats['bytes_sent'] / duration / 1024))
+    print('received: {} packets, {:.1f} KiB/s'.format(
+        stats['packets_received'], stats['bytes_received'] / duration / 1024))
+    if stats['maps']:
+        print('maps received: {}, {:.1f} KiB/s per bot, {:.2f}s on '
+              'average'.format(
+                  stats['maps'],
+                  stats['map_bytes'] / stats['map_time'] / 1024,
+                  stats['map_time'] / stats['maps']))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        prog='piqueserver-bots',
+        description='Connect headless bots to a server to measure its '
+        'performance under load.')
+    arg_parser.add_argument('host', nargs='?', default='127.0.0.1')
+    arg_parser.add_argument('port', nargs='?', type=int, default=32887)
+    arg_parser.add_argument(
+        '-n', '--bots', type=int, default=32,
+        help='number of bots - default is 32')
+    arg_parser.add_argument(
+        '-p', '--processes', type=int, default=1,
+        help='number of processes to spread the bots over - default is 1')
+    arg_parser.add_argument(
+        '-t', '--duration', type=float, default=60.0,
+        help='how long the bots play, in seconds - default is 60')
+    arg_parser.add_argument(
+        '--name', default='Bot',
+        help='bot name, the server makes it unique - default is "Bot"')
+    arg_parser.add_argument(
+        '--connect-interval', type=float, default=0.05,
+        help='seconds between connection attempts in each process - '
+        'default is 0.05')
+    arg_parser.add_argument(
+        '--status-url',
+        help='JSON url of the status server, e.g. '
+        'http://127.0.0.1:32886/json')
+    arg_parser.add_argument(
+        '--no-movement', dest='movement', action='store_false')
+    arg_parser.add_argument(
+        '--no-shooting', dest='shooting', action='store_false')
+    arg_parser.add_argument(
+        '--no-building', dest='building', action='store_false')
+    args = arg_parser.parse_args()
+
+    if args.bots < 1 or args.processes < 1:
+        arg_parser.error('need at least one bot and process')
+    processes = min(args.processes, args.bots)
+    options = {
+        'connect_interval': args.connect_interval,
+        'movement': args.movement,
+        'shooting': args.shooting,
+        'building': args.building,
+    }
+
+    before = fetch_status(args.status_url) if args.status_url else None
+
+    # every process installs its own reactor
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = []
+    for index in range(processes):
+        count = args.bots // processes + (index < args.bots % processes)
+        worker = context.Process(
+            target=run_swarm,
+            args=(args.host, args.port, count, args.duration, args.name,
+                  options, results))
+        worker.start()
+        workers.append(worker)
+
+    stats = {}
+    for _ in workers:
+        try:
+            result = results.get(timeout=args.duration + PROCESS_TIMEOUT)
+        except queue.Empty:
+            print('a bot process did not report back')
+            continue
+        for key, value in result.items():
+            stats[key] = stats.get(key, 0) + value
+    for worker in workers:
+        worker.join()
+
+    if not stats:
+        return 1
+    print_stats(stats, args.duration)
+    if before is not None:
+        after = fetch_status(args.status_url)
+        if after is not None:
+            print_server_stats(before, after)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
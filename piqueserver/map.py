@@ -16,19 +16,26 @@
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hashlib
 import importlib
 import math
+import mmap
 import random
+import threading
 import time
-from typing import List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
 
 from twisted.logger import Logger
 
+from pyspades import vxl
 from pyspades.vxl import VXLData
 from piqueserver.config import config
 
 log = Logger()
 
+map_cache_option = config.option('map_cache', default=True)
+
 
 class MapNotFound(Exception):
 
@@ -60,6 +67,112 @@ def check_rotation(maps: List[Union[str, 'RotationInfo']], load_dir:
     return infos
 
 
+def get_map_cache_dir() -> str:
+    return os.path.join(config.config_dir, 'cache', 'maps')
+
+
+def get_cache_filename(data, cache_dir: str) -> str:
+    """
+    Returns the file the map cache in cache_dir keeps the map with the VXL
+    data in, which is named after the hash of the data.
+    """
+    return os.path.join(cache_dir, hashlib.sha1(data).hexdigest() + '.vxlc')
+
+
+def save_cache_file(map_data: VXLData, cache_filename: str) -> None:
+    cache_dir = os.path.dirname(cache_filename)
+    os.makedirs(cache_dir, exist_ok=True)
+    # written to a temporary file first, so that servers loading the map at
+    # the same time never see half a file
+    temp_filename = '{}.{}.{}.tmp'.format(cache_filename, os.getpid(),
+                                          threading.get_ident())
+    try:
+        with open(temp_filename, 'wb') as fp:
+            fp.write(map_data.get_cache_data())
+        os.replace(temp_filename, cache_filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def load_map_file(filename: str, cache_dir: Optional[str] = None) -> VXLData:
+    """
+    Loads a VXL file. With a cache_dir, the map is loaded from the map cache
+    in it if it is there, and saved to it after it was parsed otherwise.
+    """
+    with open(filename, 'rb') as fp:
+        if cache_dir is None:
+            return VXLData(fp)
+        data = vxl.map_file(fp)
+    try:
+        cache_filename = get_cache_filename(data, cache_dir)
+        try:
+            with open(cache_filename, 'rb') as fp:
+                return vxl.load_cache(fp)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warn("Ignoring map cache file {filename}: {exception!r}",
+                     filename=cache_filename, exception=e)
+        map_data = VXLData()
+        map_data.load_vxl(data)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    try:
+        save_cache_file(map_data, cache_filename)
+    except OSError as e:
+        log.warn("Could not save map cache file {filename}: {exception!r}",
+                 filename=cache_filename, exception=e)
+    return map_data
+
+
+def cache_map_file(filename: str, cache_dir: str) -> bool:
+    """
+    Saves a VXL file to the map cache in cache_dir. Returns False if it was
+    in the cache already.
+    """
+    with open(filename, 'rb') as fp:
+        data = vxl.map_file(fp)
+    try:
+        cache_filename = get_cache_filename(data, cache_dir)
+        if os.path.isfile(cache_filename):
+            return False
+        map_data = VXLData()
+        map_data.load_vxl(data)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    save_cache_file(map_data, cache_filename)
+    return True
+
+
+def warm_map_cache(load_dir: str, cache_dir: str,
+                   threads: Optional[int] = None
+                   ) -> Dict[str, Union[bool, Exception]]:
+    """
+    Saves every VXL file in load_dir to the map cache in cache_dir, parsing
+    several at a time. Maps are parsed without holding the GIL, so threads
+    are enough for that.
+
+    Returns the result of cache_map_file, or the exception it raised, for
+    the name of each map.
+    """
+    names = sorted(os.path.splitext(name)[0] for name in os.listdir(load_dir)
+                   if name.endswith('.vxl'))
+
+    def cache(name):
+        try:
+            return cache_map_file(os.path.join(load_dir, name + '.vxl'),
+                                  cache_dir)
+        except (OSError, ValueError) as e:
+            return e
+
+    with ThreadPoolExecutor(threads or os.cpu_count() or 1) as executor:
+        return dict(zip(names, executor.map(cache, names)))
+
+
 class Map:
     # pylint: disable=too-many-instance-attributes
 
@@ -127,12 +240,12 @@ class Map:
         return protocol, connection
 
     def load_vxl(self, rot_info):
+        filename = rot_info.get_map_filename(self.load_dir)
+        cache_dir = get_map_cache_dir() if map_cache_option.get() else None
         try:
-            fp = open(rot_info.get_map_filename(self.load_dir), 'rb')
+            self.data = load_map_file(filename, cache_dir)
         except OSError:
             raise MapNotFound(rot_info.name)
-        self.data = VXLData(fp)
-        fp.close()
 
 
 class RotationInfo:
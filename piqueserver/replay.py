@@ -0,0 +1,103 @@
+"""
+Replays a network capture (see :mod:`pyspades.capture`) against the server.
+
+The recorded events are fed to the protocol through a fake enet host, and the
+server's simulation clock runs at ``speed`` times real time. A speed of 0 runs
+it as fast as possible: every tick advances the clock by exactly one update
+interval, so a capture replays the same way every time. When the capture is
+exhausted, a summary is printed and the reactor is stopped.
+"""
+
+import asyncio
+import time
+
+from twisted.internet import reactor
+from twisted.logger import Logger
+
+from pyspades.capture import ReplayHost, read_capture
+
+log = Logger()
+
+
+class ReplayClock:
+    """simulation clock running at ``speed`` times real time, or as fast as
+    possible if ``speed`` is 0"""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.real_start = time.monotonic()
+        self.now = 0.0
+
+    def __call__(self):
+        if self.speed:
+            return (time.monotonic() - self.real_start) * self.speed
+        return self.now
+
+    def sleep(self, delay):
+        if self.speed:
+            return asyncio.sleep(max(delay, 0) / self.speed)
+        # the server only runs a world update once strictly more than one
+        # update interval has passed
+        self.now += max(delay, 0) + 1e-9
+        return asyncio.sleep(0)
+
+
+class DelayedReplayHost(ReplayHost):
+    """a ReplayHost that only starts once the server has loaded its map"""
+    offset = None
+
+    def start(self):
+        clock = self.clock
+        self.offset = clock()
+        self.clock = lambda: clock() - self.offset
+
+    def service(self, timeout=0):
+        if self.offset is None:
+            return None
+        return ReplayHost.service(self, timeout)
+
+
+def make_replay_protocol(protocol_class, path, speed=1.0):
+    """return a subclass of ``protocol_class`` that replays the capture at
+    ``path`` instead of listening on the network"""
+    with open(path, 'rb') as fp:
+        records = list(read_capture(fp))
+    clock = ReplayClock(speed)
+
+    class ReplayProtocol(protocol_class):
+        replay_done = False
+
+        def create_host(self, address):
+            return DelayedReplayHost(records, clock)
+
+        def get_time(self):
+            return clock()
+
+        def sleep(self, delay):
+            if self.host.finished and not self.replay_done:
+                self.replay_done = True
+                self.on_replay_done()
+            return clock.sleep(delay)
+
+        def _post_init(self):
+            protocol_class._post_init(self)
+            self.replay_start = time.monotonic()
+            self.replay_ticks = self.loop_count
+            self.host.start()
+
+        def on_replay_done(self):
+            elapsed = time.monotonic() - self.replay_start
+            ticks = self.loop_count - self.replay_ticks
+            stats = self.service_stats
+            print('replayed {} events ({} recorded) in {:.2f}s'.format(
+                self.host.events, len(records), elapsed))
+            print('capture length: {:.2f}s, speed: {}'.format(
+                records[-1].time if records else 0.0, speed or 'max'))
+            print('ticks: {} ({:.1f}/s)'.format(
+                ticks, ticks / elapsed if elapsed else 0.0))
+            print('event handling: {:.3f}s, simulation: {:.3f}s'.format(
+                stats.time, self.simulation_time))
+            reactor.stop()
+
+    ReplayProtocol.__name__ = 'Replay' + protocol_class.__name__
+    return ReplayProtocol
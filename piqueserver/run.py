@@ -122,6 +122,28 @@ def update_geoip(target_dir):
     return 0
 
 
+def warm_map_cache(target_dir):
+    from piqueserver.map import get_map_cache_dir, warm_map_cache
+    load_dir = os.path.join(target_dir, 'maps')
+    cache_dir = get_map_cache_dir()
+    if not os.path.isdir(load_dir):
+        print('Maps directory %s does not exist' % load_dir)
+        return 1
+
+    print('Saving the maps in %s to the map cache in %s...' %
+          (load_dir, cache_dir))
+    results = warm_map_cache(load_dir, cache_dir)
+    status = 0
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            print('%s: failed: %s' % (name, result))
+            status = 1
+        else:
+            print('%s: %s' % (name, 'cached' if result else 'already cached'))
+    print('Complete! %d maps' % len(results))
+    return status
+
+
 def main():
     # We need to install the asyncio reactor before we add any imports like
     # `twisted.internet.*` which install the default reactor.  We keep it here
@@ -180,18 +202,42 @@ def main():
         action='store_true',
         help='download the latest geoip database')
 
+    arg_parser.add_argument(
+        '--warm-map-cache',
+        action='store_true',
+        help='save every map in the maps dir to the map cache, so that they '
+        'load faster when the server switches to them')
+
     arg_parser.add_argument(
         '--version',
         action='store_true',
         help='show the version and exit')
 
+    arg_parser.add_argument(
+        '--capture',
+        metavar='FILE',
+        help='record all incoming network traffic to FILE')
+
+    arg_parser.add_argument(
+        '--replay',
+        metavar='FILE',
+        help='replay the network traffic recorded in FILE instead of '
+        'listening on the network, then exit')
+
+    arg_parser.add_argument(
+        '--replay-speed',
+        type=float,
+        default=1.0,
+        help='how fast to replay, e.g. 2 for twice as fast or 0 for as fast '
+        'as possible - default is 1')
+
     args = arg_parser.parse_args()
 
     # update the config_dir from cli args
     config.config_dir = args.config_dir
 
     # run the required tasks if args given
-    if args.copy_config or args.update_geoip:
+    if args.copy_config or args.update_geoip or args.warm_map_cache:
         if args.copy_config:
             status = copy_config()
             if status != 0:
@@ -202,6 +248,11 @@ def main():
             if status != 0:
                 sys.exit(status)
 
+        if args.warm_map_cache:
+            status = warm_map_cache(config.config_dir)
+            if status != 0:
+                sys.exit(status)
+
         return  # if we have done a task, don't run the server
 
     if args.version:
@@ -255,7 +306,8 @@ def main():
         config.update_from_dict(json.loads(args.json_parameters))
 
     from piqueserver import server
-    server.run()
+    server.run(capture=args.capture, replay=args.replay,
+               replay_speed=args.replay_speed)
 
 
 if __name__ == "__main__":
@@ -140,6 +140,15 @@ default_ban_duration = bans_config.option(
     'default_duration', default="1day", cast=cast_duration)
 speedhack_detect = config.option('speedhack_detect', True)
 rubberband_distance = config.option('rubberband_distance', default=10)
+interest_management = config.option('interest_management', default=False)
+reuse_loaders = config.option('reuse_packet_loaders', default=False)
+batch_packets = config.option('batch_reliable_packets', default=False)
+network_event_budget = config.option('network_event_budget', default=0)
+network_time_budget = config.option('network_time_budget', default=0)
+congestion_control = config.option('congestion_control', default=False)
+adaptive_network_rate = config.option('adaptive_network_rate', default=False)
+connectivity_index = config.option('connectivity_index', default=False)
+cache_map_data = config.option('cache_map_data', default=True)
 user_blocks_only = config.option('user_blocks_only', False)
 logging_profile_option = logging_config.option('profile', False)
 set_god_build = config.option('set_god_build', False)
@@ -348,6 +357,15 @@ class FeatureProtocol(ServerProtocol):
 
         self.speedhack_detect = speedhack_detect.get()
         self.rubberband_distance = rubberband_distance.get()
+        self.interest_management = interest_management.get()
+        self.reuse_loaders = reuse_loaders.get()
+        self.batch_packets = batch_packets.get()
+        self.service_event_budget = network_event_budget.get()
+        self.service_time_budget = network_time_budget.get() / 1000
+        self.congestion_control = congestion_control.get()
+        self.adaptive_network_rate = adaptive_network_rate.get()
+        self.connectivity_index = connectivity_index.get()
+        self.cache_map_data = cache_map_data.get()
         if user_blocks_only.get():
             self.user_blocks = set()
         self.set_god_build = set_god_build.get()
@@ -908,9 +926,16 @@ class FeatureProtocol(ServerProtocol):
         return self.advance_call.getTime() - self.advance_call.seconds()
 
 
-def run() -> None:
+def run(capture: Optional[str] = None, replay: Optional[str] = None,
+        replay_speed: float = 1.0) -> None:
     """
     runs the server
+
+    Arguments:
+        capture: record all network events to this file
+        replay: replay the network events in this capture file instead of
+            listening on the network
+        replay_speed: how fast to replay, 0 for as fast as possible
     """
 
     # load and apply regular scripts
@@ -931,11 +956,22 @@ def run() -> None:
 
     protocol_class.connection_class = connection_class
 
+    if replay is not None:
+        from piqueserver.replay import make_replay_protocol
+        protocol_class = make_replay_protocol(protocol_class, replay,
+                                              replay_speed)
+
     interface = network_interface.get().encode('utf-8')
 
     # instantiate the protocol class once. It will set timers and hooks to keep
     # itself running once we start the reactor
-    protocol_class(interface, config.get_dict())
+    protocol = protocol_class(interface, config.get_dict())
+
+    if capture is not None:
+        from pyspades.capture import CaptureWriter
+        protocol.capture = CaptureWriter(open(capture, 'wb'))
+        reactor.addSystemEventTrigger(
+            'after', 'shutdown', protocol.capture.close)
 
     log.debug('Checking for unregistered config items...')
     unused = config.check_unused()
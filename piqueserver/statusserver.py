@@ -69,7 +69,14 @@ def current_state(protocol):
             'latency': player.latency,
             'client': player.client_string,
             'kills': player.kills,
-            'team': player.team.name
+            'team': player.team.name,
+            'network': {
+                'congestion': player.congestion,
+                'updateRate': player.network_fps,
+                'updateInterval': player.world_update_throttle.interval,
+                'updatesSent': player.world_update_throttle.sent,
+                'updatesSkipped': player.world_update_throttle.skipped,
+            }
         }
 
         players.append(player_data)
@@ -91,7 +98,16 @@ def current_state(protocol):
         "scores": {
             "currentBlueScore": protocol.blue_team.score,
             "currentGreenScore": protocol.green_team.score,
-            "maxScore": protocol.max_score}
+            "maxScore": protocol.max_score},
+        "network": {
+            "service": protocol.service_stats.as_dict(),
+            "simulationTime": protocol.simulation_time,
+            "outbound": {
+                "queued": protocol.packets_queued,
+                "coalesced": protocol.packets_coalesced,
+                "flushed": protocol.packets_flushed},
+            "mapCache": (protocol.map_cache.get_stats()
+                         if protocol.map_cache is not None else None)}
     }
 
     return dictionary
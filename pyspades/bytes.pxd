@@ -2,9 +2,11 @@ DEF INT_ERROR = -0xFFFFFFFF >> 1
 DEF LONG_LONG_ERROR = -0xFFFFFFFFFFFFFFFF >> 1
 DEF FLOAT_ERROR = float('nan')
 
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+cdef extern from "bytes_c.h":
+    struct ByteBuffer:
+        char * data
+        size_t size, pos, capacity
+        int exports
 
 cdef class ByteReader:
     cdef char * data
@@ -12,9 +14,12 @@ cdef class ByteReader:
     cdef char * end
     cdef int start, size
     cdef object input
+    cdef Py_buffer view
+    cdef bint has_view
 
     cdef char * check_available(self, int size) except NULL
     cpdef read(self, int bytecount = ?)
+    cpdef readView(self, int bytecount = ?)
     cpdef int readByte(self, bint unsigned = ?) except INT_ERROR
     cpdef int readShort(self, bint unsigned = ?, bint big_endian = ?) \
                         except INT_ERROR
@@ -31,9 +36,9 @@ cdef class ByteReader:
     cpdef size_t tell(self)
 
 cdef class ByteWriter:
-    cdef stringstream * stream
+    cdef ByteBuffer * buf
 
-    cdef void writeSize(self, char * data, int size)
+    cdef void writeSize(self, char * data, int size) except *
     cpdef write(self, data)
     cpdef writeByte(self, int value, bint unsigned = ?)
     cpdef writeShort(self, int value, bint unsigned = ?,
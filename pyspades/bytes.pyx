@@ -31,25 +31,31 @@ cdef extern from "bytes_c.cpp":
     double read_float(char * data, int big_endian)
     char * read_string(char * data)
 
-    stringstream * create_stream()
-    void delete_stream(stringstream * stream)
-    void write_byte(stringstream * stream, char value)
-    void write_ubyte(stringstream * stream, unsigned char value)
-    void write_short(stringstream * stream, short value, int big_endian)
-    void write_ushort(stringstream * stream, unsigned short value, int big_endian)
-    void write_int(stringstream * stream, int value, int big_endian)
-    void write_uint(stringstream * stream, unsigned int value, int big_endian)
-    void write_float(stringstream * stream, double value, int big_endian)
-    void write_string(stringstream * stream, char * data, size_t size)
-    void write(stringstream * stream, char * data, size_t size)
-    void rewind_stream(stringstream * stream, int bytecount)
-    object get_stream(stringstream * stream)
-    size_t get_stream_size(stringstream * stream)
-    size_t get_stream_pos(stringstream * stream)
-
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+    ByteBuffer * create_buffer() except +
+    void delete_buffer(ByteBuffer * buf)
+    size_t get_buffer_pool_count()
+    void write_byte(ByteBuffer * buf, char value) except +
+    void write_ubyte(ByteBuffer * buf, unsigned char value) except +
+    void write_short(ByteBuffer * buf, short value, int big_endian) except +
+    void write_ushort(ByteBuffer * buf, unsigned short value,
+                      int big_endian) except +
+    void write_int(ByteBuffer * buf, int value, int big_endian) except +
+    void write_uint(ByteBuffer * buf, unsigned int value,
+                    int big_endian) except +
+    void write_float(ByteBuffer * buf, double value, int big_endian) except +
+    void write_string(ByteBuffer * buf, char * data, size_t size) except +
+    void write(ByteBuffer * buf, char * data, size_t size) except +
+    void write_padding(ByteBuffer * buf, size_t size) except +
+    void rewind_buffer(ByteBuffer * buf, int bytecount)
+    object get_buffer(ByteBuffer * buf)
+    size_t get_buffer_size(ByteBuffer * buf)
+    size_t get_buffer_pos(ByteBuffer * buf)
+
+from cpython.buffer cimport (PyBUF_FORMAT, PyBUF_SIMPLE, PyObject_GetBuffer,
+                             PyBuffer_Release)
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.string cimport memchr
+cimport cython
 
 class NoDataLeft(Exception):
     pass
@@ -59,18 +65,33 @@ DEF LONG_LONG_ERROR = -0xFFFFFFFFFFFFFFFF >> 1
 DEF FLOAT_ERROR = float('nan')
 
 cdef class ByteReader:
-    """Reads various data types from a bytes-like object"""
+    """Reads various data types from a bytes-like object
+
+    Any object supporting the buffer protocol (bytes, bytearray, memoryview,
+    mmap, ...) can be read from. The data is not copied, so the object must
+    not be resized while the reader is in use.
+    """
     def __init__(self, input_data, int start = 0, int size = -1):
+        if self.has_view:
+            PyBuffer_Release(&self.view)
+            self.has_view = False
+        PyObject_GetBuffer(input_data, &self.view, PyBUF_SIMPLE)
+        self.has_view = True
         self.input = input_data
-        self.data = input_data
-        self.data += start
+        if start < 0 or start > self.view.len:
+            start = self.view.len
+        if size == -1 or size > self.view.len - start:
+            size = self.view.len - start
+        self.data = <char *>self.view.buf + start
         self.pos = self.data
-        if size == -1:
-            size = len(input_data) - start
         self.size = size
         self.end = self.data + size
         self.start = start
 
+    def __dealloc__(self):
+        if self.has_view:
+            PyBuffer_Release(&self.view)
+
     cdef char * check_available(self, int size) except NULL:
         cdef char * data = self.pos
         if data + size > self.end:
@@ -94,6 +115,22 @@ cdef class ByteReader:
         self.pos += bytecount
         return ret
 
+    cpdef readView(self, int bytecount = -1):
+        """read a number of bytes without copying them
+
+        Arguments:
+            bytecount (int, optional): The number of bytes to read. If omitted, all bytes available are read
+
+        Returns:
+            memoryview: a view of ``bytecount`` bytes of the underlying data
+        """
+        cdef int left = self.dataLeft()
+        if bytecount == -1 or bytecount > left:
+            bytecount = left
+        cdef Py_ssize_t offset = (self.pos - self.data) + self.start
+        self.pos += bytecount
+        return memoryview(self.input)[offset:offset + bytecount]
+
     cpdef int readByte(self, bint unsigned = False) except INT_ERROR:
         """read one byte of data as integer
 
@@ -164,14 +201,24 @@ cdef class ByteReader:
         Returns:
             bytes: The value of the bytes
         """
-        value = self.pos
+        cdef Py_ssize_t left = self.end - self.pos
+        cdef Py_ssize_t limit = left
+        if size != -1 and size < left:
+            limit = size
+        # the string ends at the first NUL byte, but never extends past the
+        # field or the end of the data
+        cdef char * terminator = <char *>memchr(self.pos, 0, limit)
+        cdef Py_ssize_t length = limit
+        if terminator != NULL:
+            length = terminator - self.pos
         if size == -1:
-            size = len(value) + 1
-        if size > self.end - self.pos:
-            size = self.end - self.pos
-            value = value[:size]
+            # consume the terminating NUL too, if there is one
+            size = min(length + 1, left)
+        elif size > left:
+            size = left
+        value = PyBytes_FromStringAndSize(self.pos, length)
         self.pos += size
-        return bytes(value)
+        return value
 
     cpdef ByteReader readReader(self, int size = -1):
         cdef int left = self.dataLeft()
@@ -237,63 +284,96 @@ cdef class ByteReader:
     def __bytes__(self):
         return self.data[:self.size]
 
+def get_pool_size():
+    """return the number of released ByteWriter buffers currently waiting to
+    be reused"""
+    return get_buffer_pool_count()
+
+@cython.freelist(16)
 cdef class ByteWriter:
-    def __init__(self):
-        self.stream = create_stream()
+    """Writes various data types into a contiguous, growable buffer.
+
+    The underlying buffers are pooled, so creating a ByteWriter per packet is
+    cheap. ``bytes(writer)`` copies the data out once, and the writer also
+    supports the buffer protocol, so ``memoryview(writer)`` gives access to
+    the data without copying. The writer can not grow while such a view is
+    alive.
+    """
+    def __cinit__(self):
+        self.buf = create_buffer()
 
-    cdef void writeSize(self, char * data, int size):
-        write(self.stream, data, size)
+    cdef void writeSize(self, char * data, int size) except *:
+        write(self.buf, data, size)
 
     cpdef write(self, data):
-        write(self.stream, data, len(data))
+        write(self.buf, data, len(data))
 
     cpdef writeByte(self, int value, bint unsigned = False):
         if unsigned:
-            write_ubyte(self.stream, value)
+            write_ubyte(self.buf, value)
         else:
-            write_byte(self.stream, value)
+            write_byte(self.buf, value)
 
     cpdef writeShort(self, int value, bint unsigned = False,
                      bint big_endian = True):
         if unsigned:
-            write_ushort(self.stream, value, big_endian)
+            write_ushort(self.buf, value, big_endian)
         else:
-            write_short(self.stream, value, big_endian)
+            write_short(self.buf, value, big_endian)
 
     cpdef writeInt(self, long long value, bint unsigned = False,
                    bint big_endian = True):
         if unsigned:
-            write_uint(self.stream, value, big_endian)
+            write_uint(self.buf, value, big_endian)
         else:
-            write_int(self.stream, value, big_endian)
+            write_int(self.buf, value, big_endian)
 
     cpdef writeFloat(self, float value, bint big_endian = True):
-        write_float(self.stream, value, big_endian)
+        write_float(self.buf, value, big_endian)
 
     cpdef writeStringSize(self, char * value, int size):
-        write_string(self.stream, value, size)
+        write_string(self.buf, value, size)
 
     cpdef writeString(self, value, int size = -1):
-        write_string(self.stream, value, len(value))
+        write_string(self.buf, value, len(value))
         if size != -1:
             self.pad(size - (len(value) + 1))
 
     cpdef pad(self, int bytecount):
-        cdef int i
-        for i in range(bytecount):
-            write_ubyte(self.stream, 0)
+        if bytecount > 0:
+            write_padding(self.buf, bytecount)
 
     cpdef rewind(self, int bytecount):
-        rewind_stream(self.stream, bytecount)
+        rewind_buffer(self.buf, bytecount)
 
     cpdef size_t tell(self):
-        return get_stream_pos(self.stream)
+        return get_buffer_pos(self.buf)
 
     def __bytes__(self):
-        return get_stream(self.stream)
+        return get_buffer(self.buf)
+
+    def __getbuffer__(self, Py_buffer * view, int flags):
+        self.buf.exports += 1
+        view.buf = self.buf.data
+        view.obj = self
+        view.len = self.buf.size
+        view.readonly = 1
+        view.itemsize = 1
+        view.format = NULL
+        if flags & PyBUF_FORMAT:
+            view.format = 'B'
+        view.ndim = 1
+        view.shape = NULL
+        view.strides = NULL
+        view.suboffsets = NULL
+        view.internal = NULL
+
+    def __releasebuffer__(self, Py_buffer * view):
+        self.buf.exports -= 1
 
     def __dealloc__(self):
-        delete_stream(self.stream)
+        delete_buffer(self.buf)
+        self.buf = NULL
 
     def __len__(self):
-        return get_stream_size(self.stream)
+        return get_buffer_size(self.buf)
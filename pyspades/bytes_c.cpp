@@ -18,20 +18,89 @@
 */
 
 #include "Python.h"
-#include <iostream>
-#include <sstream>
-#include <string>
+#include <stdlib.h>
+#include <string.h>
+#include <new>
+#include <stdexcept>
+#include "bytes_c.h"
 using namespace std;
 
-stringstream *create_stream()
+// Growable contiguous write buffer. Released buffers are kept on a free list
+// so the common case of encoding a packet does not touch the allocator.
+
+#define BUFFER_INITIAL_CAPACITY 256
+#define BUFFER_POOL_SIZE 64
+// don't keep large (e.g. map data) buffers around
+#define BUFFER_POOL_MAX_CAPACITY 65536
+
+static ByteBuffer *buffer_pool[BUFFER_POOL_SIZE];
+static int buffer_pool_count = 0;
+
+ByteBuffer *create_buffer()
+{
+    ByteBuffer *buf;
+    if (buffer_pool_count > 0)
+    {
+        buf = buffer_pool[--buffer_pool_count];
+    }
+    else
+    {
+        buf = new ByteBuffer;
+        buf->data = (char *)malloc(BUFFER_INITIAL_CAPACITY);
+        if (buf->data == NULL)
+        {
+            delete buf;
+            throw bad_alloc();
+        }
+        buf->capacity = BUFFER_INITIAL_CAPACITY;
+    }
+    buf->size = buf->pos = 0;
+    buf->exports = 0;
+    return buf;
+}
+
+void delete_buffer(ByteBuffer *buf)
 {
-    stringstream *ss = new stringstream(stringstream::out | stringstream::binary);
-    return ss;
+    if (buf == NULL)
+        return;
+    if (buffer_pool_count < BUFFER_POOL_SIZE &&
+        buf->capacity <= BUFFER_POOL_MAX_CAPACITY)
+    {
+        buffer_pool[buffer_pool_count++] = buf;
+        return;
+    }
+    free(buf->data);
+    delete buf;
 }
 
-void delete_stream(stringstream *ss)
+inline size_t get_buffer_pool_count()
 {
-    delete ss;
+    return buffer_pool_count;
+}
+
+// make room for `size` bytes at the current position and advance past them
+inline char *reserve(ByteBuffer *buf, size_t size)
+{
+    size_t end = buf->pos + size;
+    if (end > buf->capacity)
+    {
+        if (buf->exports > 0)
+            throw runtime_error("cannot grow a ByteWriter while a view of it "
+                                "is exported");
+        size_t capacity = buf->capacity * 2;
+        if (capacity < end)
+            capacity = end;
+        char *data = (char *)realloc(buf->data, capacity);
+        if (data == NULL)
+            throw bad_alloc();
+        buf->data = data;
+        buf->capacity = capacity;
+    }
+    char *out = buf->data + buf->pos;
+    buf->pos = end;
+    if (end > buf->size)
+        buf->size = end;
+    return out;
 }
 
 /*
@@ -107,108 +176,116 @@ write methods
 
 // byte
 
-inline void write_byte(stringstream *ss, int8_t value)
+inline void write_byte(ByteBuffer *buf, int8_t value)
 {
-    ss->put(value);
+    *reserve(buf, 1) = value;
 }
 
-inline void write_ubyte(stringstream *ss, uint8_t value)
+inline void write_ubyte(ByteBuffer *buf, uint8_t value)
 {
-    ss->put((char)value);
+    *reserve(buf, 1) = (char)value;
 }
 
 // short
 
-inline void write_short(stringstream *ss, int16_t value, int big_endian)
+inline void write_short(ByteBuffer *buf, int16_t value, int big_endian)
 {
+    char *out = reserve(buf, 2);
     if (big_endian)
     {
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 8);
+        out[1] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
     }
 }
 
-inline void write_ushort(stringstream *ss, uint16_t value,
+inline void write_ushort(ByteBuffer *buf, uint16_t value,
                          int big_endian)
 {
-    write_short(ss, (short)value, big_endian);
+    write_short(buf, (short)value, big_endian);
 }
 
 // int
 
-inline void write_int(stringstream *ss, int32_t value, int big_endian)
+inline void write_int(ByteBuffer *buf, int32_t value, int big_endian)
 {
+    char *out = reserve(buf, 4);
     if (big_endian)
     {
-        ss->put((char)(value >> 24));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 24);
+        out[1] = (char)(value >> 16);
+        out[2] = (char)(value >> 8);
+        out[3] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 24));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
+        out[2] = (char)(value >> 16);
+        out[3] = (char)(value >> 24);
     }
 }
 
-inline void write_uint(stringstream *ss, uint32_t value,
+inline void write_uint(ByteBuffer *buf, uint32_t value,
                        int big_endian)
 {
-    write_int(ss, (int)value, big_endian);
+    write_int(buf, (int)value, big_endian);
 }
 
 // float
 
-inline void write_float(stringstream *ss, double value, int big_endian)
+inline void write_float(ByteBuffer *buf, double value, int big_endian)
 {
-    char out[4];
+    char *out = reserve(buf, 4);
     #if (PY_MAJOR_VERSION >= 3 && PY_MINOR_VERSION >= 11)
-        PyFloat_Pack4(value, (char *)&out, !big_endian);
+        PyFloat_Pack4(value, out, !big_endian);
     #else
-        _PyFloat_Pack4(value, (unsigned char *)&out, !big_endian);
+        _PyFloat_Pack4(value, (unsigned char *)out, !big_endian);
     #endif
-    ss->write(out, 4);
 }
 
-inline void write_string(stringstream *ss, char *data, size_t size)
+inline void write_string(ByteBuffer *buf, char *data, size_t size)
 {
-    ss->write(data, size);
-    ss->put(0);
+    char *out = reserve(buf, size + 1);
+    memcpy(out, data, size);
+    out[size] = 0;
 }
 
-inline void write(stringstream *ss, char *data, size_t size)
+inline void write(ByteBuffer *buf, char *data, size_t size)
 {
-    ss->write(data, size);
+    memcpy(reserve(buf, size), data, size);
 }
 
-inline void rewind_stream(stringstream *ss, int bytes)
+inline void write_padding(ByteBuffer *buf, size_t size)
 {
-    ss->seekp(-bytes, stringstream::cur);
+    memset(reserve(buf, size), 0, size);
+}
+
+inline void rewind_buffer(ByteBuffer *buf, int bytes)
+{
+    if (bytes > 0 && (size_t)bytes > buf->pos)
+        buf->pos = 0;
+    else
+        buf->pos -= bytes;
+    if (buf->pos > buf->size)
+        buf->pos = buf->size;
 }
 
-inline size_t get_stream_size(stringstream *ss)
+inline size_t get_buffer_size(ByteBuffer *buf)
 {
-    return ss->str().length();
+    return buf->size;
 }
 
-inline size_t get_stream_pos(stringstream *ss)
+inline size_t get_buffer_pos(ByteBuffer *buf)
 {
-    streampos pos = ss->tellp();
-    if (pos == (streampos)-1)
-        return 0;
-    return pos;
+    return buf->pos;
 }
 
-inline PyObject *get_stream(stringstream *ss)
+inline PyObject *get_buffer(ByteBuffer *buf)
 {
-    const string tmp = ss->str();
-    return PyBytes_FromStringAndSize(tmp.c_str(), tmp.length());
+    return PyBytes_FromStringAndSize(buf->data, buf->size);
 }
@@ -0,0 +1,15 @@
+#ifndef BYTES_C_H
+#define BYTES_C_H
+
+#include <stddef.h>
+
+struct ByteBuffer
+{
+    char *data;
+    size_t size;     // bytes written so far (high-water mark)
+    size_t pos;      // current write position
+    size_t capacity;
+    int exports;     // number of active buffer protocol views
+};
+
+#endif /* BYTES_C_H */
@@ -0,0 +1,234 @@
+# This file is part of pyspades.
+
+# pyspades is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pyspades is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Recording and replaying inbound network traffic.
+
+A capture file starts with :data:`MAGIC`, followed by one record per enet
+event. Each record is a :data:`RECORD` header (time since the start of the
+capture, peer id, event type, channel, event data and payload length)
+followed by the payload: the packet data for received packets, and the port
+and host of the peer for connects.
+
+:class:`ReplayHost` stands in for an ``enet.Host`` and hands the recorded
+events back out on a clock of your choosing, see
+:mod:`piqueserver.replay`.
+"""
+
+import struct
+import time
+from collections import namedtuple
+
+import enet
+
+MAGIC = b'PSCAP\x01'
+RECORD = struct.Struct('<dHBBII')
+ADDRESS = struct.Struct('<H')
+
+CaptureRecord = namedtuple(
+    'CaptureRecord', 'time peer_id type channel data payload')
+
+
+class CaptureWriter:
+    """writes enet events to a capture file
+
+    Arguments:
+        fp: a file object opened for binary writing
+        clock: time source, defaults to :func:`time.monotonic`
+    """
+
+    def __init__(self, fp, clock=time.monotonic):
+        self.fp = fp
+        self.clock = clock
+        self.start = clock()
+        self.count = 0
+        fp.write(MAGIC)
+
+    def write(self, peer_id, event_type, channel=0, data=0, payload=b''):
+        self.fp.write(RECORD.pack(self.clock() - self.start, peer_id,
+                                  event_type, channel, data, len(payload)))
+        self.fp.write(payload)
+        self.count += 1
+
+    def write_event(self, event):
+        """record an event returned by ``enet.Host.service``"""
+        event_type = event.type
+        peer = event.peer
+        if event_type == enet.EVENT_TYPE_RECEIVE:
+            payload = event.packet.data
+        elif event_type == enet.EVENT_TYPE_CONNECT:
+            address = peer.address
+            payload = ADDRESS.pack(address.port) + address.host.encode()
+        else:
+            payload = b''
+        self.write(peer.incomingPeerID, event_type, event.channelID,
+                   event.data, payload)
+
+    def close(self):
+        self.fp.close()
+
+
+def read_capture(fp):
+    """yield the :class:`CaptureRecord` s in a capture file"""
+    if fp.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a capture file')
+    while True:
+        header = fp.read(RECORD.size)
+        if not header:
+            return
+        if len(header) != RECORD.size:
+            raise ValueError('truncated capture file')
+        timestamp, peer_id, event_type, channel, data, size = \
+            RECORD.unpack(header)
+        payload = fp.read(size)
+        if len(payload) != size:
+            raise ValueError('truncated capture file')
+        yield CaptureRecord(timestamp, peer_id, event_type, channel, data,
+                            payload)
+
+
+class FakeAddress:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+
+
+class FakePacket:
+    def __init__(self, data, flags=0):
+        self.data = data
+        self.flags = flags
+
+    @property
+    def dataLength(self):
+        return len(self.data)
+
+
+class FakePeer:
+    """a peer with the attributes the server reads from ``enet.Peer``
+
+    Everything sent to it is counted and dropped.
+    """
+    reliableDataInTransit = 0
+    roundTripTime = 50
+    lowestRoundTripTime = 50
+    packetLoss = 0
+    packetThrottle = 32
+
+    def __init__(self, peer_id, address=None, event_data=0):
+        self.incomingPeerID = peer_id
+        self.address = address or FakeAddress()
+        self.eventData = event_data
+        self.connected = True
+        self.packets_sent = 0
+        self.bytes_sent = 0
+
+    @property
+    def ping(self):
+        return self.roundTripTime
+
+    def send(self, channel, packet):
+        self.packets_sent += 1
+        self.bytes_sent += len(packet.data)
+        return 0
+
+    def disconnect(self, data=0):
+        self.connected = False
+
+    disconnect_now = disconnect_later = disconnect
+
+    def reset(self):
+        self.connected = False
+
+
+class FakeEvent:
+    def __init__(self, event_type, peer, channel=0, data=0, packet=None):
+        self.type = event_type
+        self.peer = peer
+        self.channelID = channel
+        self.data = data
+        self.packet = packet
+
+
+class ReplayHost:
+    """replays a capture in place of an ``enet.Host``
+
+    Arguments:
+        records: the :class:`CaptureRecord` s to replay, in order
+        clock: returns the time since the start of the replay, in the same
+            timescale as the capture
+    """
+    intercept = None
+
+    def __init__(self, records, clock):
+        self.records = list(records)
+        self.clock = clock
+        self.index = 0
+        self.peers = {}
+        self.events = 0
+
+    @property
+    def finished(self):
+        return self.index >= len(self.records)
+
+    def service(self, timeout=0):
+        now = self.clock()
+        while not self.finished:
+            record = self.records[self.index]
+            if record.time > now:
+                return None
+            self.index += 1
+            event = self.make_event(record)
+            if event is not None:
+                self.events += 1
+                return event
+        return None
+
+    def check_events(self):
+        # the events that are due stand in for the ones enet has received
+        # but not dispatched yet
+        return self.service()
+
+    def make_event(self, record):
+        if record.type == enet.EVENT_TYPE_CONNECT:
+            port, = ADDRESS.unpack_from(record.payload)
+            host = record.payload[ADDRESS.size:].decode()
+            peer = FakePeer(record.peer_id, FakeAddress(host, port),
+                            record.data)
+            self.peers[record.peer_id] = peer
+            return FakeEvent(record.type, peer, record.channel, record.data)
+        peer = self.peers.get(record.peer_id)
+        if peer is None or not peer.connected:
+            # the server dropped this peer earlier than in the capture
+            return None
+        if record.type == enet.EVENT_TYPE_DISCONNECT:
+            del self.peers[record.peer_id]
+            peer.connected = False
+            return FakeEvent(record.type, peer, record.channel, record.data)
+        return FakeEvent(record.type, peer, record.channel, record.data,
+                         FakePacket(record.payload))
+
+    def connect(self, address, channel_count, data):
+        # outgoing connections (e.g. to the master server) never connect
+        return FakePeer(0xFFFF, address, data)
+
+    def compress_with_range_coder(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def broadcast(self, channel, packet):
+        for peer in self.peers.values():
+            peer.send(channel, packet)
@@ -291,13 +291,13 @@ void genland(unsigned int seed, MapData *map)
             height = buf[k].a;
             for (z = 63; z > height; z--)
             {
-                map->geometry[get_pos(x, y, z)] = true;
+                map->geometry.set(get_pos(x, y, z));
             }
-            map->geometry[get_pos(x, y, z)] = true;
+            map->geometry.set(get_pos(x, y, z));
             lowest_z = get_lowest_height(x, y) + 1;
             for (; z < lowest_z; z++)
             {
-                map->colors[get_pos(x, y, z)] = ((int *)&buf[k])[0];
+                map->colors.set(get_pos(x, y, z), ((int *)&buf[k])[0]);
             }
         }
     }
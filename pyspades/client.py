@@ -0,0 +1,358 @@
+# This file is part of pyspades.
+
+# pyspades is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pyspades is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A headless client, used to put load on a server without real players.
+
+A :class:`ClientProtocol` connects any number of :class:`ClientConnection` s
+to a server. Each of them answers the handshake, downloads the map, joins a
+team and then walks around, shoots and builds at random. Movement is
+simulated locally like a real client does, with one :class:`World` shared by
+all bots of a protocol.
+"""
+
+import asyncio
+import io
+import math
+import random
+import time
+import zlib
+
+import enet
+from twisted.logger import Logger
+
+from pyspades import contained as loaders
+from pyspades import world
+from pyspades.bytes import ByteReader, ByteWriter
+from pyspades.common import Vertex3
+from pyspades.constants import (
+    GAME_VERSION, UPDATE_FREQUENCY, RIFLE_WEAPON, BLOCK_TOOL, WEAPON_TOOL,
+    BUILD_BLOCK, DESTROY_BLOCK, MAX_BLOCK_DISTANCE)
+from pyspades.packet import load_server_packet
+from pyspades.protocol import BaseConnection, BaseProtocol
+from pyspades.vxl import VXLData
+
+log = Logger()
+
+# how often bots send their orientation and position, in seconds
+ORIENTATION_INTERVAL = 0.1
+POSITION_INTERVAL = 1.0
+# how long bots keep walking in one direction, in seconds
+MIN_WALK_TIME, MAX_WALK_TIME = 0.5, 3.0
+SHOT_INTERVAL = 0.5
+BUILD_INTERVAL = 5.0
+
+
+class ClientConnection(BaseConnection):
+    """a bot connected to a server"""
+    player_id = None
+    team = 0
+    weapon = RIFLE_WEAPON
+    world_object = None
+    joined = None
+    map_start = None
+    map_time = None
+    map_size = 0
+
+    def __init__(self, protocol, peer):
+        BaseConnection.__init__(self, protocol, peer)
+        self.name = protocol.name
+        self.team = random.randint(0, 1)
+        self.packets_received = self.bytes_received = 0
+        self.packets_sent = self.bytes_sent = 0
+        self.map_received = 0
+        self.map_data = None
+        self.map_checksum = 0
+        self.next_walk = self.next_shot = self.next_build = 0.0
+        self.last_orientation = self.last_position = 0.0
+        self.shooting = False
+
+    # network
+
+    def send_data(self, data, reliable=True):
+        if self.disconnected:
+            return
+        if reliable:
+            flags = enet.PACKET_FLAG_RELIABLE
+        else:
+            flags = enet.PACKET_FLAG_UNSEQUENCED
+        self.peer.send(0, enet.Packet(bytes(data), flags))
+        self.packets_sent += 1
+        self.bytes_sent += len(data)
+
+    def send_contained(self, contained, sequence=False):
+        writer = ByteWriter()
+        contained.write(writer)
+        self.send_data(writer, not sequence)
+
+    def loader_received(self, packet):
+        data = packet.data
+        self.packets_received += 1
+        self.bytes_received += len(data)
+        contained = load_server_packet(ByteReader(data))
+        if contained is None:
+            return
+        handler = self.handlers.get(contained.id)
+        if handler is not None:
+            handler(self, contained)
+
+    def on_connect(self):
+        log.debug('{name} connected', name=self.name)
+
+    def on_disconnect(self):
+        self.disconnected = True
+        self.remove_world_object()
+        log.debug('{name} disconnected', name=self.name)
+
+    # packet handlers
+
+    def on_handshake(self, contained):
+        handshake_return = loaders.HandShakeReturn()
+        handshake_return.success = True
+        self.send_contained(handshake_return)
+
+    def on_version_request(self, contained):
+        version_response = loaders.VersionResponse()
+        version_response.client = 'p'
+        version_response.version = (1, 0, 0)
+        version_response.os_info = 'pyspades bot'
+        self.send_contained(version_response)
+
+    def on_map_start(self, contained):
+        self.map_start = time.monotonic()
+        self.map_size = contained.size
+        self.map_received = 0
+        self.map_data = []
+        self.map_checksum = 0
+
+    def on_map_chunk(self, contained):
+        if self.map_data is None:
+            return
+        self.map_received += len(contained.data)
+        self.map_data.append(contained.data)
+        self.map_checksum = zlib.crc32(contained.data, self.map_checksum)
+
+    def on_state_data(self, contained):
+        # the state is sent once the map transfer has completed. The bots
+        # share one map, which is only decoded again if the map data is not
+        # the same as the data it was decoded from.
+        self.map_time = time.monotonic() - self.map_start
+        checksum = (self.map_received, self.map_checksum)
+        if (self.map_data is not None and
+                checksum != self.protocol.map_checksum):
+            data = zlib.decompress(b''.join(self.map_data))
+            self.protocol.set_map(VXLData(io.BytesIO(data)))
+            self.protocol.map_checksum = checksum
+        self.map_data = None
+        self.player_id = contained.player_id
+        existing_player = loaders.ExistingPlayer()
+        existing_player.player_id = self.player_id
+        existing_player.team = self.team
+        existing_player.weapon = self.weapon
+        existing_player.tool = WEAPON_TOOL
+        existing_player.kills = 0
+        existing_player.color = 0x707070
+        existing_player.name = self.name
+        self.send_contained(existing_player)
+        self.joined = time.monotonic()
+
+    def on_create_player(self, contained):
+        if contained.player_id != self.player_id:
+            return
+        self.remove_world_object()
+        self.world_object = self.protocol.world.create_object(
+            world.Character, Vertex3(contained.x, contained.y, contained.z),
+            Vertex3(1.0, 0.0, 0.0))
+
+    def on_position(self, contained):
+        # the server corrects our position
+        if self.world_object is not None:
+            self.world_object.set_position(contained.x, contained.y,
+                                           contained.z)
+
+    def on_kill(self, contained):
+        if contained.player_id == self.player_id:
+            self.remove_world_object()
+
+    handlers = {
+        loaders.HandShakeInit.id: on_handshake,
+        loaders.VersionRequest.id: on_version_request,
+        loaders.MapStart.id: on_map_start,
+        loaders.MapChunk.id: on_map_chunk,
+        loaders.StateData.id: on_state_data,
+        loaders.CreatePlayer.id: on_create_player,
+        loaders.PositionData.id: on_position,
+        loaders.KillAction.id: on_kill,
+    }
+
+    # behaviour
+
+    def remove_world_object(self):
+        if self.world_object is not None:
+            self.world_object.delete()
+            self.world_object = None
+
+    def update(self, now):
+        """called every tick to play the game"""
+        world_object = self.world_object
+        if world_object is None or self.disconnected:
+            return
+        protocol = self.protocol
+        if protocol.movement and now >= self.next_walk:
+            self.walk()
+            self.next_walk = now + random.uniform(MIN_WALK_TIME,
+                                                  MAX_WALK_TIME)
+        if now - self.last_orientation >= ORIENTATION_INTERVAL:
+            self.last_orientation = now
+            orientation = loaders.OrientationData()
+            orientation.set(world_object.orientation.get())
+            self.send_contained(orientation, True)
+        if now - self.last_position >= POSITION_INTERVAL:
+            self.last_position = now
+            position = loaders.PositionData()
+            position.set(world_object.position.get())
+            self.send_contained(position, True)
+        if protocol.shooting and now >= self.next_shot:
+            self.shoot()
+            self.next_shot = now + SHOT_INTERVAL
+        if protocol.building and now >= self.next_build:
+            self.build()
+            self.next_build = now + random.uniform(0.5, 1.5) * BUILD_INTERVAL
+
+    def walk(self):
+        world_object = self.world_object
+        up, down, left, right = (random.random() < 0.5 for _ in range(4))
+        world_object.set_walk(up, down, left, right)
+        jump = random.random() < 0.1
+        world_object.set_animation(jump, False, False, False)
+        angle = random.uniform(0, 2 * math.pi)
+        world_object.set_orientation(math.cos(angle), math.sin(angle), 0.0)
+        input_data = loaders.InputData()
+        input_data.player_id = self.player_id
+        input_data.up, input_data.down = up, down
+        input_data.left, input_data.right = left, right
+        input_data.jump = jump
+        input_data.crouch = input_data.sneak = input_data.sprint = False
+        self.send_contained(input_data)
+
+    def shoot(self):
+        self.shooting = not self.shooting
+        weapon_input = loaders.WeaponInput()
+        weapon_input.player_id = self.player_id
+        weapon_input.primary = self.shooting
+        weapon_input.secondary = False
+        self.send_contained(weapon_input)
+        if not self.shooting:
+            return
+        # real clients report the blocks their bullets hit
+        hit = self.world_object.cast_ray(64.0)
+        if hit is None:
+            return
+        block_action = loaders.BlockAction()
+        block_action.player_id = self.player_id
+        block_action.value = DESTROY_BLOCK
+        block_action.x, block_action.y, block_action.z = hit
+        self.send_contained(block_action)
+
+    def build(self):
+        position = self.world_object.position
+        orientation = self.world_object.orientation
+        x = int(position.x + orientation.x * 2)
+        y = int(position.y + orientation.y * 2)
+        z = int(position.z + 2)
+        if math.hypot(x - position.x, y - position.y) > MAX_BLOCK_DISTANCE:
+            return
+        self.set_tool(BLOCK_TOOL)
+        block_action = loaders.BlockAction()
+        block_action.player_id = self.player_id
+        block_action.value = BUILD_BLOCK
+        block_action.x, block_action.y, block_action.z = x, y, z
+        self.send_contained(block_action)
+        self.set_tool(WEAPON_TOOL)
+
+    def set_tool(self, tool):
+        set_tool = loaders.SetTool()
+        set_tool.player_id = self.player_id
+        set_tool.value = tool
+        self.send_contained(set_tool)
+
+
+class ClientProtocol(BaseProtocol):
+    """connects ``count`` bots to a server
+
+    Arguments:
+        host (str): the server to connect to
+        port (int): its port
+        count (int): the number of bots
+        name (str): bot names, the server makes them unique
+        connect_interval (float): seconds between connection attempts
+    """
+    is_client = True
+    connection_class = ClientConnection
+    movement = True
+    shooting = True
+    building = True
+    # size and CRC-32 of the map data the map was decoded from
+    map_checksum = None
+
+    def __init__(self, host, port, count=1, name='Bot',
+                 version=GAME_VERSION, connect_interval=0.05):
+        self.max_connections = count
+        self.name = name
+        self.map = None
+        self.world = world.World()
+        BaseProtocol.__init__(self, None)
+        self.bots = []
+        asyncio.ensure_future(
+            self.connect_bots(host, port, count, version, connect_interval))
+
+    async def connect_bots(self, host, port, count, version, interval):
+        for _ in range(count):
+            if self.host is None:
+                return
+            self.bots.append(self.connect(self.connection_class, host, port,
+                                          version, timeout=30.0))
+            await asyncio.sleep(interval)
+
+    def set_map(self, map_obj):
+        self.map = map_obj
+        self.world.map = map_obj
+
+    async def update(self):
+        while self.host is not None:
+            BaseProtocol.update(self)
+            if self.map is not None:
+                self.world.update(UPDATE_FREQUENCY)
+                now = time.monotonic()
+                for bot in self.bots:
+                    bot.update(now)
+            await asyncio.sleep(UPDATE_FREQUENCY)
+
+    def get_stats(self):
+        """return counters summed over all bots"""
+        bots = self.bots
+        map_times = [bot.map_time for bot in bots if bot.map_time]
+        return {
+            'bots': len(bots),
+            'joined': sum(1 for bot in bots if bot.joined is not None),
+            'packets_sent': sum(bot.packets_sent for bot in bots),
+            'bytes_sent': sum(bot.bytes_sent for bot in bots),
+            'packets_received': sum(bot.packets_received for bot in bots),
+            'bytes_received': sum(bot.bytes_received for bot in bots),
+            'maps': len(map_times),
+            'map_bytes': sum(bot.map_received for bot in bots
+                             if bot.map_time),
+            'map_time': sum(map_times),
+        }
@@ -66,6 +66,22 @@ UPDATE_FPS = 60.0
 UPDATE_FREQUENCY = 1 / UPDATE_FPS
 NETWORK_FPS = 10.0
 
+# with congestion control, a peer gets fewer WorldUpdates while it has more
+# reliable data in flight, loses more packets or its round trip time rises
+# further above its lowest round trip time than this
+CONGESTION_RELIABLE_IN_TRANSIT = 16384
+CONGESTION_PACKET_LOSS = 0.1
+CONGESTION_LATENCY = 150  # ms
+# send at least every nth WorldUpdate to a congested peer
+MAX_UPDATE_INTERVAL = 8
+# enet reports packet loss as a fraction of this
+ENET_PACKET_LOSS_SCALE = 1 << 16
+# with adaptive network rates, a peer gets about one WorldUpdate per round
+# trip, scaled down by enet's packet throttle and kept within these limits
+MIN_NETWORK_FPS = 5.0
+MAX_NETWORK_FPS = 30.0
+ENET_PACKET_THROTTLE_SCALE = 32
+
 MIN_BLOCK_INTERVAL = 0.1
 MAX_BLOCK_DISTANCE = 6
 MAX_DIG_DISTANCE = 6
@@ -26,12 +26,18 @@ This module contains the definitions and registrations for the various packets u
 #
 # Other things that should probably be done here is using cython.freelist(n) to
 # speed up allocation for packets
+#
+# Fixed-layout packets also describe their wire format in a ``fields``
+# attribute (see pyspades.schema). The Cython read/write methods stay the
+# canonical codecs, tests/pyspades/test_schema.py keeps the two in sync.
 
 from pyspades.common import encode, decode
 from pyspades.constants import NEUTRAL_TEAM, CTF_MODE, TC_MODE
 from pyspades.loaders cimport Loader
 from pyspades.bytes cimport ByteReader, ByteWriter
 from pyspades.packet import register_packet
+from pyspades.schema import (Flags, BYTE, UBYTE, INT, UINT, FLOAT, COLOR,
+                             STRING, BYTES)
 
 cimport cython
 
@@ -70,6 +76,9 @@ id_iter = itertools.count()
 
 cdef class PositionData(Loader):
     id = 0
+    fields = [
+        ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+    ]
 
     cdef public:
         float x, y, z
@@ -92,6 +101,9 @@ register_packet(PositionData)
 
 cdef class OrientationData(Loader):
     id = 1
+    fields = [
+        ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+    ]
 
     cdef public:
         float x, y, z
@@ -121,11 +133,14 @@ cdef class WorldUpdate(Loader):
 
     cdef public:
         list items
+        bytes data
 
     cpdef read(self, ByteReader reader):
         cdef list items = []
         self.items = items
-        for _ in range(32):
+        self.data = None
+        # the server only sends the slots up to the highest player id
+        for _ in range(min(32, reader.dataLeft() // 24)):
             p_x = reader.readFloat(False)
             p_y = reader.readFloat(False)
             p_z = reader.readFloat(False)
@@ -136,6 +151,10 @@ cdef class WorldUpdate(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        if self.data is not None:
+            # preencoded payload, see World.get_network_data
+            writer.write(self.data)
+            return
         cdef tuple item
         for item in self.items:
             (p_x, p_y, p_z), (o_x, o_y, o_z) = item
@@ -150,6 +169,11 @@ register_packet(WorldUpdate)
 
 cdef class InputData(Loader):
     id = 3
+    fields = [
+        ('player_id', UBYTE),
+        ('keys', Flags('up', 'down', 'left', 'right', 'jump', 'crouch',
+                       'sneak', 'sprint')),
+    ]
     cdef public:
         int player_id
         bint up, down, left, right, jump, crouch, sneak, sprint
@@ -179,6 +203,10 @@ register_packet(InputData)
 
 cdef class WeaponInput(Loader):
     id = 4
+    fields = [
+        ('player_id', UBYTE),
+        ('buttons', Flags('primary', 'secondary')),
+    ]
 
     cdef public:
         bint primary, secondary
@@ -201,6 +229,9 @@ register_packet(WeaponInput)
 
 cdef class HitPacket(Loader):
     id = 5
+    fields = [
+        ('player_id', UBYTE), ('value', UBYTE),
+    ]
 
     cdef public:
         int player_id, value
@@ -218,6 +249,10 @@ register_packet(HitPacket, server=False)
 
 cdef class SetHP(Loader):
     id = 5
+    fields = [
+        ('hp', UBYTE), ('not_fall', UBYTE),
+        ('source_x', FLOAT), ('source_y', FLOAT), ('source_z', FLOAT),
+    ]
 
     cdef public:
         int hp, not_fall
@@ -271,6 +306,9 @@ register_packet(GrenadePacket)
 @cython.freelist(8)
 cdef class SetTool(Loader):
     id = 7
+    fields = [
+        ('player_id', UBYTE), ('value', UBYTE),
+    ]
 
     cdef public:
         int player_id, value
@@ -288,6 +326,9 @@ register_packet(SetTool)
 
 cdef class SetColor(Loader):
     id = 8
+    fields = [
+        ('player_id', UBYTE), ('value', COLOR),
+    ]
 
     cdef public:
         unsigned int value, player_id
@@ -305,6 +346,10 @@ register_packet(SetColor)
 
 cdef class ExistingPlayer(Loader):
     id = 9
+    fields = [
+        ('player_id', UBYTE), ('team', BYTE), ('weapon', UBYTE), ('tool', UBYTE),
+        ('kills', UINT), ('color', COLOR), ('name', STRING),
+    ]
 
     cdef public:
         int player_id, team, weapon, tool, kills
@@ -334,6 +379,9 @@ register_packet(ExistingPlayer)
 
 cdef class ShortPlayerData(Loader):
     id = 10
+    fields = [
+        ('player_id', UBYTE), ('team', BYTE), ('weapon', UBYTE),
+    ]
 
     cdef public:
         int player_id, team, weapon
@@ -353,6 +401,10 @@ register_packet(ShortPlayerData)
 
 cdef class MoveObject(Loader):
     id = 11
+    fields = [
+        ('object_type', UBYTE), ('state', UBYTE),
+        ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+    ]
 
     cdef public:
         unsigned int object_type, state
@@ -378,6 +430,11 @@ register_packet(MoveObject)
 @cython.freelist(8)
 cdef class CreatePlayer(Loader):
     id = 12
+    fields = [
+        ('player_id', UBYTE), ('weapon', UBYTE), ('team', BYTE),
+        ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+        ('name', STRING),
+    ]
 
     cdef public:
         unsigned int player_id, weapon
@@ -404,6 +461,10 @@ register_packet(CreatePlayer)
 
 cdef class BlockAction(Loader):
     id = 13
+    fields = [
+        ('player_id', UBYTE), ('value', UBYTE),
+        ('x', INT), ('y', INT), ('z', INT),
+    ]
 
     cdef public:
         int x, y, z, value, player_id
@@ -427,6 +488,11 @@ register_packet(BlockAction)
 
 cdef class BlockLine(Loader):
     id = 14
+    fields = [
+        ('player_id', UBYTE),
+        ('x1', INT), ('y1', INT), ('z1', INT),
+        ('x2', INT), ('y2', INT), ('z2', INT),
+    ]
 
     cdef public:
         int player_id
@@ -636,6 +702,10 @@ register_packet(StateData)
 
 cdef class KillAction(Loader):
     id = 16
+    fields = [
+        ('player_id', UBYTE), ('killer_id', UBYTE), ('kill_type', UBYTE),
+        ('respawn_time', UBYTE),
+    ]
 
     cdef public:
         int player_id, killer_id, kill_type, respawn_time
@@ -657,6 +727,9 @@ register_packet(KillAction)
 
 cdef class ChatMessage(Loader):
     id = 17
+    fields = [
+        ('player_id', UBYTE), ('chat_type', UBYTE), ('value', STRING),
+    ]
 
     cdef public:
         unsigned int player_id, chat_type
@@ -677,6 +750,9 @@ register_packet(ChatMessage)
 
 cdef class MapStart(Loader):
     id = 18
+    fields = [
+        ('size', UINT),
+    ]
 
     cdef public:
         unsigned int size
@@ -692,6 +768,9 @@ register_packet(MapStart)
 
 cdef class MapChunk(Loader):
     id = 19
+    fields = [
+        ('data', BYTES),
+    ]
 
     cdef public:
         object data
@@ -708,6 +787,9 @@ register_packet(MapChunk)
 @cython.freelist(8)
 cdef class PlayerLeft(Loader):
     id = 20
+    fields = [
+        ('player_id', UBYTE),
+    ]
 
     cdef public:
         int player_id
@@ -723,6 +805,9 @@ register_packet(PlayerLeft)
 
 cdef class TerritoryCapture(Loader):
     id = 21
+    fields = [
+        ('object_index', UBYTE), ('winning', UBYTE), ('state', UBYTE),
+    ]
 
     cdef public:
         unsigned int object_index, winning, state
@@ -742,6 +827,10 @@ register_packet(TerritoryCapture)
 
 cdef class ProgressBar(Loader):
     id = 22
+    fields = [
+        ('object_index', UBYTE), ('capturing_team', UBYTE), ('rate', BYTE),
+        ('progress', FLOAT),
+    ]
 
     cdef public:
         unsigned int object_index, capturing_team
@@ -766,6 +855,9 @@ register_packet(ProgressBar)
 @cython.freelist(8)
 cdef class IntelCapture(Loader):
     id = 23
+    fields = [
+        ('player_id', UBYTE), ('winning', UBYTE),
+    ]
 
     cdef public:
         int player_id
@@ -784,6 +876,9 @@ register_packet(IntelCapture)
 
 cdef class IntelPickup(Loader):
     id = 24
+    fields = [
+        ('player_id', UBYTE),
+    ]
 
     cdef public:
         int player_id
@@ -799,6 +894,10 @@ register_packet(IntelPickup)
 
 cdef class IntelDrop(Loader):
     id = 25
+    fields = [
+        ('player_id', UBYTE),
+        ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+    ]
 
     cdef public:
         int player_id
@@ -817,6 +916,9 @@ register_packet(IntelDrop)
 
 cdef class Restock(Loader):
     id = 26
+    fields = [
+        ('player_id', UBYTE),
+    ]
 
     cdef public:
         int player_id
@@ -849,6 +951,9 @@ register_packet(FogColor)
 @cython.freelist(8)
 cdef class WeaponReload(Loader):
     id = 28
+    fields = [
+        ('player_id', UBYTE), ('clip_ammo', UBYTE), ('reserve_ammo', UBYTE),
+    ]
 
     cdef public:
         int player_id, clip_ammo, reserve_ammo
@@ -868,6 +973,9 @@ register_packet(WeaponReload)
 
 cdef class ChangeTeam(Loader):
     id = 29
+    fields = [
+        ('player_id', UBYTE), ('team', BYTE),
+    ]
 
     cdef public:
         int player_id, team
@@ -885,6 +993,9 @@ register_packet(ChangeTeam)
 
 cdef class ChangeWeapon(Loader):
     id = 30
+    fields = [
+        ('player_id', UBYTE), ('weapon', UBYTE),
+    ]
 
     cdef public:
         int player_id, weapon
@@ -923,6 +1034,7 @@ cdef class HandShakeReturn(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        writer.writeInt(42 if self.success else 0, True)
 
 register_packet(HandShakeReturn)
 
@@ -957,6 +1069,10 @@ cdef class VersionResponse(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        writer.writeByte(ord(self.client), True)
+        for value in self.version:
+            writer.writeByte(value, True)
+        writer.writeString(encode(self.os_info))
 
 register_packet(VersionResponse)
 
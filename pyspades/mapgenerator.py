@@ -2,9 +2,35 @@
 The map generator is responsible for generating the map bytes that get sent
 to the client on connect
 """
+from concurrent.futures import ThreadPoolExecutor
+import os
 import zlib
 
+from twisted.logger import Logger
+
+log = Logger()
+
 COMPRESSION_LEVEL = 5
+# threads compressing the bands of a map, see MapCache
+COMPRESS_THREADS = min(os.cpu_count() or 1, 8)
+
+ADLER_BASE = 65521
+# start of a zlib stream, and the empty final block that ends its data
+ZLIB_HEADER = zlib.compress(b'', COMPRESSION_LEVEL)[:2]
+FINAL_BLOCK = b'\x03\x00'
+
+
+def adler32_combine(adler1, adler2, length2):
+    """return the Adler-32 checksum of two pieces of data joined together,
+    from the checksums of both pieces and the length of the second one. This
+    is adler32_combine from zlib, which the zlib module does not expose."""
+    remainder = length2 % ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xFFFF) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE -
+            remainder) % ADLER_BASE
+    return sum1 | (sum2 << 16)
 
 
 class ProgressiveMapGenerator:
@@ -97,3 +123,207 @@ class MapGeneratorChild:
     def data_left(self):
         """return True if any data is left"""
         return self.parent.data_left() or self.pos < self.parent.pos
+
+
+class MapCache:
+    """
+    Keeps the compressed map data sent to joining clients, so that it is not
+    serialised and compressed again for every client.
+
+    The map is compressed in bands of rows (see `VXLData.get_band_versions`),
+    each into its own piece of raw deflate data that ends on a byte boundary.
+    Joined together between a zlib header and trailer, the pieces make up one
+    valid zlib stream. When the map changes, only the bands that changed are
+    compressed again, and as long as it does not change every client gets the
+    same bytes.
+
+    The work is done in background threads, from a snapshot of the map (see
+    `VXLData.get_snapshot`). Serialising the snapshot and compressing do not
+    hold the GIL, so the game keeps running while a changed map is prepared.
+    """
+
+    def __init__(self, map_, level=COMPRESSION_LEVEL):
+        self.map = map_
+        self.level = level
+        # band index -> (version, compressed data, adler32, length), only
+        # used by the build thread
+        self.bands = {}
+        self.data = None
+        self.versions = None
+        self.future = None
+        # the snapshot the pending data is built from, and its map
+        self.snapshot = None
+        self.requests = 0
+        self.hits = 0
+        self.bands_compressed = 0
+        self.bands_reused = 0
+        self.bytes_compressed = 0
+
+    def update(self):
+        """start preparing the compressed data for the current state of the
+        map, unless that was done already. Returns a
+        `concurrent.futures.Future` of the data."""
+        self.requests += 1
+        versions = self.map.get_band_versions()
+        if versions == self.versions:
+            self.hits += 1
+            return self.future
+        if self.snapshot is not None and self.future.done():
+            # the map does not have to serialise the columns again
+            map_, snapshot = self.snapshot
+            map_.reuse_snapshot(snapshot)
+        snapshot = self.map.get_snapshot()
+        self.snapshot = (self.map, snapshot)
+        self.versions = versions
+        self.future = get_build_executor().submit(self.build, snapshot)
+        return self.future
+
+    def get_data(self):
+        """return the compressed map data for the current state of the map,
+        waiting for it if it is not ready yet"""
+        return self.update().result()
+
+    def build(self, snapshot):
+        # runs in the build thread, one build at a time
+        snapshot.encode()
+        changed = []
+        for band, version in enumerate(snapshot.band_versions):
+            cached = self.bands.get(band)
+            if cached is None or cached[0] != version:
+                changed.append(band)
+            else:
+                self.bands_reused += 1
+        compressed = get_compress_executor().map(
+            lambda band: self.compress_band(snapshot, band), changed)
+        for band, cached in zip(changed, compressed):
+            self.bands[band] = cached
+            self.bands_compressed += 1
+            self.bytes_compressed += cached[3]
+        pieces = [ZLIB_HEADER]
+        adler = zlib.adler32(b'')
+        for band in range(len(snapshot.band_versions)):
+            cached = self.bands[band]
+            pieces.append(cached[1])
+            adler = adler32_combine(adler, cached[2], cached[3])
+        pieces.append(FINAL_BLOCK)
+        pieces.append(adler.to_bytes(4, 'big'))
+        self.data = b''.join(pieces)
+        return self.data
+
+    def compress_band(self, snapshot, band):
+        data = snapshot.get_band_data(band)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      -zlib.MAX_WBITS)
+        compressed = compressor.compress(data)
+        compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+        return (snapshot.band_versions[band], compressed, zlib.adler32(data),
+                len(data))
+
+    def get_generator(self):
+        """return a generator that sends the current state of the map"""
+        # the size of the previous data is close enough for the loading bar
+        # if the data is not ready yet
+        size = len(self.data) if self.data is not None else None
+        return CachedMapGenerator(self, self.update(), size)
+
+    def discard(self, future):
+        """forget the data being built by ``future`` after the build failed,
+        so that the next update builds it again from scratch"""
+        if future is not self.future:
+            return
+        self.versions = None
+        self.snapshot = None
+        # no build of this cache is running while its latest one is done
+        self.bands = {}
+
+    def get_stats(self):
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'hitRate': self.hits / self.requests if self.requests else 0.0,
+            'bandsCompressed': self.bands_compressed,
+            'bandsReused': self.bands_reused,
+            'bytesCompressed': self.bytes_compressed,
+            'size': len(self.data) if self.data is not None else 0,
+            'ready': self.future is not None and self.future.done(),
+        }
+
+
+_build_executor = None
+_compress_executor = None
+
+
+def get_build_executor():
+    """return the thread map data is prepared in. There is only one, so
+    that builds of a `MapCache` never overlap."""
+    global _build_executor
+    if _build_executor is None:
+        _build_executor = ThreadPoolExecutor(
+            1, thread_name_prefix='MapCache build')
+    return _build_executor
+
+
+def get_compress_executor():
+    """return the threads bands of the map are compressed in"""
+    global _compress_executor
+    if _compress_executor is None:
+        _compress_executor = ThreadPoolExecutor(
+            COMPRESS_THREADS, thread_name_prefix='MapCache compress')
+    return _compress_executor
+
+
+class CachedMapGenerator:
+    """Sends map data from a `MapCache`, like a ProgressiveMapGenerator.
+    Until the data is ready, read returns nothing. If preparing the data
+    fails, the map is sent with a ProgressiveMapGenerator instead."""
+    pos = 0
+    data = None
+    fallback = None
+
+    def __init__(self, cache, future, size=None):
+        self.cache = cache
+        self.future = future
+        self.size = size
+
+    def ready(self):
+        """return True once the data, or the fallback generator, can be
+        read"""
+        if self.data is not None or self.fallback is not None:
+            return True
+        if not self.future.done():
+            return False
+        try:
+            self.data = self.future.result()
+        except Exception:
+            log.failure("Could not prepare the compressed map data")
+            self.cache.discard(self.future)
+            self.fallback = ProgressiveMapGenerator(self.cache.map)
+        return True
+
+    def get_size(self):
+        """get the map size, for display of the loading bar on the client"""
+        if self.ready():
+            if self.fallback is not None:
+                return self.fallback.get_size()
+            return len(self.data)
+        if self.size is not None:
+            return self.size
+        return 1.5 * 1024 * 1024
+
+    def read(self, size):
+        """read size bytes of the map data"""
+        if not self.ready():
+            return b''
+        if self.fallback is not None:
+            return self.fallback.read(size)
+        pos = self.pos
+        self.pos += size
+        return self.data[pos:pos + size]
+
+    def data_left(self):
+        """return True if any data is left"""
+        if not self.ready():
+            return True
+        if self.fallback is not None:
+            return self.fallback.data_left()
+        return self.pos < len(self.data)
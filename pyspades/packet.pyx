@@ -21,6 +21,10 @@ from pyspades.bytes cimport ByteReader, ByteWriter
 _client_loaders = {}
 _server_loaders = {}
 
+# the same loaders, indexed by packet id for fast lookup
+cdef list _client_loader_table = [None] * 256
+cdef list _server_loader_table = [None] * 256
+
 def register_packet(loader=None, server=True, client=True, extension=None):
     """register a packet
 
@@ -82,6 +86,7 @@ def register_packet(loader=None, server=True, client=True, extension=None):
                        "with that id ({}) already exists.".format(cls, cls.id))
                 raise KeyError(msg)
             _client_loaders[cls.id] = cls
+            _client_loader_table[cls.id] = cls
 
         if server:
             if cls.id in _server_loaders:
@@ -89,6 +94,7 @@ def register_packet(loader=None, server=True, client=True, extension=None):
                        "with that id ({}) already exists.".format(cls, cls.id))
                 raise KeyError(msg)
             _server_loaders[cls.id] = cls
+            _server_loader_table[cls.id] = cls
 
         return cls
 
@@ -100,32 +106,86 @@ def register_packet(loader=None, server=True, client=True, extension=None):
     return register
 
 
-def load_server_packet(data):
-    return load_contained_packet(data, _server_loaders)
+cdef class LoaderCache:
+    """preallocated Loader instances to decode packets into
 
-def load_client_packet(data):
-    return load_contained_packet(data, _client_loaders)
+    Each connection can own one of these for the packet types it receives
+    most often (e.g. position and input updates), so decoding them does not
+    allocate a new Loader every time. The same instance is handed to the
+    packet handler for every packet of that type, so handlers must not keep a
+    reference to it after they return.
 
-cdef inline Loader load_contained_packet(ByteReader data, dict table):
-    type_ = data.readByte(True)
-    return table[type_](data)
+    Arguments:
+        ids (iterable): packet ids to preallocate Loaders for
+        server (bool, optional): cache packets sent by the server instead of
+            packets sent by the client
+    """
+    cdef list loaders
+
+    def __init__(self, ids=(), bint server=False):
+        cdef list table = _server_loader_table if server else \
+            _client_loader_table
+        self.loaders = [None] * 256
+        for packet_id in ids:
+            klass = table[packet_id]
+            if klass is None:
+                raise KeyError('no packet registered with id {}'.format(
+                    packet_id))
+            self.loaders[packet_id] = klass()
+
+    def get(self, int packet_id):
+        """return the cached Loader for ``packet_id``, or None"""
+        return self.loaders[packet_id & 0xFF]
+
+
+def load_server_packet(data, LoaderCache cache=None):
+    return load_contained_packet(data, _server_loader_table, cache)
+
+def load_client_packet(data, LoaderCache cache=None):
+    return load_contained_packet(data, _client_loader_table, cache)
+
+cdef inline Loader load_contained_packet(ByteReader data, list table,
+                                         LoaderCache cache):
+    """decode a packet, returning None if the packet id is unknown"""
+    cdef int type_ = data.readByte(True)
+    cdef Loader loader
+    if cache is not None:
+        loader = cache.loaders[type_]
+        if loader is not None:
+            loader.read(data)
+            return loader
+    klass = table[type_]
+    if klass is None:
+        return None
+    return klass(data)
 
 _packet_handlers = {}
+cdef list _packet_handler_table = [None] * 256
 
 def register_packet_handler(loader):
     def register_handler(function):
         _packet_handlers[loader.id] = function
+        _packet_handler_table[loader.id] = function
         return function
     return register_handler
 
-def call_packet_handler(self, loader):
-    contained = load_client_packet(ByteReader(loader.data))
-    try:
-        handler = _packet_handlers[contained.id]
-    except KeyError:
+def call_packet_handler(self, loader, LoaderCache cache=None):
+    """decode a packet received from a client and pass it to the handler
+    registered for it. Unknown and unhandled packets are ignored.
+
+    Arguments:
+        self: the connection the packet was received on
+        loader (enet.Packet): the received packet
+        cache (LoaderCache, optional): decode into these preallocated Loaders
+            where possible
+    """
+    contained = load_contained_packet(ByteReader(loader.data),
+                                      _client_loader_table, cache)
+    if contained is None:
         # an invalid ID was sent
-        pass
-    finally:
-        # we call the handler in the finally clause so we don't
-        # accidentally ignore KeyErrors the handler raises
-        handler(self, contained)
+        return
+    handler = _packet_handler_table[contained.id]
+    if handler is None:
+        return
+    # handler exceptions are deliberately not caught here
+    handler(self, contained)
@@ -26,17 +26,23 @@ from pyspades.constants import (BLOCK_TOOL, CTF_MODE, ERROR_FULL,
                                 TC_CAPTURE_DISTANCE, TC_MODE, WEAPON_KILL,
                                 WEAPON_TOOL)
 from pyspades.mapgenerator import ProgressiveMapGenerator
-from pyspades.packet import call_packet_handler, register_packet_handler
+from pyspades.packet import (LoaderCache, call_packet_handler,
+                             register_packet_handler)
 from pyspades.protocol import BaseConnection
 from pyspades.team import Team
 from pyspades.weapon import WEAPONS
-from pyspades.types import RateLimiter
+from pyspades.types import RateLimiter, UpdateThrottle
 
 log = Logger()
 
 
 tc_data = loaders.TCState()
 
+# packets clients send many times per second. With protocol.reuse_loaders,
+# these are decoded into preallocated per-connection Loader instances
+REUSABLE_LOADERS = (loaders.PositionData.id, loaders.OrientationData.id,
+                    loaders.InputData.id, loaders.WeaponInput.id)
+
 # special characters to replace in chat messages
 MSG_SPECIAL_CHARACTER_MAP = str.maketrans({'\r': ' ', '\n': ' '})
 
@@ -92,6 +98,12 @@ class ServerConnection(BaseConnection):
     map_data = None
     last_position_update = None
     local = False
+    loader_cache = None  # type: LoaderCache
+    # why this connection last got fewer WorldUpdates, see get_congestion
+    congestion = None  # type: Optional[str]
+    # WorldUpdate schedule with protocol.adaptive_network_rate
+    network_fps = NETWORK_FPS
+    next_network_update = 0.0
 
     def __init__(self, *arg, **kw) -> None:
         BaseConnection.__init__(self, *arg, **kw)
@@ -104,6 +116,58 @@ class ServerConnection(BaseConnection):
         self.client_info = {}
         self.proto_extensions = {}  # type: Dict[int, int]
         self.line_build_start_pos = None
+        if getattr(protocol, 'reuse_loaders', False):
+            self.loader_cache = LoaderCache(REUSABLE_LOADERS)
+        self.world_update_throttle = UpdateThrottle(MAX_UPDATE_INTERVAL)
+
+    def get_congestion(self) -> Optional[str]:
+        """return why this connection should get fewer WorldUpdates right
+        now, or None if it is keeping up"""
+        if self.map_data is not None or self.saved_loaders is not None:
+            return 'loading'
+        peer = self.peer
+        if peer.reliableDataInTransit > CONGESTION_RELIABLE_IN_TRANSIT:
+            return 'reliable'
+        if peer.packetLoss > CONGESTION_PACKET_LOSS * ENET_PACKET_LOSS_SCALE:
+            return 'loss'
+        if peer.roundTripTime - peer.lowestRoundTripTime > CONGESTION_LATENCY:
+            return 'latency'
+        return None
+
+    def send_world_update(self) -> bool:
+        """decide whether this connection gets the current WorldUpdate
+
+        Connections still loading the map get none, congested ones get
+        every nth, see :class:`pyspades.types.UpdateThrottle`."""
+        self.congestion = congestion = self.get_congestion()
+        if congestion == 'loading':
+            self.world_update_throttle.skip()
+            return False
+        return self.world_update_throttle.update(congestion is not None)
+
+    def get_network_fps(self) -> float:
+        """return the WorldUpdate rate this connection can make use of
+
+        That is about one update per round trip, so players on a LAN get
+        updates more often and high-ping players less often, scaled down
+        further when enet throttles the connection."""
+        peer = self.peer
+        fps = 1000.0 / max(peer.roundTripTime, 1)
+        fps *= peer.packetThrottle / ENET_PACKET_THROTTLE_SCALE
+        return min(max(fps, MIN_NETWORK_FPS), MAX_NETWORK_FPS)
+
+    def network_update_due(self, now: float) -> bool:
+        """return True if this connection's next WorldUpdate is due, and
+        schedule the one after it"""
+        if now < self.next_network_update:
+            return False
+        self.network_fps = self.get_network_fps()
+        interval = 1 / self.network_fps
+        self.next_network_update += interval
+        if self.next_network_update <= now:
+            # we fell behind, don't try to catch up
+            self.next_network_update = now + interval
+        return True
 
     def on_connect(self) -> None:
         if self.local:
@@ -136,7 +200,7 @@ class ServerConnection(BaseConnection):
         """
         if self.player_id is None:
             return
-        call_packet_handler(self, loader)
+        call_packet_handler(self, loader, self.loader_cache)
 
     @register_packet_handler(loaders.ProtocolExtensionInfo)
     def on_ext_info_received(self, contained: loaders.ProtocolExtensionInfo) -> None:
@@ -869,7 +933,8 @@ class ServerConnection(BaseConnection):
             else:
                 position = Vertex3(x, y, z)
                 self.world_object = self.protocol.world.create_object(
-                    world.Character, position, None, self._on_fall)
+                    world.Character, position, None, self._on_fall,
+                    self.player_id)
             self.world_object.dead = False
             self.tool = WEAPON_TOOL
             self.refill(True)
@@ -1073,7 +1138,7 @@ class ServerConnection(BaseConnection):
 
     def _connection_ack(self) -> None:
         self._send_connection_data()
-        self.send_map(ProgressiveMapGenerator(self.protocol.map))
+        self.send_map(self.protocol.get_map_generator())
         if not self.client_info:
             handshake_init = loaders.HandShakeInit()
             self.send_contained(handshake_init)
@@ -1241,8 +1306,12 @@ class ServerConnection(BaseConnection):
         for _ in range(10):
             if not self.map_data.data_left():
                 break
+            data = self.map_data.read(8192)
+            if not data:
+                # still being compressed, see MapCache
+                break
             map_data = loaders.MapChunk()
-            map_data.data = self.map_data.read(8192)
+            map_data.data = data
             self.send_contained(map_data)
 
     def continue_map_transfer(self) -> None:
@@ -16,6 +16,8 @@
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import collections
+import time
 from twisted.internet import reactor
 from pyspades.bytes import ByteWriter
 
@@ -25,6 +27,9 @@ import enet
 class BaseConnection:
     disconnected = False
     timeout_call = None
+    # reliable packets queued by a batched broadcast, see
+    # BaseProtocol.flush_outbound
+    outbound = None
 
     def __init__(self, protocol, peer):
         self.protocol = protocol
@@ -51,11 +56,32 @@ class BaseConnection:
             flags = enet.PACKET_FLAG_UNSEQUENCED
         else:
             flags = enet.PACKET_FLAG_RELIABLE
+            # reliable packets must not overtake broadcasts queued earlier
+            # this tick
+            if self.outbound:
+                self.flush_outbound()
         data = ByteWriter()
         contained.write(data)
         packet = enet.Packet(bytes(data), flags)
         self.peer.send(0, packet)
 
+    def queue_packet(self, packet):
+        """queue a reliable enet packet until the end of the tick"""
+        if self.outbound is None:
+            self.outbound = []
+        self.outbound.append(packet)
+
+    def flush_outbound(self):
+        """send the packets queued for this connection, in order"""
+        outbound = self.outbound
+        if not outbound:
+            return
+        self.outbound = None
+        send = self.peer.send
+        for packet in outbound:
+            send(0, packet)
+        self.protocol.packets_flushed += len(outbound)
+
     # events
 
     def on_connect(self):
@@ -71,10 +97,70 @@ class BaseConnection:
         return self.peer.roundTripTime
 
 
+class ServiceStats:
+    """counters for the enet service loop in :meth:`BaseProtocol.update`"""
+
+    def __init__(self):
+        # events handled, by type
+        self.connect = 0
+        self.disconnect = 0
+        self.receive = 0
+        self.ticks = 0
+        # seconds spent servicing the enet host
+        self.time = 0.0
+        self.last_time = 0.0
+        self.last_events = 0
+        # ticks that ran out of budget, and how many of them in a row
+        self.deferred = 0
+        self.backlog = 0
+        # events that were received but left for the next tick, at the end
+        # of the last tick and at most
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    @property
+    def events(self):
+        return self.connect + self.disconnect + self.receive
+
+    def as_dict(self):
+        return {
+            'events': {
+                'connect': self.connect,
+                'disconnect': self.disconnect,
+                'receive': self.receive,
+            },
+            'ticks': self.ticks,
+            'time': self.time,
+            'lastTime': self.last_time,
+            'lastEvents': self.last_events,
+            'deferred': self.deferred,
+            'backlog': self.backlog,
+            'queueDepth': self.queue_depth,
+            'maxQueueDepth': self.max_queue_depth,
+        }
+
+
 class BaseProtocol:
     connection_class = BaseConnection
     max_connections = 33
     is_client = False
+    # queue reliable broadcasts and send them all at the end of a tick
+    batch_packets = False
+    # the maximum number of enet events handled per tick and the maximum
+    # time spent handling them, in seconds. Events over budget stay queued
+    # in enet until the next tick. 0 means no limit.
+    service_event_budget = 0
+    service_time_budget = 0
+    # the maximum number of events over budget moved out of enet into
+    # pending_events. Any more stay queued in enet, whose buffers are limited
+    # per peer, and are handled after the pending ones.
+    max_pending_events = 4096
+    # a pyspades.capture.CaptureWriter recording every enet event handled
+    capture = None
+    # counters for batched broadcasts
+    packets_queued = 0
+    packets_coalesced = 0
+    packets_flushed = 0
 
     def __init__(self, port=None, interface=b'*',
                  update_interval=1 / 60.0):
@@ -82,16 +168,25 @@ class BaseProtocol:
             address = enet.Address(interface, port)
         else:
             address = None
-        try:
-            self.host = enet.Host(address, self.max_connections, 1)
-        except MemoryError:
-            # pyenet raises memoryerror when the enet host could not be created
-            raise IOError("Failed  to Create Enet Host. Is the Port in use?")
+        self.host = self.create_host(address)
 
         self.host.compress_with_range_coder()
         self.update_loop = asyncio.ensure_future(self.update())
         self.connections = {}
         self.clients = {}
+        # enet packets queued this tick, by payload
+        self.outbound_packets = {}
+        self.service_stats = ServiceStats()
+        # events received but left for the next tick by the service budget
+        self.pending_events = collections.deque()
+
+    def create_host(self, address):
+        """create the enet host the protocol services"""
+        try:
+            return enet.Host(address, self.max_connections, 1)
+        except MemoryError:
+            # pyenet raises memoryerror when the enet host could not be created
+            raise IOError("Failed  to Create Enet Host. Is the Port in use?")
 
     def connect(self, connection_class, host, port, version, channel_count=1,
                 timeout=5.0):
@@ -128,28 +223,64 @@ class BaseProtocol:
             del self.clients[peer]
             self.check_client()
 
+    def flush_outbound(self):
+        """send the reliable packets queued during this tick
+
+        Every connection receives its packets in the order they were queued.
+        enet then packs the queued commands for a peer into as few datagrams
+        as the MTU allows when the host is flushed.
+        """
+        for connection in self.connections.values():
+            connection.flush_outbound()
+        if self.outbound_packets:
+            self.outbound_packets.clear()
+            self.host.flush()
+
     def check_client(self):
         if self.is_client and not self.clients:
-            self.update_loop.stop()
+            self.update_loop.cancel()
             self.update_loop = None
             self.host = None  # important for GC
 
     def update(self):
+        stats = self.service_stats
+        event_budget = self.service_event_budget
+        time_budget = self.service_time_budget
+        start = time.perf_counter()
+        deadline = start + time_budget
+        handled = 0
+        exhausted = False
         try:
             while 1:
                 if self.host is None:
                     return
-                try:
-                    event = self.host.service(0)
-                except IOError:
-                    break
-                if event is None:
+                if ((event_budget and handled >= event_budget) or
+                        (time_budget and time.perf_counter() >= deadline)):
+                    exhausted = True
                     break
+                if self.pending_events:
+                    event = self.pending_events.popleft()
+                else:
+                    try:
+                        event = self.host.service(0)
+                    except IOError:
+                        break
+                    if event is None:
+                        break
                 event_type = event.type
                 if event_type == enet.EVENT_TYPE_NONE:
                     break
                 peer = event.peer
                 is_client = peer in self.clients
+                if event_type == enet.EVENT_TYPE_CONNECT:
+                    stats.connect += 1
+                elif event_type == enet.EVENT_TYPE_DISCONNECT:
+                    stats.disconnect += 1
+                else:
+                    stats.receive += 1
+                handled += 1
+                if self.capture is not None:
+                    self.capture.write_event(event)
                 if is_client:
                     connection = self.clients[peer]
                     if event_type == enet.EVENT_TYPE_CONNECT:
@@ -172,3 +303,34 @@ class BaseProtocol:
             # make sure the LoopingCall doesn't catch this and stops
             import traceback
             traceback.print_exc()
+        elapsed = time.perf_counter() - start
+        stats.ticks += 1
+        stats.time += elapsed
+        stats.last_time = elapsed
+        stats.last_events = handled
+        if exhausted:
+            stats.deferred += 1
+            stats.backlog += 1
+            self.queue_pending_events()
+            # the events left for the next tick include acknowledgements, and
+            # sending is done by host.service, which was not reached
+            if self.host is not None:
+                self.host.flush()
+        else:
+            stats.backlog = 0
+        stats.queue_depth = len(self.pending_events)
+        stats.max_queue_depth = max(stats.max_queue_depth, stats.queue_depth)
+
+    def queue_pending_events(self):
+        """move the events enet received but did not dispatch yet to
+        pending_events, without reading from the socket, so that the queue
+        depth is known"""
+        while (self.host is not None and
+               len(self.pending_events) < self.max_pending_events):
+            try:
+                event = self.host.check_events()
+            except IOError:
+                break
+            if event is None or event.type == enet.EVENT_TYPE_NONE:
+                break
+            self.pending_events.append(event)
@@ -0,0 +1,285 @@
+# This file is part of pyspades.
+
+# pyspades is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# pyspades is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Declarative packet layouts.
+
+A layout is a list of ``(name, field_type)`` tuples. It is compiled into
+precompiled :class:`struct.Struct` codecs and a specialised ``read`` and
+``write`` method, so every run of fixed-size fields is decoded and encoded in
+a single bulk operation::
+
+    @register_packet(extension=EXTENSION_EXAMPLE)
+    class ExamplePacket(SchemaLoader):
+        id = 0x70
+        fields = [
+            ('player_id', UBYTE),
+            ('x', FLOAT), ('y', FLOAT), ('z', FLOAT),
+            ('color', COLOR),
+            ('name', STRING),
+        ]
+
+The built-in packets in :mod:`pyspades.contained` describe their layout with
+the same ``fields`` attribute. They keep their hand-written Cython codecs,
+which are faster than anything that sets attributes from Python, and the tests
+check them against the layout.
+"""
+
+import struct
+
+from pyspades.bytes import NoDataLeft
+from pyspades.common import encode, decode
+from pyspades.loaders import Loader
+
+__all__ = [
+    'FieldType', 'Flags', 'FixedString',
+    'BYTE', 'UBYTE', 'SHORT', 'USHORT', 'INT', 'UINT', 'FLOAT',
+    'SHORT_BE', 'USHORT_BE', 'INT_BE', 'UINT_BE', 'FLOAT_BE',
+    'COLOR', 'RGB', 'STRING', 'BYTES',
+    'compile_schema', 'SchemaLoader',
+]
+
+
+class FieldType:
+    """a field with a fixed size, stored as one or more struct items
+
+    Arguments:
+        code (str): :mod:`struct` format characters for the field
+        count (int): number of struct items ``code`` packs to
+        big_endian (bool): byte order of the field
+    """
+
+    def __init__(self, code, count=1, big_endian=False):
+        self.code = code
+        self.count = count
+        self.big_endian = big_endian
+
+    @property
+    def size(self):
+        return struct.calcsize('<' + self.code)
+
+    def unpack(self, name, items):
+        """return source lines setting ``self.<name>`` from ``items``"""
+        return ['self.{} = {}'.format(name, items[0])]
+
+    def pack(self, name):
+        """return source expressions for the struct items of
+        ``self.<name>``"""
+        return ['self.{}'.format(name)]
+
+    def __repr__(self):
+        return '{}({!r}, big_endian={!r})'.format(
+            type(self).__name__, self.code, self.big_endian)
+
+
+class _Color(FieldType):
+    """a BGR color stored as the integer ``b | g << 8 | r << 16``"""
+
+    def __init__(self):
+        FieldType.__init__(self, 'BBB', 3)
+
+    def unpack(self, name, items):
+        return ['self.{} = {} | ({} << 8) | ({} << 16)'.format(name, *items)]
+
+    def pack(self, name):
+        return ['self.{} & 0xFF'.format(name),
+                '(self.{} >> 8) & 0xFF'.format(name),
+                '(self.{} >> 16) & 0xFF'.format(name)]
+
+
+class _RGB(FieldType):
+    """a BGR color exposed as an ``(r, g, b)`` tuple"""
+
+    def __init__(self):
+        FieldType.__init__(self, 'BBB', 3)
+
+    def unpack(self, name, items):
+        b, g, r = items
+        return ['self.{} = ({}, {}, {})'.format(name, r, g, b)]
+
+    def pack(self, name):
+        return ['self.{}[2]'.format(name), 'self.{}[1]'.format(name),
+                'self.{}[0]'.format(name)]
+
+
+class Flags(FieldType):
+    """up to eight booleans packed into one byte, lowest bit first"""
+
+    def __init__(self, *names):
+        if not 0 < len(names) <= 8:
+            raise ValueError('Flags needs between 1 and 8 names')
+        FieldType.__init__(self, 'B')
+        self.names = names
+
+    def unpack(self, name, items):
+        return ['self.{} = ({} >> {}) & 1'.format(flag, items[0], bit)
+                for bit, flag in enumerate(self.names)]
+
+    def pack(self, name):
+        return [' | '.join('(bool(self.{}) << {})'.format(flag, bit)
+                           for bit, flag in enumerate(self.names))]
+
+
+class FixedString(FieldType):
+    """a NUL-padded string field of ``length`` bytes"""
+
+    def __init__(self, length):
+        FieldType.__init__(self, '{}s'.format(length))
+        self.length = length
+
+    def unpack(self, name, items):
+        return ["self.{} = decode({}.split(b'\\0', 1)[0])".format(
+            name, items[0])]
+
+    def pack(self, name):
+        # struct pads with NUL bytes; keep room for the terminator
+        return ['encode(self.{})[:{}]'.format(name, self.length - 1)]
+
+
+class _Tail:
+    """a variable-length field that takes up the rest of the packet"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return 'STRING' if self.text else 'BYTES'
+
+
+BYTE = FieldType('b')
+UBYTE = FieldType('B')
+SHORT = FieldType('h')
+USHORT = FieldType('H')
+INT = FieldType('i')
+UINT = FieldType('I')
+FLOAT = FieldType('f')
+SHORT_BE = FieldType('h', big_endian=True)
+USHORT_BE = FieldType('H', big_endian=True)
+INT_BE = FieldType('i', big_endian=True)
+UINT_BE = FieldType('I', big_endian=True)
+FLOAT_BE = FieldType('f', big_endian=True)
+COLOR = _Color()
+RGB = _RGB()
+#: NUL-terminated string at the end of the packet, decoded with
+#: :func:`pyspades.common.decode`
+STRING = _Tail(True)
+#: raw bytes at the end of the packet
+BYTES = _Tail(False)
+
+
+def _segments(fields):
+    """split the fixed-size fields into runs that share a byte order"""
+    segments = []
+    for index, (name, field_type) in enumerate(fields):
+        if isinstance(field_type, _Tail):
+            if index != len(fields) - 1:
+                raise ValueError(
+                    'variable-length field {!r} must be last'.format(name))
+            continue
+        if not isinstance(field_type, FieldType):
+            raise TypeError('invalid type for field {!r}: {!r}'.format(
+                name, field_type))
+        if not segments or segments[-1][0] != field_type.big_endian:
+            segments.append((field_type.big_endian, []))
+        segments[-1][1].append((name, field_type))
+    return segments
+
+
+def compile_schema(fields, packet_id=None):
+    """compile a layout into ``read(self, reader)`` and
+    ``write(self, writer)`` functions
+
+    Arguments:
+        fields (list): ``(name, field_type)`` tuples, in wire order
+        packet_id (int, optional): written as the first byte by ``write``
+
+    Returns:
+        (read, write): the generated functions
+    """
+    fields = list(fields)
+    namespace = {'NoDataLeft': NoDataLeft, 'encode': encode,
+                 'decode': decode}
+    read_lines = []
+    write_lines = []
+    item = 0
+    for index, (big_endian, segment) in enumerate(_segments(fields)):
+        order = '>' if big_endian else '<'
+        code = ''.join(field_type.code for _, field_type in segment)
+        items = []
+        assignments = []
+        pack_items = []
+        for name, field_type in segment:
+            names = ['_v{}'.format(item + i) for i in range(field_type.count)]
+            item += field_type.count
+            items.extend(names)
+            assignments.extend(field_type.unpack(name, names))
+            pack_items.extend(field_type.pack(name))
+        reader_codec = struct.Struct(order + code)
+        namespace['_r{}'.format(index)] = reader_codec
+        if index == 0 and packet_id is not None:
+            # the packet id is a single byte, so it can share the first
+            # struct regardless of byte order
+            namespace['_w0'] = struct.Struct(order + 'B' + code)
+            pack_items.insert(0, str(packet_id))
+        else:
+            namespace['_w{}'.format(index)] = reader_codec
+        read_lines.extend([
+            'data = reader.read({})'.format(reader_codec.size),
+            'if len(data) != {}:'.format(reader_codec.size),
+            "    raise NoDataLeft('not enough data')",
+            '{}, = _r{}.unpack(data)'.format(', '.join(items), index),
+        ])
+        read_lines.extend(assignments)
+        write_lines.append('writer.write(_w{}.pack({}))'.format(
+            index, ', '.join(pack_items)))
+    if packet_id is not None and not write_lines:
+        write_lines.append('writer.writeByte({}, True)'.format(packet_id))
+    if fields and isinstance(fields[-1][1], _Tail):
+        name, tail = fields[-1]
+        if tail.text:
+            read_lines.append('self.{} = decode(reader.readString())'.format(
+                name))
+            write_lines.append('writer.writeString(encode(self.{}))'.format(
+                name))
+        else:
+            read_lines.append('self.{} = reader.read()'.format(name))
+            write_lines.append('writer.write(self.{})'.format(name))
+
+    source = 'def read(self, reader):\n'
+    source += ''.join('    {}\n'.format(line)
+                      for line in read_lines or ['pass'])
+    source += 'def write(self, writer):\n'
+    source += ''.join('    {}\n'.format(line)
+                      for line in write_lines or ['pass'])
+    exec(compile(source, '<schema {!r}>'.format(packet_id), 'exec'),
+         namespace)
+    return namespace['read'], namespace['write']
+
+
+class SchemaLoader(Loader):
+    """a Loader whose ``read`` and ``write`` are generated from ``fields``
+
+    Subclasses set ``id`` and ``fields``; attributes are created from the
+    field names.
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = cls.__dict__.get('fields')
+        if fields is None:
+            return
+        cls.read, cls.write = compile_schema(fields, getattr(cls, 'id', None))
@@ -27,7 +27,7 @@ import traceback
 from pyspades.protocol import BaseProtocol
 from pyspades.constants import (
     CTF_MODE, TC_MODE, GAME_VERSION, MIN_TERRITORY_COUNT, MAX_TERRITORY_COUNT,
-    UPDATE_FREQUENCY, UPDATE_FPS, NETWORK_FPS)
+    UPDATE_FREQUENCY, UPDATE_FPS, NETWORK_FPS, MAX_NETWORK_FPS)
 from pyspades.types import IDPool
 from pyspades.master import MasterPool
 from pyspades.team import Team
@@ -38,7 +38,7 @@ from pyspades import world
 from pyspades.bytes import ByteWriter
 from pyspades import contained as loaders
 from pyspades.common import make_color
-from pyspades.mapgenerator import ProgressiveMapGenerator
+from pyspades.mapgenerator import MapCache, ProgressiveMapGenerator
 from twisted.logger import Logger
 
 log = Logger()
@@ -77,6 +77,20 @@ class ServerProtocol(BaseProtocol):
     melee_damage = 100
     version = GAME_VERSION
     respawn_waves = False
+    # only send players the positions of players they could possibly see
+    interest_management = False
+    # decode frequent packets into preallocated per-connection Loaders
+    reuse_loaders = False
+    # send fewer WorldUpdates to congested connections
+    congestion_control = False
+    # give every connection its own WorldUpdate rate, based on its latency
+    adaptive_network_rate = False
+    # track which blocks are connected to the ground, see
+    # VXLData.enable_connectivity_index
+    connectivity_index = False
+    # compress the map once for all joining players, see MapCache
+    cache_map_data = True
+    map_cache = None
     master_hosts: List[MasterHostDict]
 
     def __init__(self, *arg, **kw):
@@ -108,8 +122,11 @@ class ServerProtocol(BaseProtocol):
                             abs(vec[1] * 1.02) +
                             abs(vec[2] * 1.01))
 
-        self.last_network_update = self.world_time = time.monotonic()
+        self.last_network_update = self.world_time = self.get_time()
         self.loop_count = 0
+        # seconds spent on world updates and network updates, see
+        # service_stats for the time spent handling enet events
+        self.simulation_time = 0.0
 
     def _create_teams(self):
         """create the teams
@@ -168,7 +185,18 @@ class ServerProtocol(BaseProtocol):
         writer = ByteWriter()
         contained.write(writer)
         data = bytes(writer)
-        packet = enet.Packet(data, flags)
+        batch = self.batch_packets and not unsequenced
+        if batch:
+            # identical payloads queued during the same tick share one packet
+            packet = self.outbound_packets.get(data)
+            if packet is None:
+                packet = enet.Packet(data, flags)
+                self.outbound_packets[data] = packet
+                coalesced = False
+            else:
+                coalesced = True
+        else:
+            packet = enet.Packet(data, flags)
         for player in self.connections.values():
             if player is sender or player.player_id is None:
                 continue
@@ -179,6 +207,11 @@ class ServerProtocol(BaseProtocol):
             if player.saved_loaders is not None:
                 if save:
                     player.saved_loaders.append(data)
+            elif batch:
+                player.queue_packet(packet)
+                self.packets_queued += 1
+                if coalesced:
+                    self.packets_coalesced += 1
             else:
                 player.peer.send(0, packet)
 
@@ -229,7 +262,7 @@ class ServerProtocol(BaseProtocol):
 
     async def update(self):
         while True:
-            start_time = time.monotonic()
+            start_time = self.get_time()
             # Notify if update starts more than 4ms later than requested
             lag = start_time - self.world_time - UPDATE_FREQUENCY
             if lag > 0.004:
@@ -237,13 +270,14 @@ class ServerProtocol(BaseProtocol):
                     "LAG before world update: {lag:.0f} ms", lag=lag * 1000)
 
             BaseProtocol.update(self)
+            simulation_start = time.monotonic()
             # Map transfer
             for player in self.connections.values():
                 if (player.map_data is not None and
                         not player.peer.reliableDataInTransit):
                     player.continue_map_transfer()
             # Update world
-            while (time.monotonic() - self.world_time) > UPDATE_FREQUENCY:
+            while (self.get_time() - self.world_time) > UPDATE_FREQUENCY:
                 self.loop_count += 1
                 self.world.update(UPDATE_FREQUENCY)
                 try:
@@ -252,46 +286,125 @@ class ServerProtocol(BaseProtocol):
                     traceback.print_exc()
                 self.world_time += UPDATE_FREQUENCY
             # Update network
-            if time.monotonic() - self.last_network_update >= 1 / NETWORK_FPS:
+            if self.adaptive_network_rate:
+                # connections keep their own schedule, see
+                # ServerConnection.network_update_due
+                network_fps = MAX_NETWORK_FPS
+            else:
+                network_fps = NETWORK_FPS
+            if self.get_time() - self.last_network_update >= 1 / network_fps:
                 self.last_network_update = self.world_time
                 self.update_network()
+            if self.batch_packets:
+                self.flush_outbound()
+            self.simulation_time += time.monotonic() - simulation_start
 
             # Notify if update uses more than 70% of time budget
-            lag = time.monotonic() - start_time
+            lag = self.get_time() - start_time
             if lag > (UPDATE_FREQUENCY * 0.7):
                 log.debug("world update LAG: {lag:.0f} ms", lag=lag * 1000)
 
-            delay = self.world_time + UPDATE_FREQUENCY - time.monotonic()
-            await asyncio.sleep(delay)
+            delay = self.world_time + UPDATE_FREQUENCY - self.get_time()
+            await self.sleep(delay)
+
+    def get_time(self):
+        """return the current time of the simulation, in seconds"""
+        return time.monotonic()
+
+    def sleep(self, delay):
+        """wait until the simulation time has advanced by ``delay`` seconds
+
+        Together with get_time, this can be overridden to run the
+        simulation faster than real time."""
+        return asyncio.sleep(delay)
+
+    def get_update_receivers(self):
+        """return the connections that get a WorldUpdate this time, or None
+        if every connection does"""
+        if not (self.adaptive_network_rate or self.congestion_control):
+            return None
+        now = self.get_time()
+        receivers = set()
+        for player in self.connections.values():
+            if player.player_id is None:
+                continue
+            if (self.adaptive_network_rate and
+                    not player.network_update_due(now)):
+                continue
+            if self.congestion_control and not player.send_world_update():
+                continue
+            receivers.add(player)
+        return receivers
 
     def update_network(self):
         if not len(self.players):
             return
-        items = []
+        receivers = self.get_update_receivers()
+        if receivers is not None and not receivers:
+            return
         highest_player_id = max(self.players)
-        for i in range(highest_player_id + 1):
-            position = orientation = None
-            try:
-                player = self.players[i]
-                if (not player.filter_visibility_data and
-                        not player.team.spectator):
-                    world_object = player.world_object
-                    position = world_object.position.get()
-                    orientation = world_object.orientation.get()
-            except (KeyError, TypeError, AttributeError):
-                pass
-            if position is None:
-                position = (0.0, 0.0, 0.0)
-                orientation = (0.0, 0.0, 0.0)
-            items.append((position, orientation))
-        world_update = loaders.WorldUpdate()
-        # we only want to send as many items of the player list as needed, so
-        # we slice it off at the highest player id
-        world_update.items = items[:highest_player_id+1]
-        self.broadcast_contained(world_update, unsequenced=True)
+        for player in self.players.values():
+            world_object = player.world_object
+            if world_object is not None:
+                world_object.network_visible = not (
+                    player.filter_visibility_data or
+                    player.team is None or player.team.spectator)
+                if player.team is not None:
+                    world_object.network_team = player.team.id
+        # characters keep their slots in the world's WorldUpdate buffer up to
+        # date, so we only need to copy out the slots up to the highest
+        # player id
+        if not self.interest_management:
+            world_update = loaders.WorldUpdate()
+            world_update.data = self.world.get_network_data(
+                highest_player_id + 1)
+            if receivers is not None:
+                self.broadcast_contained(world_update, unsequenced=True,
+                                         rule=receivers.__contains__)
+            else:
+                self.broadcast_contained(world_update, unsequenced=True)
+            return
+        self.world.update_visibility()
+        packets = {}
+        for player in self.connections.values():
+            if player.player_id is None or player.saved_loaders is not None:
+                continue
+            if receivers is not None and player not in receivers:
+                continue
+            viewer = player.player_id
+            if (player.world_object is None or
+                    player.filter_visibility_data):
+                viewer = -1
+            data = self.world.get_network_data_for(
+                viewer, highest_player_id + 1)
+            # most players on the same team see the same set of players, so
+            # share packets between them where possible
+            packet = packets.get(data)
+            if packet is None:
+                world_update = loaders.WorldUpdate()
+                world_update.data = data
+                packet = enet.Packet(bytes(world_update.generate()),
+                                     enet.PACKET_FLAG_UNSEQUENCED)
+                packets[data] = packet
+            player.peer.send(0, packet)
+
+    def get_map_generator(self):
+        """return a generator for the map data sent to a joining player"""
+        if self.map_cache is not None:
+            return self.map_cache.get_generator()
+        return ProgressiveMapGenerator(self.map)
 
     def set_map(self, map_obj):
+        if self.connectivity_index:
+            map_obj.enable_connectivity_index()
         self.map = map_obj
+        if self.cache_map_data:
+            self.map_cache = MapCache(map_obj)
+            # compress it in the background now instead of when the first
+            # player joins
+            self.map_cache.update()
+        else:
+            self.map_cache = None
         self.world.map = map_obj
         self.on_map_change(map_obj)
         self.team_1.initialize()
@@ -300,7 +413,11 @@ class ServerProtocol(BaseProtocol):
             self.reset_tc()
         self.players = {}
         if self.connections:
-            data = ProgressiveMapGenerator(self.map, parent=True)
+            if self.map_cache is not None:
+                get_generator = self.map_cache.get_generator
+            else:
+                get_generator = ProgressiveMapGenerator(
+                    self.map, parent=True).get_child
             for connection in list(self.connections.values()):
                 if connection.player_id is None:
                     continue
@@ -309,7 +426,7 @@ class ServerProtocol(BaseProtocol):
                     continue
                 connection.reset()
                 connection._send_connection_data()
-                connection.send_map(data.get_child())
+                connection.send_map(get_generator())
         self.update_entities()
 
     def reset_game(self, player=None, territory=None):
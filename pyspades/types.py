@@ -23,6 +23,8 @@ IDPool is used to distribute the IDs given out by the Server
 AttributeSet is used for testing if various settings are active
 
 MultikeyDict is used to make player names accessible by both id and name
+
+UpdateThrottle is used to send fewer periodic updates to congested peers
 """
 
 import itertools
@@ -118,3 +120,52 @@ class RateLimiter:
 
     def get_events(self) -> list:
         return list(self._window)
+
+
+class UpdateThrottle:
+    """decides which of a stream of periodic updates to send to a peer
+
+    Every ``interval``-th update is sent. The interval doubles (up to
+    ``max_interval``) each time an update is due while the peer is
+    congested, and shrinks by one for every update sent while it is not.
+
+    >>> throttle = UpdateThrottle(max_interval=4)
+    >>> [throttle.update(congested=True) for _ in range(8)]
+    [False, False, False, False, False, False, True, False]
+    >>> throttle.interval
+    4
+    >>> [throttle.update(congested=False) for _ in range(4)]
+    [False, False, True, False]
+    >>> throttle.interval
+    3
+    """
+
+    def __init__(self, max_interval: int = 8) -> None:
+        self.max_interval = max_interval
+        self.interval = 1
+        self.sent = 0
+        self.skipped = 0
+        self._counter = 0
+
+    def update(self, congested: bool) -> bool:
+        """return True if the next update should be sent"""
+        self._counter += 1
+        if self._counter < self.interval:
+            self.skipped += 1
+            return False
+        self._counter = 0
+        if congested:
+            interval = min(self.interval * 2, self.max_interval)
+            if interval != self.interval:
+                # back off right away rather than send this update too
+                self.interval = interval
+                self.skipped += 1
+                return False
+        elif self.interval > 1:
+            self.interval -= 1
+        self.sent += 1
+        return True
+
+    def skip(self) -> None:
+        """record an update that was not sent for other reasons"""
+        self.skipped += 1
@@ -4,32 +4,63 @@ cdef extern from "vxl_c.cpp":
         MAP_Y
         MAP_Z
         DEFAULT_COLOR
+        BAND_COUNT
     struct MapData:
-        pass
+        unsigned long long version
+        unsigned long long band_versions[BAND_COUNT]
     struct MapGenerator:
         pass
+    struct Connectivity:
+        pass
+    struct MapSnapshot:
+        pass
     MapGenerator * create_map_generator(MapData * original)
     void delete_map_generator(MapGenerator * generator)
     object get_generator_data(MapGenerator * generator, int columns)
-    MapData * load_vxl(unsigned char * v)
+    MapData * load_vxl(const unsigned char * v, size_t size, int threads) nogil
     MapData * copy_map(MapData * map)
     void delete_vxl(MapData * map)
     object save_vxl(MapData * map)
+    object save_map_cache(MapData * map)
+    MapData * load_map_cache(const unsigned char * v, size_t size,
+        int threads) nogil
+    object save_band(MapData * map, int band)
+    MapSnapshot * create_map_snapshot(MapData * map)
+    void encode_map_snapshot(MapSnapshot * snapshot, int threads) nogil
+    void apply_map_snapshot(MapData * map, MapSnapshot * snapshot)
+    object get_snapshot_band(MapSnapshot * snapshot, int band)
+    void delete_map_snapshot(MapSnapshot * snapshot)
     int check_node(int x, int y, int z, MapData * map, int destroy)
     bint get_solid(int x, int y, int z, MapData * map)
     int get_color(int x, int y, int z, MapData * map)
+    int get_z(int x, int y, int start, MapData * map)
+    int get_height(int x, int y, MapData * map)
     void set_point(int x, int y, int z, MapData * map, bint solid, int color)
     void set_column_solid(int x, int y, int start_z, int end_z,
         MapData * map, bint solid)
     void set_column_color(int x, int y, int start_z, int end_z,
         MapData * map, int color)
+    int count_land(int x1, int y1, int x2, int y2, MapData * map)
     int get_random_point(int x1, int y1, int x2, int y2, MapData * map,
         float random_1, float random_2, int * x, int * y)
     bint is_valid_position(int x, int y, int z)
     void update_shadows(MapData * map)
+    void get_solid_slice(MapData * map, int z, unsigned char * out)
+    void get_top_surface(MapData * map, unsigned char * heights, int * colors)
+    Connectivity * create_connectivity(MapData * map)
+    void delete_connectivity(Connectivity * connectivity)
+    void connectivity_add(int x, int y, int z, MapData * map,
+        Connectivity * connectivity)
+    int connectivity_remove(int x, int y, int z, MapData * map,
+        Connectivity * connectivity, int destroy)
 
 cdef class VXLData:
     cdef MapData * map
+    cdef Connectivity * connectivity
+    cdef bint connectivity_enabled
+
+    cdef Connectivity * get_connectivity(self)
+    cdef void reset_connectivity(self)
 
     cpdef get_solid(self, int x, int y, int z)
     cpdef get_color(self, int x, int y, int z)
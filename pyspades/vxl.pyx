@@ -28,9 +28,64 @@ cdef tuple make_color_tuple(int color):
 cpdef inline int make_color(int r, int g, int b, int a = 255):
     return b | (g << 8) | (r << 16) | (<int>((a / 255.0) * 128) << 24)
 
+import io
+import mmap
+import os
 import time
 import random
 
+# threads used to parse a map or load it from the map cache, and to serialize
+# a snapshot of one
+LOAD_THREADS = min(os.cpu_count() or 1, 8)
+
+def map_file(fp):
+    """Map the file behind fp into memory, or read it if it is not a plain
+    file."""
+    try:
+        fileno = fp.fileno()
+        if fp.tell() != 0:
+            raise io.UnsupportedOperation()
+    except (AttributeError, io.UnsupportedOperation):
+        return fp.read()
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+cdef MapData * parse_vxl(data) except NULL:
+    cdef const unsigned char[::1] view = data
+    cdef size_t size = view.shape[0]
+    cdef int threads = LOAD_THREADS
+    cdef MapData * map
+    if size == 0:
+        raise ValueError('invalid VXL data')
+    # parsing does not touch Python objects, so other threads can keep
+    # running while a map is loaded in the background
+    with nogil:
+        map = load_vxl(&view[0], size, threads)
+    if map == NULL:
+        raise ValueError('invalid VXL data')
+    return map
+
+def load_cache(fp):
+    """Load a map saved with VXLData.get_cache_data from a file. Copies the
+    solid voxels and colors straight into the map instead of parsing them,
+    raises ValueError if the file is not a valid map cache of this
+    machine."""
+    cdef VXLData map = VXLData.__new__(VXLData)
+    data = map_file(fp)
+    cdef const unsigned char[::1] view
+    cdef int threads = LOAD_THREADS
+    try:
+        view = data
+        if view.shape[0] > 0:
+            with nogil:
+                map.map = load_map_cache(&view[0], view.shape[0], threads)
+    finally:
+        view = None
+        if isinstance(data, mmap.mmap):
+            data.close()
+    if map.map == NULL:
+        raise ValueError('invalid map cache')
+    return map
+
 cdef class Generator:
     cdef MapGenerator * generator
     cdef public:
@@ -52,21 +107,92 @@ cdef class Generator:
     def __dealloc__(self):
         delete_map_generator(self.generator)
 
+cdef class Snapshot:
+    """
+    The serialized map as it was when the snapshot was taken, see
+    VXLData.get_snapshot. encode() does the work without holding the GIL and
+    the snapshot does not refer to the map, so it can be used from another
+    thread, one thread at a time.
+    """
+    cdef MapSnapshot * snapshot
+    cdef readonly tuple band_versions
+
+    def __init__(self, VXLData data):
+        self.band_versions = data.get_band_versions()
+        self.snapshot = create_map_snapshot(data.map)
+
+    def encode(self):
+        """serialize the columns of the map, if that was not done yet"""
+        cdef int threads = LOAD_THREADS
+        with nogil:
+            encode_map_snapshot(self.snapshot, threads)
+
+    def get_band_data(self, int band):
+        """like VXLData.get_band_data"""
+        if not 0 <= band < BAND_COUNT:
+            raise IndexError('band out of range')
+        self.encode()
+        return get_snapshot_band(self.snapshot, band)
+
+    def __dealloc__(self):
+        if self.snapshot != NULL:
+            delete_map_snapshot(self.snapshot)
+
 cdef class VXLData:
     def __init__(self, fp = None):
-        cdef unsigned char * c_data
-        if fp is not None:
-            data = fp.read()
-            c_data = data
-        else:
-            c_data = NULL
-        self.map = load_vxl(c_data)
+        if fp is None:
+            self.map = load_vxl(NULL, 0, 1)
+            return
+        # a mapping only pages in the file while it is parsed, instead of
+        # keeping a copy of it around next to the map
+        data = map_file(fp)
+        try:
+            self.map = parse_vxl(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
 
     def load_vxl(self, c_data = None):
-        self.map = load_vxl(c_data)
+        cdef MapData * old_map = self.map
+        if c_data is None:
+            self.map = load_vxl(NULL, 0, 1)
+        else:
+            self.map = parse_vxl(c_data)
+        delete_vxl(old_map)
+        self.reset_connectivity()
+
+    def enable_connectivity_index(self, bint enabled = True):
+        '''
+        Keep track of which blocks are connected to the ground, so that
+        destroy_point only has to check the blocks supported by the destroyed
+        one. Takes 16 MiB and about 0.1 seconds to build. Copies of the map do
+        not inherit it.
+        '''
+        self.connectivity_enabled = enabled
+        if enabled:
+            self.get_connectivity()
+        else:
+            self.reset_connectivity()
+
+    cdef Connectivity * get_connectivity(self):
+        if self.connectivity_enabled and self.connectivity == NULL:
+            self.connectivity = create_connectivity(self.map)
+        return self.connectivity
+
+    cdef void reset_connectivity(self):
+        # called after changes the index does not follow, it is rebuilt the
+        # next time it is needed
+        if self.connectivity != NULL:
+            delete_connectivity(self.connectivity)
+            self.connectivity = NULL
 
     def copy(self):
-        cdef VXLData map = VXLData()
+        '''
+        Returns a copy of the map. The copy shares the chunks of rows the
+        map is stored in until either map changes them, so copying is cheap
+        and only changed chunks take memory of their own.
+        '''
+        cdef VXLData map = VXLData.__new__(VXLData)
         map.map = copy_map(self.map)
         return map
 
@@ -76,8 +202,12 @@ cdef class VXLData:
         return solid, color
 
     def set_point(self, int x, int y, int z, tuple color):
+        cdef Connectivity * connectivity
         if is_valid_position(x, y, z):
             set_point(x, y, z, self.map, 1, make_color(*color))
+            connectivity = self.get_connectivity()
+            if connectivity != NULL:
+                connectivity_add(x, y, z, self.map, connectivity)
 
     # TODO: consider making this function raise error on invalid position
     cpdef get_solid(self, int x, int y, int z):
@@ -101,18 +231,10 @@ cdef class VXLData:
         moving down.  Useful for getting the coordinate for where something
         should be after being dropped.
         '''
-
-        for z in range(start, 64):
-            if get_solid(x, y, z, self.map):
-                return z
-        return 0
+        return get_z(x, y, start, self.map)
 
     cpdef int get_height(self, int x, int y):
-        cdef int start = 63
-        for z in range(start, -1, -1):
-            if not get_solid(x, y, z, self.map):
-                return z + 1
-        return 0
+        return get_height(x, y, self.map)
 
     cpdef tuple get_safe_coords(self, int x, int y, int z):
         '''
@@ -132,31 +254,38 @@ cdef class VXLData:
             random.random(), &x, &y)
         return x, y
 
-    def count_land(self, int x1, y1, x2, y2):
-        cdef int land = 0
-        for x in range(x1, x2):
-            for y in range(y1, y2):
-                if self.get_solid(x, y, 62):
-                    land += 1
-        return land
+    def count_land(self, int x1, int y1, int x2, int y2):
+        """The number of columns with x1 <= x < x2 and y1 <= y < y2 that are
+        solid at z 62, counted from an index the map keeps up to date."""
+        return count_land(x1, y1, x2, y2, self.map)
 
     def destroy_point(self, int x, int y, int z):
+        cdef Connectivity * connectivity
         if not self.get_solid(x, y, z) or z >= 62:
             return 0
         set_point(x, y, z, self.map, 0, 0)
         count = 1
         start = time.monotonic()
-        for node_x, node_y, node_z in self.get_neighbors(x, y, z):
-            if node_z < 62:
-                count += self.check_node(node_x, node_y, node_z, True)
+        connectivity = self.get_connectivity()
+        if connectivity != NULL:
+            count += connectivity_remove(x, y, z, self.map, connectivity, 1)
+        else:
+            for node_x, node_y, node_z in self.get_neighbors(x, y, z):
+                if node_z < 62:
+                    count += check_node(node_x, node_y, node_z, self.map, 1)
         taken = time.monotonic() - start
         if taken > 0.1:
             print('destroying block at', x, y, z, 'took:', taken)
         return count
 
     def remove_point(self, int x, int y, int z):
-        if is_valid_position(x, y, z):
-            set_point(x, y, z, self.map, 0, 0)
+        cdef Connectivity * connectivity
+        if not self.get_solid(x, y, z):
+            return
+        set_point(x, y, z, self.map, 0, 0)
+        connectivity = self.get_connectivity()
+        if connectivity != NULL:
+            connectivity_remove(x, y, z, self.map, connectivity, 0)
 
     cpdef bint has_neighbors(self, int x, int y, int z):
         return (
@@ -192,15 +321,17 @@ cdef class VXLData:
         return neighbors
 
     cpdef int check_node(self, int x, int y, int z, bint destroy = False):
-        return check_node(x, y, z, self.map, destroy)
+        cdef int count = check_node(x, y, z, self.map, destroy)
+        if destroy and count:
+            self.reset_connectivity()
+        return count
 
     cpdef bint build_point(self, int x, int y, int z, tuple color):
         if not is_valid_position(x, y, z):
             return False
         if not self.has_neighbors(x, y, z) or z >= 62:
             return False
-        r, g, b = color
-        set_point(x, y, z, self.map, 1, make_color(*color))
+        self.set_point(x, y, z, color)
         return True
 
     cpdef bint set_column_fast(self, int x, int y, int z_start,
@@ -212,6 +343,7 @@ cdef class VXLData:
             z_end < z_start):
             return False
         set_column_solid(x, y, z_start, z_end, self.map, 1)
+        self.reset_connectivity()
 
         if not is_valid_position(x, y, z_color_end) or z_color_end < z_start:
             return False
@@ -226,21 +358,19 @@ cdef class VXLData:
         cdef unsigned int i, r, g, b, a, color
         data_python = allocate_memory(sizeof(int[512][512]), <char**>&data)
         i = 0
-        cdef int current_z
         if z == -1:
             a = 255
-        else:
-            current_z = z
+            get_top_surface(self.map, NULL, <int *>data)
         for y in range(512):
             for x in range(512):
                 if z == -1:
-                    current_z = self.get_z(x, y)
+                    color = data[i]
                 else:
                     if get_solid(x, y, z, self.map):
                         a = 255
                     else:
                         a = 0
-                color = get_color(x, y, current_z, self.map)
+                    color = get_color(x, y, z, self.map)
                 if rgba:
                     b = color & 0xFF
                     g = (color & 0xFF00) >> 8
@@ -251,6 +381,41 @@ cdef class VXLData:
                 i += 1
         return data_python
 
+    def get_solid_mask(self, int z):
+        '''
+        Returns a 512x512 memoryview of bytes, indexed [y][x], that is 1
+        where the voxel at x, y, z is solid. numpy.asarray() turns it into
+        an array without copying it.
+        '''
+        cdef unsigned char * data
+        if not 0 <= z < MAP_Z:
+            raise IndexError('z out of range')
+        data_python = allocate_memory(MAP_X * MAP_Y, <char**>&data)
+        get_solid_slice(self.map, z, data)
+        return memoryview(data_python).cast('B', (MAP_Y, MAP_X))
+
+    def get_height_map(self):
+        '''
+        Returns a 512x512 memoryview of bytes, indexed [y][x], with what
+        get_z(x, y) returns for every column.
+        '''
+        cdef unsigned char * data
+        data_python = allocate_memory(MAP_X * MAP_Y, <char**>&data)
+        get_top_surface(self.map, data, NULL)
+        return memoryview(data_python).cast('B', (MAP_Y, MAP_X))
+
+    def get_color_map(self):
+        '''
+        Returns a 512x512 memoryview of unsigned ints, indexed [y][x], with
+        the color of the voxel at the top of every column, as 0xAARRGGBB
+        where the alpha channel holds the shade from update_shadows.
+        '''
+        cdef int * data
+        data_python = allocate_memory(sizeof(int) * MAP_X * MAP_Y,
+                                      <char**>&data)
+        get_top_surface(self.map, NULL, data)
+        return memoryview(data_python).cast('I', (MAP_Y, MAP_X))
+
     def set_overview(self, data_str, int z):
         cdef unsigned int * data
         cdef unsigned int r, g, b, a, color, i, new_color
@@ -265,6 +430,7 @@ cdef class VXLData:
                 else:
                     set_point(x, y, z, self.map, 1, color)
                 i += 1
+        self.reset_connectivity()
 
     def generate(self):
         start = time.monotonic()
@@ -274,11 +440,51 @@ cdef class VXLData:
             print('VXLData.generate() took {}'.format(dt))
         return data
 
+    def get_cache_data(self):
+        """The map in the format of the map cache, see load_cache."""
+        return save_map_cache(self.map)
+
     def get_generator(self):
         return Generator(self)
 
+    def get_band_versions(self):
+        '''
+        Returns the version of each band of rows the map is serialized in.
+        A band that has the same version as before still serializes to the
+        same data, also when it is compared to a copy of the map.
+        '''
+        return tuple([self.map.band_versions[band]
+                      for band in range(BAND_COUNT)])
+
+    def get_band_data(self, int band):
+        '''
+        Returns the serialized columns of one band of rows. Joined together,
+        the bands of a map make up the data returned by generate().
+        '''
+        if not 0 <= band < BAND_COUNT:
+            raise IndexError('band out of range')
+        return save_band(self.map, band)
+
+    def get_snapshot(self):
+        '''
+        Returns a Snapshot of the map as it is now. Like copy(), this only
+        copies pointers to the chunks of the map, the columns are serialized
+        when the snapshot is encoded.
+        '''
+        return Snapshot(self)
+
+    def reuse_snapshot(self, Snapshot snapshot):
+        '''
+        Keeps the columns serialized for an encoded snapshot, so that
+        generate() only has to serialize the columns that changed since the
+        snapshot was taken. Does nothing unless it is the last snapshot taken
+        of this map.
+        '''
+        apply_map_snapshot(self.map, snapshot.snapshot)
+
     def __dealloc__(self):
         cdef MapData * map
+        self.reset_connectivity()
         if self.map != NULL:
             map = self.map
             self.map = NULL
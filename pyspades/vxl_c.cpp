@@ -21,6 +21,9 @@
 #include "vxl_c.h"
 #include "Python.h"
 #include <vector>
+#include <string.h>
+#include <system_error>
+#include <thread>
 
 using namespace std;
 
@@ -36,62 +39,143 @@ void inline limit(int *value, int min, int max)
     }
 }
 
-MapData *load_vxl(unsigned char *v)
+// find where each column starts in VXL data and how many colors it has, by
+// walking the span headers. Returns false if the data is cut off or has
+// spans outside of the map.
+static bool index_vxl(const unsigned char *v, size_t size,
+                      const unsigned char **starts, uint32_t *counts)
 {
-    MapData *map = new MapData;
-    if (v == NULL)
-        return map;
-    int x, y, z;
-    for (y = 0; y < 512; ++y)
+    const unsigned char *end = v + size;
+    for (int i = 0; i < COLUMN_COUNT; i++)
     {
-        for (x = 0; x < 512; ++x)
+        starts[i] = v;
+        uint32_t count = 0;
+        int len_top = 0;
+        for (;;)
         {
-            for (z = 0; z < 64; ++z)
+            if (end - v < 4)
+                return false;
+            int number_4byte_chunks = v[0];
+            int top_color_start = v[1];
+            int top_color_end = v[2];
+            int air_start = v[3];
+            int len_bottom = top_color_end - top_color_start + 1;
+            if (top_color_end >= MAP_Z || len_bottom < 0 ||
+                air_start > MAP_Z || air_start < len_top)
+                return false;
+            if (number_4byte_chunks == 0)
             {
-                map->geometry[get_pos(x, y, z)] = 1;
+                if (end - v < 4 * (len_bottom + 1))
+                    return false;
+                count += len_bottom;
+                v += 4 * (len_bottom + 1);
+                break;
             }
-            z = 0;
-            for (;;)
-            {
-                int *color;
-                int i;
-                int number_4byte_chunks = v[0];
-                int top_color_start = v[1];
-                int top_color_end = v[2]; // inclusive
-                int bottom_color_start;
-                int bottom_color_end; // exclusive
-                int len_top;
-                int len_bottom;
-                for (i = z; i < top_color_start; i++)
-                    map->geometry[get_pos(x, y, i)] = 0;
-                color = (int *)(v + 4);
-                for (z = top_color_start; z <= top_color_end; z++)
-                    map->colors[get_pos(x, y, z)] = *color++;
-                len_bottom = top_color_end - top_color_start + 1;
-
-                // check for end of data marker
-                if (number_4byte_chunks == 0)
-                {
-                    // infer ACTUAL number of 4-byte chunks from the length of the color data
-                    v += 4 * (len_bottom + 1);
-                    break;
-                }
+            len_top = (number_4byte_chunks - 1) - len_bottom;
+            if (len_top < 0 || end - v < 4 * number_4byte_chunks)
+                return false;
+            count += number_4byte_chunks - 1;
+            v += 4 * number_4byte_chunks;
+        }
+        counts[i] = count;
+    }
+    return true;
+}
 
-                // infer the number of bottom colors in next span from chunk length
-                len_top = (number_4byte_chunks - 1) - len_bottom;
+static void load_column(MapData *map, int x, int y, const unsigned char *v)
+{
+    // collect the solid voxels in a mask, which is how the geometry stores
+    // a column
+    uint64_t solid = ~(uint64_t)0;
+    int column = get_pos(x, y, 0);
+    int z = 0;
+    for (;;)
+    {
+        const int *color;
+        int number_4byte_chunks = v[0];
+        int top_color_start = v[1];
+        int top_color_end = v[2]; // inclusive
+        int bottom_color_start;
+        int bottom_color_end; // exclusive
+        int len_top;
+        int len_bottom;
+        solid &= ~bit_range64(z, top_color_start);
+        color = (const int *)(v + 4);
+        for (z = top_color_start; z <= top_color_end; z++)
+            map->colors.append(column + z * COLUMN_COUNT, *color++);
+        len_bottom = top_color_end - top_color_start + 1;
+
+        // check for end of data marker
+        if (number_4byte_chunks == 0)
+            break;
+
+        // infer the number of bottom colors in next span from chunk length
+        len_top = (number_4byte_chunks - 1) - len_bottom;
+
+        // now skip the v pointer past the data to the beginning of the next span
+        v += v[0] * 4;
+
+        bottom_color_end = v[3]; // aka air start
+        bottom_color_start = bottom_color_end - len_top;
+        for (z = bottom_color_start; z < bottom_color_end; ++z)
+        {
+            map->colors.append(column + z * COLUMN_COUNT, *color++);
+        }
+    }
+    map->geometry.set_column(column, solid);
+}
 
-                // now skip the v pointer past the data to the beginning of the next span
-                v += v[0] * 4;
+static void load_rows(MapData *map, const unsigned char **starts,
+                      int y_start, int y_end)
+{
+    for (int y = y_start; y < y_end; y++)
+    {
+        for (int x = 0; x < MAP_X; x++)
+            load_column(map, x, y, starts[get_pos(x, y, 0)]);
+    }
+}
 
-                bottom_color_end = v[3]; // aka air start
-                bottom_color_start = bottom_color_end - len_top;
-                for (z = bottom_color_start; z < bottom_color_end; ++z)
-                {
-                    map->colors[get_pos(x, y, z)] = *color++;
-                }
-            }
+// parse size bytes of VXL data, splitting the rows of the map between the
+// given number of threads. Different rows never share words of the geometry
+// chunks, and the color pools are laid out up front, so the threads do not
+// need to synchronize. Does not need the GIL. Returns NULL if the data is
+// invalid.
+MapData *load_vxl(const unsigned char *v, size_t size, int threads)
+{
+    MapData *map = new MapData;
+    if (v == NULL)
+        return map;
+    vector<const unsigned char *> starts(COLUMN_COUNT);
+    vector<uint32_t> counts(COLUMN_COUNT);
+    if (!index_vxl(v, size, &starts[0], &counts[0]))
+    {
+        delete map;
+        return NULL;
+    }
+    map->colors.reserve_columns(&counts[0]);
+#ifdef VXL_HASH_COLORS
+    // the hash map can only be filled from one thread
+    threads = 1;
+#endif
+    threads = std::max(1, std::min(threads, MAP_Y));
+    vector<std::thread> workers;
+    for (int t = 1; t < threads; t++)
+    {
+        int y_start = MAP_Y * t / threads;
+        int y_end = MAP_Y * (t + 1) / threads;
+        try
+        {
+            workers.push_back(std::thread(load_rows, map, &starts[0],
+                                          y_start, y_end));
+        }
+        catch (const std::system_error &)
+        {
+            load_rows(map, &starts[0], y_start, y_end);
         }
     }
+    load_rows(map, &starts[0], 0, MAP_Y / threads);
+    for (size_t t = 0; t < workers.size(); t++)
+        workers[t].join();
     return map;
 }
 
@@ -100,136 +184,550 @@ void inline delete_vxl(MapData *map)
     delete map;
 }
 
-struct Position
+// the map cache format: the solid voxels and colors of every chunk as they
+// are stored in memory, so that loading a map from it is a copy instead of
+// a parse. After the header, every chunk holds its geometry columns, the
+// color mask of each column, the number of colors and the colors in column
+// and z order. Written in the byte order of the machine, as the cache is
+// only meant to be read where it was written.
+#define MAP_CACHE_MAGIC "VXLCACHE"
+#define MAP_CACHE_VERSION 1
+#define MAP_CACHE_BYTE_ORDER 0x01020304
+
+struct MapCacheHeader
 {
-    int x;
-    int y;
-    int z;
+    char magic[8];
+    uint32_t version;
+    uint32_t byte_order;
 };
 
-#define NODE_RESERVE_SIZE 250000
-static Position *nodes = NULL;
-static int node_pos;
-static int nodes_size;
-static set_type<int> marked;
+template <typename T>
+inline void append_data(vector<char> &data, const T *values, size_t count)
+{
+    const char *start = (const char *)values;
+    data.insert(data.end(), start, start + count * sizeof(T));
+}
 
-inline void push_back_node(int x, int y, int z)
+PyObject *save_map_cache(MapData *map)
 {
-    nodes[node_pos].x = x;
-    nodes[node_pos].y = y;
-    nodes[node_pos].z = z;
-    node_pos++;
+    MapCacheHeader header;
+    memcpy(header.magic, MAP_CACHE_MAGIC, sizeof(header.magic));
+    header.version = MAP_CACHE_VERSION;
+    header.byte_order = MAP_CACHE_BYTE_ORDER;
+    vector<char> data;
+    append_data(data, &header, 1);
+    vector<uint64_t> masks(CHUNK_COLUMNS);
+    vector<int> colors;
+    for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+    {
+        append_data(data, map->geometry.get_chunk(chunk).columns,
+                    CHUNK_COLUMNS);
+        colors.clear();
+        map->colors.get_chunk(chunk).save_columns(chunk, &masks[0], colors);
+        append_data(data, &masks[0], CHUNK_COLUMNS);
+        uint32_t count = (uint32_t)colors.size();
+        append_data(data, &count, 1);
+        append_data(data, colors.data(), colors.size());
+    }
+    return PyBytes_FromStringAndSize(&data[0], data.size());
 }
 
-inline const Position *pop_back_node()
+#define CACHE_COLUMNS_SIZE (CHUNK_COLUMNS * sizeof(uint64_t))
+
+// copy chunks first to last - 1 of a map cache into a new map, starts[chunk]
+// pointing to the data of each chunk. Sets *valid to 0 if they are invalid.
+static void load_cache_chunks(MapData *map,
+                              const unsigned char *const *starts, int first,
+                              int last, char *valid)
 {
-    return &nodes[--node_pos];
+    vector<uint64_t> masks(CHUNK_COLUMNS);
+    for (int chunk = first; chunk < last; chunk++)
+    {
+        const unsigned char *v = starts[chunk];
+        GeometryChunk &geometry = map->geometry.edit_chunk(chunk);
+        memcpy(geometry.columns, v, CACHE_COLUMNS_SIZE);
+        geometry.update_land();
+        memcpy(&masks[0], v + CACHE_COLUMNS_SIZE, CACHE_COLUMNS_SIZE);
+        uint32_t count;
+        memcpy(&count, v + CACHE_COLUMNS_SIZE * 2, sizeof(count));
+        // only solid voxels have colors
+        uint64_t colors = 0;
+        uint64_t air_colors = 0;
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            air_colors |= masks[i] & ~geometry.columns[i];
+            colors += popcount64(masks[i]);
+        }
+        if (air_colors || colors != count)
+        {
+            *valid = 0;
+            return;
+        }
+        map->colors.edit_chunk(chunk).load_columns(
+            chunk, &masks[0], v + CACHE_COLUMNS_SIZE * 2 + sizeof(count));
+    }
 }
 
-inline void add_node(int x, int y, int z, MapData *map)
+// load a map saved with save_map_cache, splitting the chunks between up to
+// threads threads. Returns NULL if the data is not a valid map cache.
+MapData *load_map_cache(const unsigned char *v, size_t size, int threads)
+{
+    const unsigned char *end = v + size;
+    MapCacheHeader header;
+    if (size < sizeof(header))
+        return NULL;
+    memcpy(&header, v, sizeof(header));
+    if (memcmp(header.magic, MAP_CACHE_MAGIC, sizeof(header.magic)) != 0 ||
+        header.version != MAP_CACHE_VERSION ||
+        header.byte_order != MAP_CACHE_BYTE_ORDER)
+        return NULL;
+    v += sizeof(header);
+    const unsigned char *starts[CHUNK_COUNT];
+    for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+    {
+        uint32_t count;
+        if ((size_t)(end - v) < CACHE_COLUMNS_SIZE * 2 + sizeof(count))
+            return NULL;
+        starts[chunk] = v;
+        memcpy(&count, v + CACHE_COLUMNS_SIZE * 2, sizeof(count));
+        v += CACHE_COLUMNS_SIZE * 2 + sizeof(count);
+        if ((size_t)(end - v) / sizeof(int) < count)
+            return NULL;
+        v += count * sizeof(int);
+    }
+    if (v != end)
+        return NULL;
+    MapData *map = new MapData;
+#ifdef VXL_HASH_COLORS
+    // the hash maps of the chunks are filled with set, one chunk at a time
+    threads = 1;
+#endif
+    threads = std::max(1, std::min(threads, CHUNK_COUNT));
+    vector<char> valid(threads, 1);
+    vector<std::thread> workers;
+    for (int t = 1; t < threads; t++)
+    {
+        int first = CHUNK_COUNT * t / threads;
+        int last = CHUNK_COUNT * (t + 1) / threads;
+        try
+        {
+            workers.push_back(std::thread(load_cache_chunks, map, starts,
+                                          first, last, &valid[t]));
+        }
+        catch (const std::system_error &)
+        {
+            load_cache_chunks(map, starts, first, last, &valid[t]);
+        }
+    }
+    load_cache_chunks(map, starts, 0, CHUNK_COUNT / threads, &valid[0]);
+    for (size_t t = 0; t < workers.size(); t++)
+        workers[t].join();
+    if (std::find(valid.begin(), valid.end(), 0) != valid.end())
+    {
+        delete map;
+        return NULL;
+    }
+    return map;
+}
+
+// state of check_node, kept between calls so that a check does not allocate
+// once the buffers have grown to the size of the largest structure seen.
+// visited has a bit per voxel, which is cleared again through visited_nodes
+// before check_node returns.
+#define NODE_RESERVE_SIZE 250000
+static std::bitset<MAP_X * MAP_Y * MAP_Z> *visited = NULL;
+static vector<int> visited_nodes;
+static vector<int> node_stack;
+
+// mark a solid voxel as visited and queue it. Returns 1 if the voxel is part
+// of the ground.
+inline int add_node(int x, int y, int z, MapData *map)
 {
     if (x < 0 || x > 511 ||
         y < 0 || y > 511 ||
         z < 0 || z > 63)
+        return 0;
+    int i = get_pos(x, y, z);
+    if (!map->geometry[i] || (*visited)[i])
+        return 0;
+    if (z >= 62)
+        return 1;
+    visited->set(i);
+    visited_nodes.push_back(i);
+    node_stack.push_back(i);
+    return 0;
+}
+
+// follow the solid voxels straight below (x, y, z). Returns 1 if they reach
+// the ground. Most structures stand on something, so this finds the ground
+// without spreading sideways first.
+inline int add_column(int x, int y, int z, MapData *map)
+{
+    for (z++; z < MAP_Z; z++)
+    {
+        int i = get_pos(x, y, z);
+        if (!map->geometry[i] || (*visited)[i])
+            return 0;
+        if (z >= 62)
+            return 1;
+        visited->set(i);
+        visited_nodes.push_back(i);
+        node_stack.push_back(i);
+    }
+    return 0;
+}
+
+inline void touch_voxel(MapData *map, int i)
+{
+    touch_column(map, i % MAP_X, (i / MAP_X) % MAP_Y);
+}
+
+inline void init_nodes()
+{
+    if (visited != NULL)
         return;
-    if (!map->geometry[get_pos(x, y, z)])
-        return;
-    push_back_node(x, y, z);
+    visited = new std::bitset<MAP_X * MAP_Y * MAP_Z>();
+    visited_nodes.reserve(NODE_RESERVE_SIZE);
+    node_stack.reserve(NODE_RESERVE_SIZE);
+}
+
+inline void clear_visited(MapData *map, int destroy)
+{
+    for (vector<int>::const_iterator iter = visited_nodes.begin();
+         iter != visited_nodes.end(); ++iter)
+    {
+        visited->reset(*iter);
+        if (destroy)
+        {
+            map->geometry.reset(*iter);
+            map->colors.erase(*iter);
+            touch_voxel(map, *iter);
+        }
+    }
+    visited_nodes.clear();
+    node_stack.clear();
 }
 
+// check if the voxel at (x, y, z) is connected to the ground. Returns 0 if
+// it is, or else the number of voxels of the floating structure it is part
+// of, which are removed if destroy is set.
 int check_node(int x, int y, int z, MapData *map, int destroy)
 {
-    if (nodes == NULL)
+    if (z >= 62)
+        return 0;
+    init_nodes();
+
+    int i = get_pos(x, y, z);
+    visited->set(i);
+    visited_nodes.push_back(i);
+    node_stack.push_back(i);
+
+    while (!node_stack.empty())
     {
-        nodes = (Position *)malloc(sizeof(Position) * NODE_RESERVE_SIZE);
-        nodes_size = NODE_RESERVE_SIZE;
+        i = node_stack.back();
+        node_stack.pop_back();
+        get_xyz(i, &x, &y, &z);
+        if (add_column(x, y, z, map) ||
+            add_node(x, y - 1, z, map) ||
+            add_node(x, y + 1, z, map) ||
+            add_node(x - 1, y, z, map) ||
+            add_node(x + 1, y, z, map) ||
+            add_node(x, y, z - 1, map))
+        {
+            clear_visited(map, 0);
+            return 0;
+        }
     }
-    node_pos = 0;
 
-    push_back_node(x, y, z);
+    int ret = (int)visited_nodes.size();
+    clear_visited(map, destroy);
+    return ret;
+}
+
+// ground connectivity index. Every solid voxel that is connected to the
+// ground links to a neighbour on its way there, which makes a spanning forest
+// rooted in the ground. Removing a voxel can then only disconnect the voxels
+// linked through it, so only those have to be looked at instead of searching
+// for the ground from every neighbour.
+#define LINK_NONE 0 // not connected to the ground
+#define LINK_GROUND 7 // part of the ground, z >= 62
+// other links are 1 + the direction of the neighbour linked to. Directions
+// come in opposite pairs, so d ^ 1 is the direction back.
+static const int direction_x[6] = {0, 0, 0, 0, -1, 1};
+static const int direction_y[6] = {0, 0, -1, 1, 0, 0};
+static const int direction_z[6] = {1, -1, 0, 0, 0, 0};
+#define LINK_TO(d) ((d) + 1)
+#define LINK_FROM(d) (((d) ^ 1) + 1)
+
+struct Connectivity
+{
+    uint8_t links[MAP_X * MAP_Y * MAP_Z];
+};
+
+static vector<int> link_queue;
+
+// index of the neighbour of voxel i in direction d, or -1 if that is outside
+// of the map
+inline int get_neighbor(int i, int d)
+{
+    int x, y, z;
+    get_xyz(i, &x, &y, &z);
+    x += direction_x[d];
+    y += direction_y[d];
+    z += direction_z[d];
+    if (!is_valid_position(x, y, z))
+        return -1;
+    return get_pos(x, y, z);
+}
 
-    while (node_pos > 0)
+// link all unconnected solid voxels that can be reached from the voxels in
+// link_queue
+inline void link_queued(MapData *map, Connectivity *connectivity)
+{
+    uint8_t *links = connectivity->links;
+    for (size_t head = 0; head < link_queue.size(); head++)
     {
-        if (node_pos >= nodes_size - 6)
+        int i = link_queue[head];
+        for (int d = 0; d < 6; d++)
         {
-            nodes_size += NODE_RESERVE_SIZE;
-            nodes = (Position *)realloc((void *)nodes,
-                                        sizeof(Position) * nodes_size);
+            int j = get_neighbor(i, d);
+            if (j < 0 || !map->geometry[j] || links[j] != LINK_NONE)
+                continue;
+            links[j] = LINK_FROM(d);
+            link_queue.push_back(j);
         }
-        const Position *current_node = pop_back_node();
-        z = current_node->z;
-        if (z >= 62)
+    }
+    link_queue.clear();
+}
+
+Connectivity *create_connectivity(MapData *map)
+{
+    Connectivity *connectivity = new Connectivity;
+    uint8_t *links = connectivity->links;
+    memset(links, LINK_NONE, sizeof(connectivity->links));
+    int x, y, z;
+    // most voxels stand on a column that reaches the ground, so link those
+    // straight down first
+    for (y = 0; y < MAP_Y; y++)
+    {
+        for (x = 0; x < MAP_X; x++)
         {
-            marked.clear();
-            return 0;
+            for (z = 63; z >= 0; z--)
+            {
+                int i = get_pos(x, y, z);
+                if (!map->geometry[i])
+                {
+                    if (z >= 62)
+                        continue;
+                    break;
+                }
+                if (z >= 62)
+                    links[i] = LINK_GROUND;
+                else if (links[get_pos(x, y, z + 1)] != LINK_NONE)
+                    links[i] = LINK_TO(0);
+                else
+                    break;
+            }
+        }
+    }
+    // then spread sideways from those columns to overhangs and structures
+    for (y = 0; y < MAP_Y; y++)
+    {
+        for (x = 0; x < MAP_X; x++)
+        {
+            for (z = 63; z >= 0; z--)
+            {
+                int i = get_pos(x, y, z);
+                if (links[i] == LINK_NONE)
+                {
+                    if (z >= 62)
+                        continue;
+                    break;
+                }
+                for (int d = 2; d < 6; d++)
+                {
+                    int j = get_neighbor(i, d);
+                    if (j < 0 || !map->geometry[j] || links[j] != LINK_NONE)
+                        continue;
+                    links[j] = LINK_FROM(d);
+                    link_queue.push_back(j);
+                }
+            }
         }
-        x = current_node->x;
-        y = current_node->y;
+    }
+    link_queued(map, connectivity);
+    return connectivity;
+}
 
-        int i = get_pos(x, y, z);
+void delete_connectivity(Connectivity *connectivity)
+{
+    delete connectivity;
+}
 
-        // already visited?
-        pair<set_type<int>::iterator, bool> ret;
-        ret = marked.insert(i);
-        if (ret.second)
+// update the index after the voxel at (x, y, z) has been made solid
+void connectivity_add(int x, int y, int z, MapData *map,
+                      Connectivity *connectivity)
+{
+    uint8_t *links = connectivity->links;
+    int i = get_pos(x, y, z);
+    if (links[i] != LINK_NONE)
+        return;
+    if (z >= 62)
+        links[i] = LINK_GROUND;
+    else
+    {
+        for (int d = 0; d < 6; d++)
         {
-            add_node(x, y, z - 1, map);
-            add_node(x, y - 1, z, map);
-            add_node(x, y + 1, z, map);
-            add_node(x - 1, y, z, map);
-            add_node(x + 1, y, z, map);
-            add_node(x, y, z + 1, map);
+            int j = get_neighbor(i, d);
+            if (j >= 0 && map->geometry[j] && links[j] != LINK_NONE)
+            {
+                links[i] = LINK_TO(d);
+                break;
+            }
         }
+        if (links[i] == LINK_NONE)
+            return;
     }
+    // this may have connected floating voxels next to it
+    link_queue.push_back(i);
+    link_queued(map, connectivity);
+}
 
-    // destroy the node's path!
+// update the index after the voxel at (x, y, z) has been removed. Returns
+// the number of voxels that are no longer connected to the ground, which are
+// removed as well if destroy is set.
+int connectivity_remove(int x, int y, int z, MapData *map,
+                        Connectivity *connectivity, int destroy)
+{
+    uint8_t *links = connectivity->links;
+    int i = get_pos(x, y, z);
+    int d, j;
+    int link = links[i];
+    links[i] = LINK_NONE;
+    if (link == LINK_NONE)
+    {
+        // anything next to an unconnected voxel is floating already
+        int count = 0;
+        for (d = 0; d < 6; d++)
+        {
+            j = get_neighbor(i, d);
+            if (j < 0 || !map->geometry[j])
+                continue;
+            int node_x, node_y, node_z;
+            get_xyz(j, &node_x, &node_y, &node_z);
+            count += check_node(node_x, node_y, node_z, map, destroy);
+        }
+        return count;
+    }
 
-    if (destroy)
+    // collect the voxels that were linked to the ground through this one
+    init_nodes();
+    node_stack.push_back(i);
+    while (!node_stack.empty())
     {
-        for (set_type<int>::const_iterator iter = marked.begin();
-             iter != marked.end(); ++iter)
+        int node = node_stack.back();
+        node_stack.pop_back();
+        for (d = 0; d < 6; d++)
         {
-            map->geometry[*iter] = 0;
-            map->colors.erase(*iter);
+            j = get_neighbor(node, d);
+            if (j < 0 || links[j] != LINK_FROM(d) || (*visited)[j])
+                continue;
+            visited->set(j);
+            visited_nodes.push_back(j);
+            node_stack.push_back(j);
         }
     }
 
-    int ret = (int)marked.size();
-    marked.clear();
-    return ret;
+    // link them again through any neighbour that is still connected, and
+    // everything collected that can be reached from there
+    for (vector<int>::const_iterator iter = visited_nodes.begin();
+         iter != visited_nodes.end(); ++iter)
+    {
+        int node = *iter;
+        if (!(*visited)[node])
+            continue;
+        for (d = 0; d < 6; d++)
+        {
+            j = get_neighbor(node, d);
+            if (j < 0 || !map->geometry[j] || links[j] == LINK_NONE ||
+                (*visited)[j])
+                continue;
+            links[node] = LINK_TO(d);
+            visited->reset(node);
+            link_queue.push_back(node);
+            break;
+        }
+        for (size_t head = 0; head < link_queue.size(); head++)
+        {
+            int linked = link_queue[head];
+            for (d = 0; d < 6; d++)
+            {
+                j = get_neighbor(linked, d);
+                if (j < 0 || !(*visited)[j])
+                    continue;
+                links[j] = LINK_FROM(d);
+                visited->reset(j);
+                link_queue.push_back(j);
+            }
+        }
+        link_queue.clear();
+    }
+
+    // whatever is left is floating
+    int count = 0;
+    for (vector<int>::const_iterator iter = visited_nodes.begin();
+         iter != visited_nodes.end(); ++iter)
+    {
+        int node = *iter;
+        if (!(*visited)[node])
+            continue;
+        visited->reset(node);
+        links[node] = LINK_NONE;
+        count++;
+        if (destroy)
+        {
+            map->geometry.reset(node);
+            map->colors.erase(node);
+            touch_voxel(map, node);
+        }
+    }
+    visited_nodes.clear();
+    return count;
 }
 
 // write_map/save_vxl function from stb/nothings - thanks a lot for the
 // public-domain code!
 
-inline int is_surface(MapData *map, int x, int y, int z)
+// the voxels of column x, y that are on the surface: solid voxels next to
+// an air voxel, or at the top of the map. Voxels outside of the map count as
+// solid.
+inline uint64_t get_surface(MapData *map, int x, int y)
 {
-    if (map->geometry[get_pos(x, y, z)] == 0)
-        return 0;
-    if (z == 0)
-        return 1;
-    if (x > 0 && map->geometry[get_pos(x - 1, y, z)] == 0)
-        return 1;
-    if (x + 1 < 512 && map->geometry[get_pos(x + 1, y, z)] == 0)
-        return 1;
-    if (y > 0 && map->geometry[get_pos(x, y - 1, z)] == 0)
-        return 1;
-    if (y + 1 < 512 && map->geometry[get_pos(x, y + 1, z)] == 0)
-        return 1;
-    if (z > 0 && map->geometry[get_pos(x, y, z - 1)] == 0)
-        return 1;
-    if (z + 1 < 64 && map->geometry[get_pos(x, y, z + 1)] == 0)
-        return 1;
-    return 0;
+    uint64_t solid = map->geometry.get_column(get_pos(x, y, 0));
+    uint64_t inside = solid << 1; // voxel z - 1 is solid
+    inside &= (solid >> 1) | ((uint64_t)1 << (MAP_Z - 1)); // and z + 1
+    if (x > 0)
+        inside &= map->geometry.get_column(get_pos(x - 1, y, 0));
+    if (x + 1 < MAP_X)
+        inside &= map->geometry.get_column(get_pos(x + 1, y, 0));
+    if (y > 0)
+        inside &= map->geometry.get_column(get_pos(x, y - 1, 0));
+    if (y + 1 < MAP_Y)
+        inside &= map->geometry.get_column(get_pos(x, y + 1, 0));
+    return solid & ~inside;
+}
+
+inline int has_bit(uint64_t mask, int z)
+{
+    return z < MAP_Z && ((mask >> z) & 1);
 }
 
 inline int get_write_color(MapData *map, int x, int y, int z)
 {
-    map_type<int, int>::const_iterator iter = map->colors.find(
-        get_pos(x, y, z));
-    if (iter == map->colors.end())
+    int color;
+    if (!map->colors.get(get_pos(x, y, z), &color))
         return DEFAULT_COLOR;
-    return iter->second;
+    return color;
 }
 
 inline void write_color(char **pos, int color)
@@ -245,111 +743,210 @@ inline void write_color(char **pos, int color)
     *pos += 4;
 }
 
-char *out_global = 0;
-
-void create_temp()
+// write the spans of column i, j to out, returns the end of the written data
+inline char *write_column(MapData *map, int i, int j, char *out)
 {
-    if (out_global == 0)
-        out_global = (char *)malloc(10 * 1024 * 1024); // allocate 10 mb
+    uint64_t solid = map->geometry.get_column(get_pos(i, j, 0));
+    uint64_t surface = get_surface(map, i, j);
+    int k = 0;
+    while (k < MAP_Z)
+    {
+        int z;
+
+        int air_start;
+        int top_colors_start;
+        int top_colors_end; // exclusive
+        int bottom_colors_start;
+        int bottom_colors_end; // exclusive
+        int top_colors_len;
+        int bottom_colors_len;
+        int colors;
+        // find the air region
+        air_start = k;
+        while (k < MAP_Z && !has_bit(solid, k))
+            ++k;
+        // find the top region
+        top_colors_start = k;
+        while (has_bit(surface, k))
+            ++k;
+        top_colors_end = k;
+
+        // now skip past the solid voxels
+        while (has_bit(solid, k) && !has_bit(surface, k))
+            ++k;
+
+        // at the end of the solid voxels, we have colored voxels.
+        // in the "normal" case they're bottom colors; but it's
+        // possible to have air-color-solid-color-solid-color-air,
+        // which we encode as air-color-solid-0, 0-color-solid-air
+
+        // so figure out if we have any bottom colors at this point
+        bottom_colors_start = k;
+
+        z = k;
+        while (has_bit(surface, z))
+            ++z;
+
+        if (z == MAP_Z)
+            ; // in this case, the bottom colors of this span are empty, because we'l emit as top colors
+        else
+        {
+            // otherwise, these are real bottom colors so we can write them
+            while (has_bit(surface, k))
+                ++k;
+        }
+        bottom_colors_end = k;
+
+        // now we're ready to write a span
+        top_colors_len = top_colors_end - top_colors_start;
+        bottom_colors_len = bottom_colors_end - bottom_colors_start;
+
+        colors = top_colors_len + bottom_colors_len;
+
+        if (k == MAP_Z)
+        {
+            *out = 0;
+            out += 1;
+        }
+        else
+        {
+            *out = colors + 1;
+            out += 1;
+        }
+        *out = top_colors_start;
+        out += 1;
+        *out = top_colors_end - 1;
+        out += 1;
+        *out = air_start;
+        out += 1;
+
+        for (z = 0; z < top_colors_len; ++z)
+        {
+            write_color(&out, get_write_color(map, i, j,
+                                              top_colors_start + z));
+        }
+        for (z = 0; z < bottom_colors_len; ++z)
+        {
+            write_color(&out, get_write_color(map, i, j,
+                                              bottom_colors_start + z));
+        }
+    }
+    return out;
 }
 
-PyObject *save_vxl(MapData *map)
+// more than the largest column write_column can write
+#define MAX_COLUMN_SIZE 1024
+
+// serialize columns first to last (exclusive) into data. Columns that did
+// not change since old was serialized are copied from it. offsets[column] is
+// set to where a column starts in data.
+static void encode_columns(MapData *map, const EncodedColumns *old,
+                           int first, int last, vector<char> *data,
+                           uint32_t *offsets)
 {
-    int i, j, k;
-    create_temp();
-    char *out = out_global;
+    size_t size = 0;
+    if (old != NULL)
+        data->resize(old->offsets[last] - old->offsets[first] +
+                     MAX_COLUMN_SIZE);
+    else
+        data->resize((last - first) * 32 + MAX_COLUMN_SIZE);
+    for (int column = first; column < last; column++)
+    {
+        offsets[column] = (uint32_t)size;
+        if (old != NULL && !map->dirty[column])
+        {
+            uint32_t start = old->offsets[column];
+            uint32_t length = old->offsets[column + 1] - start;
+            if (data->size() - size < length)
+                data->resize(data->size() * 2 + length);
+            memcpy(&(*data)[size], &old->data[start], length);
+            size += length;
+        }
+        else
+        {
+            if (data->size() - size < MAX_COLUMN_SIZE)
+                data->resize(data->size() * 2);
+            char *out = write_column(map, column % MAP_X, column / MAP_X,
+                                     &(*data)[size]);
+            size = out - &(*data)[0];
+        }
+    }
+    data->resize(size);
+}
 
-    for (j = 0; j < MAP_Y; ++j)
+// bring map->encoded up to date. Only the columns that changed since the
+// last call are serialized again, the others are copied over. The columns
+// are split between the given number of threads, which only read the map.
+// Does not need the GIL.
+const EncodedColumns *encode_map(MapData *map, int threads)
+{
+    const EncodedColumns *old = map->encoded.get();
+    if (old != NULL && map->dirty.none())
+        return old;
+    std::shared_ptr<EncodedColumns> encoded =
+        std::make_shared<EncodedColumns>();
+    vector<uint32_t> &offsets = encoded->offsets;
+    offsets.resize(COLUMN_COUNT + 1);
+    threads = std::max(1, std::min(threads, MAP_Y));
+    vector<vector<char> > parts(threads);
+    vector<std::thread> workers;
+    for (int t = 1; t < threads; t++)
     {
-        for (i = 0; i < MAP_X; ++i)
+        int first = COLUMN_COUNT / threads * t;
+        int last = t + 1 < threads ? COLUMN_COUNT / threads * (t + 1)
+                                   : COLUMN_COUNT;
+        try
         {
-            k = 0;
-            while (k < MAP_Z)
-            {
-                int z;
-
-                int air_start;
-                int top_colors_start;
-                int top_colors_end; // exclusive
-                int bottom_colors_start;
-                int bottom_colors_end; // exclusive
-                int top_colors_len;
-                int bottom_colors_len;
-                int colors;
-                // find the air region
-                air_start = k;
-                while (k < MAP_Z && !map->geometry[get_pos(i, j, k)])
-                    ++k;
-                // find the top region
-                top_colors_start = k;
-                while (k < MAP_Z && is_surface(map, i, j, k))
-                    ++k;
-                top_colors_end = k;
-
-                // now skip past the solid voxels
-                while (k < MAP_Z && map->geometry[get_pos(i, j, k)] &&
-                       !is_surface(map, i, j, k))
-                    ++k;
-
-                // at the end of the solid voxels, we have colored voxels.
-                // in the "normal" case they're bottom colors; but it's
-                // possible to have air-color-solid-color-solid-color-air,
-                // which we encode as air-color-solid-0, 0-color-solid-air
-
-                // so figure out if we have any bottom colors at this point
-                bottom_colors_start = k;
-
-                z = k;
-                while (z < MAP_Z && is_surface(map, i, j, z))
-                    ++z;
-
-                if (z == MAP_Z)
-                    ; // in this case, the bottom colors of this span are empty, because we'l emit as top colors
-                else
-                {
-                    // otherwise, these are real bottom colors so we can write them
-                    while (is_surface(map, i, j, k))
-                        ++k;
-                }
-                bottom_colors_end = k;
+            workers.push_back(std::thread(encode_columns, map, old, first,
+                                          last, &parts[t], &offsets[0]));
+        }
+        catch (const std::system_error &)
+        {
+            encode_columns(map, old, first, last, &parts[t], &offsets[0]);
+        }
+    }
+    encode_columns(map, old, 0, threads > 1 ? COLUMN_COUNT / threads
+                                            : COLUMN_COUNT,
+                   &parts[0], &offsets[0]);
+    for (size_t t = 0; t < workers.size(); t++)
+        workers[t].join();
+    vector<char> &data = encoded->data;
+    data.swap(parts[0]);
+    for (int t = 1; t < threads; t++)
+    {
+        uint32_t base = (uint32_t)data.size();
+        int first = COLUMN_COUNT / threads * t;
+        int last = t + 1 < threads ? COLUMN_COUNT / threads * (t + 1)
+                                   : COLUMN_COUNT;
+        for (int column = first; column < last; column++)
+            offsets[column] += base;
+        data.insert(data.end(), parts[t].begin(), parts[t].end());
+    }
+    offsets[COLUMN_COUNT] = (uint32_t)data.size();
+    data.shrink_to_fit();
+    map->encoded = encoded;
+    map->dirty.reset();
+    return encoded.get();
+}
 
-                // now we're ready to write a span
-                top_colors_len = top_colors_end - top_colors_start;
-                bottom_colors_len = bottom_colors_end - bottom_colors_start;
+static PyObject *get_band(const EncodedColumns *encoded, int band)
+{
+    uint32_t start = encoded->offsets[band * BAND_ROWS * MAP_X];
+    uint32_t end = encoded->offsets[(band + 1) * BAND_ROWS * MAP_X];
+    return PyBytes_FromStringAndSize(&encoded->data[start], end - start);
+}
 
-                colors = top_colors_len + bottom_colors_len;
+PyObject *save_vxl(MapData *map)
+{
+    const EncodedColumns *encoded = encode_map(map, 1);
+    return PyBytes_FromStringAndSize(&encoded->data[0],
+                                     encoded->data.size());
+}
 
-                if (k == MAP_Z)
-                {
-                    *out = 0;
-                    out += 1;
-                }
-                else
-                {
-                    *out = colors + 1;
-                    out += 1;
-                }
-                *out = top_colors_start;
-                out += 1;
-                *out = top_colors_end - 1;
-                out += 1;
-                *out = air_start;
-                out += 1;
-
-                for (z = 0; z < top_colors_len; ++z)
-                {
-                    write_color(&out, get_write_color(map, i, j,
-                                                      top_colors_start + z));
-                }
-                for (z = 0; z < bottom_colors_len; ++z)
-                {
-                    write_color(&out, get_write_color(map, i, j,
-                                                      bottom_colors_start + z));
-                }
-            }
-        }
-    }
-    return PyBytes_FromStringAndSize((char *)out_global, out - out_global);
+// serialize the columns of one band of rows, see BAND_ROWS
+PyObject *save_band(MapData *map, int band)
+{
+    return get_band(encode_map(map, 1), band);
 }
 
 inline MapData *copy_map(MapData *map)
@@ -357,16 +954,74 @@ inline MapData *copy_map(MapData *map)
     return new MapData(*map);
 }
 
-struct Point2D
-{
-    int x, y;
-};
-
 inline unsigned int random(unsigned int a, unsigned int b, float value)
 {
     return (unsigned int)(value * (b - a) + a);
 }
 
+// the number of land columns of row y with x1 <= x < x2, see GeometryChunk
+inline int count_row_land(MapData *map, int x1, int x2, int y)
+{
+    const GeometryChunk &chunk = map->geometry.get_chunk(y / CHUNK_ROWS);
+    int row = y % CHUNK_ROWS;
+    if (x1 == 0 && x2 == MAP_X)
+        return chunk.land_counts[row];
+    int count = 0;
+    for (int word = x1 / 64; word * 64 < x2; word++)
+        count += popcount64(chunk.get_land(row, word, x1, x2));
+    return count;
+}
+
+// the number of land columns with x1 <= x < x2 and y1 <= y < y2. Counts a
+// row at a time from the land index, so it does not depend on how much land
+// there is.
+int count_land(int x1, int y1, int x2, int y2, MapData *map)
+{
+    limit(&x1, 0, MAP_X);
+    limit(&y1, 0, MAP_Y);
+    limit(&x2, 0, MAP_X);
+    limit(&y2, 0, MAP_Y);
+    if (x1 >= x2)
+        return 0;
+    int count = 0;
+    for (int y = y1; y < y2; y++)
+        count += count_row_land(map, x1, x2, y);
+    return count;
+}
+
+// pick land column index of the land columns with x1 <= x < x2 and
+// y1 <= y < y2, ordered by x and then by y like the baseline scan, so that
+// seeded random numbers still give the same points. index must be less than
+// their number. The column x is found by a binary search over the land
+// counts of x1 <= x < mid, then the row by walking down that column.
+inline void get_land_column(int x1, int y1, int x2, int y2, int index,
+                            MapData *map, int *end_x, int *end_y)
+{
+    int low = x1, high = x2 - 1;
+    while (low < high)
+    {
+        int mid = low + (high - low) / 2;
+        if (count_land(x1, y1, mid + 1, y2, map) > index)
+            high = mid;
+        else
+            low = mid + 1;
+    }
+    index -= count_land(x1, y1, low, y2, map);
+    int y = y1;
+    for (; y < y2 - 1; y++)
+    {
+        const GeometryChunk &chunk = map->geometry.get_chunk(y / CHUNK_ROWS);
+        if (chunk.get_land(y % CHUNK_ROWS, low / 64, low, low + 1))
+        {
+            if (index == 0)
+                break;
+            index--;
+        }
+    }
+    *end_x = low;
+    *end_y = y;
+}
+
 inline void get_random_point(int x1, int y1, int x2, int y2, MapData *map,
                              float random_1, float random_2,
                              int *end_x, int *end_y)
@@ -375,23 +1030,7 @@ inline void get_random_point(int x1, int y1, int x2, int y2, MapData *map,
     limit(&y1, 0, 511);
     limit(&x2, 0, 511);
     limit(&y2, 0, 511);
-    vector<Point2D> items;
-    int size = 0;
-    int x, y;
-    for (x = x1; x < x2; x++)
-    {
-        for (y = y1; y < y2; y++)
-        {
-            if (map->geometry[get_pos(x, y, 62)])
-            {
-                Point2D item;
-                item.x = x;
-                item.y = y;
-                items.push_back(item);
-                size += 1;
-            }
-        }
-    }
+    int size = count_land(x1, y1, x2, y2, map);
     if (size == 0)
     {
         *end_x = random(x1, x2, random_1);
@@ -399,9 +1038,37 @@ inline void get_random_point(int x1, int y1, int x2, int y2, MapData *map,
     }
     else
     {
-        Point2D item = items[random(0, size, random_1)];
-        *end_x = item.x;
-        *end_y = item.y;
+        // random_1 can round up to 1.0 as a float
+        int index = std::min((int)random(0, size, random_1), size - 1);
+        get_land_column(x1, y1, x2, y2, index, map, end_x, end_y);
+    }
+}
+
+// write a byte per column to out, in get_pos() order, that is 1 if voxel z
+// of the column is solid
+void get_solid_slice(MapData *map, int z, unsigned char *out)
+{
+    for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+    {
+        const uint64_t *columns = map->geometry.get_chunk(chunk).columns;
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+            *out++ = (columns[i] >> z) & 1;
+    }
+}
+
+// write the z of the top solid voxel of each column to heights, or 0 if the
+// column is empty like VXLData.get_z does, and the color of that voxel to
+// colors, both in get_pos() order. Either can be NULL.
+void get_top_surface(MapData *map, unsigned char *heights, int *colors)
+{
+    for (int column = 0; column < COLUMN_COUNT; column++)
+    {
+        uint64_t solid = map->geometry.get_column(column);
+        int z = solid ? lowest_bit64(solid) : 0;
+        if (heights != NULL)
+            heights[column] = z;
+        if (colors != NULL)
+            colors[column] = get_color(column % MAP_X, column / MAP_X, z, map);
     }
 }
 
@@ -422,138 +1089,106 @@ int sunblock(MapData *map, int x, int y, int z)
     return i;
 }
 
-void update_shadows(MapData *map)
+struct ShadowFunc
 {
-    int x, y, z;
-    for (map_type<int, int>::iterator iter = map->colors.begin();
-         iter != map->colors.end(); ++iter)
+    MapData *map;
+
+    inline int operator()(int x, int y, int z, unsigned int color) const
     {
-        get_xyz(iter->first, &x, &y, &z);
-        unsigned int color = iter->second;
         int a = sunblock(map, x, y, z);
-        iter->second = (color & 0x00FFFFFF) | (a << 24);
+        return (color & 0x00FFFFFF) | (a << 24);
     }
+};
+
+void update_shadows(MapData *map)
+{
+    ShadowFunc func = {map};
+    map->colors.update_all(func);
+    touch_all(map);
 }
 
+// reads the serialized map as it was when the generator was created
 struct MapGenerator
 {
-    MapData *map;
-    int x, y;
+    std::shared_ptr<const EncodedColumns> encoded;
+    int column;
 };
 
 MapGenerator *create_map_generator(MapData *original)
 {
     MapGenerator *generator = new MapGenerator;
-    generator->map = copy_map(original);
-    generator->x = 0;
-    generator->y = 0;
+    encode_map(original, 1);
+    generator->encoded = original->encoded;
+    generator->column = 0;
     return generator;
 }
 
 void delete_map_generator(MapGenerator *generator)
 {
-    delete_vxl(generator->map);
     delete generator;
 }
 
 PyObject *get_generator_data(MapGenerator *generator, int columns)
 {
-    int i, j, k;
-    create_temp();
-    char *out = out_global;
-    int column = 0;
-    MapData *map = generator->map;
+    const EncodedColumns *encoded = generator->encoded.get();
+    int start = generator->column;
+    int end = std::min(start + columns, COLUMN_COUNT);
+    generator->column = end;
+    return PyBytes_FromStringAndSize(
+        &encoded->data[encoded->offsets[start]],
+        encoded->offsets[end] - encoded->offsets[start]);
+}
 
-    for (j = generator->y; j < MAP_Y; ++j)
-    {
-        for (i = generator->x; i < MAP_X; ++i)
-        {
-            if (column == columns)
-            {
-                goto done;
-            }
-            k = 0;
-            while (k < MAP_Z)
-            {
-                // find the air region
-                int air_start = k;
-                while (k < MAP_Z && !map->geometry[get_pos(i, j, k)])
-                    ++k;
-                // find the top region
-                int top_colors_start = k;
-                while (k < MAP_Z && is_surface(map, i, j, k))
-                    ++k;
-                int top_colors_end = k; // exlusive
-
-                // now skip past the solid voxels
-                while (k < MAP_Z && map->geometry[get_pos(i, j, k)] &&
-                       !is_surface(map, i, j, k))
-                    ++k;
-
-                // at the end of the solid voxels, we have colored voxels.
-                // in the "normal" case they're bottom colors; but it's
-                // possible to have air-color-solid-color-solid-color-air,
-                // which we encode as air-color-solid-0, 0-color-solid-air
-
-                // so figure out if we have any bottom colors at this point
-                int bottom_colors_start = k;
-
-                int z = k;
-                while (z < MAP_Z && is_surface(map, i, j, z))
-                    ++z;
-
-                if (z == MAP_Z)
-                {
-                    // in this case, the bottom colors of this span are empty, because we'll emit as top colors
-                }
-                else
-                {
-                    // otherwise, these are real bottom colors so we can write them
-                    while (is_surface(map, i, j, k))
-                        ++k;
-                }
-                int bottom_colors_end = k; // exclusive
+// a map as it was at one point in time, serialized in the background. Holds
+// a copy of the map, which shares its chunks with the map, until it is
+// serialized by encode_map_snapshot, which does not need the GIL. The map
+// keeps track of the columns that changed since its last snapshot, so that
+// it can use the serialized columns of the snapshot afterwards.
+struct MapSnapshot
+{
+    MapData *map;
+    std::shared_ptr<const EncodedColumns> encoded;
+    uint64_t version;
+};
 
-                // now we're ready to write a span
-                int top_colors_len = top_colors_end - top_colors_start;
-                int bottom_colors_len = bottom_colors_end - bottom_colors_start;
+MapSnapshot *create_map_snapshot(MapData *map)
+{
+    MapSnapshot *snapshot = new MapSnapshot;
+    snapshot->version = map->version;
+    snapshot->map = copy_map(map);
+    map->snapshot_version = map->version;
+    map->snapshot_dirty.reset();
+    return snapshot;
+}
 
-                int colors = top_colors_len + bottom_colors_len;
+void encode_map_snapshot(MapSnapshot *snapshot, int threads)
+{
+    if (snapshot->map == NULL)
+        return;
+    encode_map(snapshot->map, threads);
+    snapshot->encoded = snapshot->map->encoded;
+    delete snapshot->map;
+    snapshot->map = NULL;
+}
 
-                if (k == MAP_Z)
-                {
-                    *out = 0;
-                    out += 1;
-                }
-                else
-                {
-                    *out = colors + 1;
-                    out += 1;
-                }
-                *out = top_colors_start;
-                out += 1;
-                *out = top_colors_end - 1;
-                out += 1;
-                *out = air_start;
-                out += 1;
-
-                for (z = 0; z < top_colors_len; ++z)
-                {
-                    write_color(&out, get_write_color(map, i, j,
-                                                      top_colors_start + z));
-                }
-                for (z = 0; z < bottom_colors_len; ++z)
-                {
-                    write_color(&out, get_write_color(map, i, j,
-                                                      bottom_colors_start + z));
-                }
-            }
-            column++;
-        }
-        generator->x = 0;
+// let the map use the columns serialized for its last snapshot, so that
+// only the columns that changed since have to be serialized again
+void apply_map_snapshot(MapData *map, MapSnapshot *snapshot)
+{
+    if (snapshot->map == NULL && snapshot->version == map->snapshot_version)
+    {
+        map->encoded = snapshot->encoded;
+        map->dirty = map->snapshot_dirty;
     }
-done:
-    generator->x = i;
-    generator->y = j;
-    return PyBytes_FromStringAndSize((char *)out_global, out - out_global);
+}
+
+PyObject *get_snapshot_band(MapSnapshot *snapshot, int band)
+{
+    return get_band(snapshot->encoded.get(), band);
+}
+
+void delete_map_snapshot(MapSnapshot *snapshot)
+{
+    delete snapshot->map;
+    delete snapshot;
 }
@@ -1,12 +1,19 @@
 #ifndef VXL_C_H
 #define VXL_C_H
 
+#include <algorithm>
+#include <atomic>
 #include <bitset>
+#include <memory>
+#include <stdint.h>
+#include <string.h>
+#include <vector>
 #include <unordered_map>
-#include <unordered_set>
+#if defined(_MSC_VER)
+#include <intrin.h>
+#endif
 
 #define map_type std::unordered_map
-#define set_type std::unordered_set
 
 #define MAP_X 512
 #define MAP_Y 512
@@ -14,13 +21,623 @@
 #define get_pos(x, y, z) ((x) + (y)*MAP_Y + (z)*MAP_X * MAP_Y)
 #define DEFAULT_COLOR 0xFF674028
 
-struct MapData
+#define COLUMN_COUNT (MAP_X * MAP_Y)
+
+inline int popcount64(uint64_t value)
+{
+#if defined(_MSC_VER)
+    return (int)__popcnt64(value);
+#else
+    return __builtin_popcountll(value);
+#endif
+}
+
+// index of the lowest set bit, value must not be 0
+inline int lowest_bit64(uint64_t value)
+{
+#if defined(_MSC_VER)
+    unsigned long index;
+    _BitScanForward64(&index, value);
+    return (int)index;
+#else
+    return __builtin_ctzll(value);
+#endif
+}
+
+// index of the highest set bit, value must not be 0
+inline int highest_bit64(uint64_t value)
+{
+#if defined(_MSC_VER)
+    unsigned long index;
+    _BitScanReverse64(&index, value);
+    return (int)index;
+#else
+    return 63 - __builtin_clzll(value);
+#endif
+}
+
+// mask with bits start to end - 1 set, for 0 <= start <= end <= 64
+inline uint64_t bit_range64(int start, int end)
+{
+    if (start >= end)
+        return 0;
+    uint64_t mask = end >= 64 ? ~(uint64_t)0 : ((uint64_t)1 << end) - 1;
+    return mask & ~(((uint64_t)1 << start) - 1);
+}
+
+// the map is stored in chunks of rows, shared between a map and its copies
+// until one of them changes, see SharedChunks
+#define CHUNK_ROWS 8
+#define CHUNK_COLUMNS (MAP_X * CHUNK_ROWS)
+#define CHUNK_COUNT (COLUMN_COUNT / CHUNK_COLUMNS)
+
+// the chunk voxel get_pos() i is in
+inline int chunk_of(int i)
+{
+    return ((unsigned int)i % COLUMN_COUNT) / CHUNK_COLUMNS;
+}
+
+// chunks shared between a map and its copies. A chunk is copied before it
+// is changed while another map still uses it, so copying a map only copies
+// CHUNK_COUNT pointers, and the first change to a chunk copies only that
+// chunk.
+template <typename Chunk>
+struct SharedChunks
+{
+    std::shared_ptr<Chunk> chunks[CHUNK_COUNT];
+
+    SharedChunks()
+    {
+        for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+            chunks[chunk] = std::make_shared<Chunk>();
+    }
+
+    inline const Chunk &get_chunk(int chunk) const
+    {
+        return *chunks[chunk];
+    }
+
+    // a chunk that is only used by this map, to change it
+    inline Chunk &edit_chunk(int chunk)
+    {
+        std::shared_ptr<Chunk> &shared = chunks[chunk];
+        if (shared.use_count() > 1)
+            shared = std::make_shared<Chunk>(*shared);
+        return *shared;
+    }
+};
+
+// the voxel a column needs to be solid in to count as land, for spawns and
+// territories
+#define LAND_Z 62
+#define ROW_WORDS (MAP_X / 64)
+
+// the solid voxels of the columns of a chunk: bit z of columns[i] is set if
+// voxel z of column i of the chunk is solid.
+// The land columns are indexed as well, so they can be counted and sampled
+// without visiting every column: bit i % 64 of land[i / 64] is set if column
+// i is land, and land_counts[row] is the number of land columns in a row of
+// the chunk. Both are kept up to date by set_column.
+struct GeometryChunk
+{
+    uint64_t columns[CHUNK_COLUMNS];
+    uint64_t land[CHUNK_COLUMNS / 64];
+    int land_counts[CHUNK_ROWS];
+
+    GeometryChunk()
+    {
+        std::fill(columns, columns + CHUNK_COLUMNS, 0);
+        std::fill(land, land + CHUNK_COLUMNS / 64, 0);
+        std::fill(land_counts, land_counts + CHUNK_ROWS, 0);
+    }
+
+    // i is the index of the column in the chunk
+    inline void set_column(int i, uint64_t solid)
+    {
+        uint64_t changed = columns[i] ^ solid;
+        columns[i] = solid;
+        if ((changed >> LAND_Z) & 1)
+        {
+            land[i / 64] ^= (uint64_t)1 << (i % 64);
+            land_counts[i / MAP_X] += ((solid >> LAND_Z) & 1) ? 1 : -1;
+        }
+    }
+
+    // rebuild the land index after columns were written directly
+    void update_land()
+    {
+        std::fill(land, land + CHUNK_COLUMNS / 64, 0);
+        std::fill(land_counts, land_counts + CHUNK_ROWS, 0);
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            if (!((columns[i] >> LAND_Z) & 1))
+                continue;
+            land[i / 64] |= (uint64_t)1 << (i % 64);
+            land_counts[i / MAP_X]++;
+        }
+    }
+
+    // the land columns of a row of the chunk with x1 <= x < x2 in word
+    // word of the row, bit x % 64 for column x
+    inline uint64_t get_land(int row, int word, int x1, int x2) const
+    {
+        return land[row * ROW_WORDS + word] &
+               bit_range64(std::max(x1 - word * 64, 0),
+                           std::min(x2 - word * 64, 64));
+    }
+};
+
+// the solid voxels of the map, indexed by get_pos()
+struct Geometry : SharedChunks<GeometryChunk>
+{
+    inline bool operator[](int i) const
+    {
+        unsigned int u = (unsigned int)i;
+        return (get_column(i) >> (u / COLUMN_COUNT)) & 1;
+    }
+
+    inline void set(int i, bool solid = true)
+    {
+        unsigned int u = (unsigned int)i;
+        uint64_t bit = (uint64_t)1 << (u / COLUMN_COUNT);
+        GeometryChunk &chunk = edit_chunk(chunk_of(i));
+        uint64_t column = chunk.columns[u % CHUNK_COLUMNS];
+        chunk.set_column(u % CHUNK_COLUMNS,
+                         solid ? column | bit : column & ~bit);
+    }
+
+    inline void reset(int i)
+    {
+        set(i, false);
+    }
+
+    // the solid voxels of the column of voxel i, bit z for voxel z
+    inline uint64_t get_column(int i) const
+    {
+        return get_chunk(chunk_of(i)).columns[(unsigned int)i % CHUNK_COLUMNS];
+    }
+
+    inline void set_column(int i, uint64_t solid)
+    {
+        edit_chunk(chunk_of(i)).set_column((unsigned int)i % CHUNK_COLUMNS,
+                                           solid);
+    }
+};
+
+#ifdef VXL_HASH_COLORS
+
+// the original color storage: one hash map node per colored voxel, keyed by
+// get_pos(). Kept for comparison, build with VXL_HASH_COLORS=1 to use it.
+struct ColorChunk
 {
-    std::bitset<MAP_X * MAP_Y * MAP_Z> geometry;
-    // char geometry[MAP_X * MAP_Y * MAP_Z];
     map_type<int, int> colors;
+
+    inline bool get(int i, int *color) const
+    {
+        map_type<int, int>::const_iterator iter = colors.find(i);
+        if (iter == colors.end())
+            return false;
+        *color = iter->second;
+        return true;
+    }
+
+    inline void set(int i, int color)
+    {
+        colors[i] = color;
+    }
+
+    inline void erase(int i)
+    {
+        colors.erase(i);
+    }
+
+    // counts holds the number of colors of each column of the chunk
+    void reserve_columns(const uint32_t *counts)
+    {
+        size_t total = 0;
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+            total += counts[i];
+        colors.reserve(total);
+    }
+
+    inline void append(int i, int color)
+    {
+        set(i, color);
+    }
+
+    // call func(x, y, z, color) for every colored voxel and store the
+    // returned color
+    template <typename Func>
+    void update_all(int chunk, Func func)
+    {
+        int x, y, z;
+        for (map_type<int, int>::iterator iter = colors.begin();
+             iter != colors.end(); ++iter)
+        {
+            x = iter->first % MAP_Y;
+            y = (iter->first / MAP_Y) % MAP_X;
+            z = iter->first / (MAP_X * MAP_Y);
+            iter->second = func(x, y, z, iter->second);
+        }
+    }
+
+    // see the ColorChunk below
+    void save_columns(int chunk, uint64_t *masks,
+                      std::vector<int> &colors) const
+    {
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            masks[i] = 0;
+            for (int z = 0; z < MAP_Z; z++)
+            {
+                int color;
+                if (!get(chunk * CHUNK_COLUMNS + i + z * COLUMN_COUNT,
+                         &color))
+                    continue;
+                masks[i] |= (uint64_t)1 << z;
+                colors.push_back(color);
+            }
+        }
+    }
+
+    void load_columns(int chunk, const uint64_t *masks,
+                      const unsigned char *colors)
+    {
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            for (int z = 0; z < MAP_Z; z++)
+            {
+                if (!(masks[i] & ((uint64_t)1 << z)))
+                    continue;
+                int color;
+                memcpy(&color, colors, sizeof(int));
+                colors += sizeof(int);
+                set(chunk * CHUNK_COLUMNS + i + z * COLUMN_COUNT, color);
+            }
+        }
+    }
+};
+
+#else
+
+// colors of one column: bit z of the mask is set if voxel z has a color. The
+// colors of those voxels are stored in z order in the shared pool, starting
+// at offset, with room for capacity colors.
+struct ColorColumn
+{
+    uint64_t mask;
+    uint32_t offset;
+    uint32_t capacity;
+};
+
+// per-column color storage for the columns of a chunk, indexed by get_pos().
+// A lookup is a bit test and a popcount instead of a hash lookup, all colors
+// live in one array, and copying the store is two memcpys.
+struct ColorChunk
+{
+    std::vector<ColorColumn> columns;
+    std::vector<int> pool;
+    // slots in the pool that no column uses anymore
+    size_t unused;
+
+    ColorChunk() : columns(CHUNK_COLUMNS), unused(0)
+    {
+        ColorColumn empty = {0, 0, 0};
+        std::fill(columns.begin(), columns.end(), empty);
+    }
+
+    inline bool get(int i, int *color) const
+    {
+        const ColorColumn &column = columns[i % CHUNK_COLUMNS];
+        uint64_t bit = (uint64_t)1 << (i / COLUMN_COUNT);
+        if (!(column.mask & bit))
+            return false;
+        *color = pool[column.offset + popcount64(column.mask & (bit - 1))];
+        return true;
+    }
+
+    inline void set(int i, int color)
+    {
+        ColorColumn &column = columns[i % CHUNK_COLUMNS];
+        uint64_t bit = (uint64_t)1 << (i / COLUMN_COUNT);
+        int index = popcount64(column.mask & (bit - 1));
+        if (column.mask & bit)
+        {
+            pool[column.offset + index] = color;
+            return;
+        }
+        int count = popcount64(column.mask);
+        if ((uint32_t)count == column.capacity)
+            grow(column, count);
+        int *colors = &pool[column.offset];
+        std::copy_backward(colors + index, colors + count,
+                           colors + count + 1);
+        colors[index] = color;
+        column.mask |= bit;
+    }
+
+    inline void erase(int i)
+    {
+        ColorColumn &column = columns[i % CHUNK_COLUMNS];
+        uint64_t bit = (uint64_t)1 << (i / COLUMN_COUNT);
+        if (!(column.mask & bit))
+            return;
+        int index = popcount64(column.mask & (bit - 1));
+        int count = popcount64(column.mask);
+        int *colors = &pool[column.offset];
+        std::copy(colors + index + 1, colors + count, colors + index);
+        column.mask &= ~bit;
+    }
+
+    // lay out the pool for a chunk that is about to be loaded, with room for
+    // counts[i] colors in column i of the chunk
+    void reserve_columns(const uint32_t *counts)
+    {
+        uint32_t offset = 0;
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            columns[i].mask = 0;
+            columns[i].offset = offset;
+            columns[i].capacity = counts[i];
+            offset += counts[i];
+        }
+        pool.assign(offset, 0);
+        unused = 0;
+    }
+
+    // add a color to a column reserved with reserve_columns, in increasing z
+    // order. Only touches the column, so different columns can be loaded
+    // from different threads.
+    inline void append(int i, int color)
+    {
+        ColorColumn &column = columns[i % CHUNK_COLUMNS];
+        uint64_t bit = (uint64_t)1 << (i / COLUMN_COUNT);
+        int index = popcount64(column.mask & (bit - 1));
+        if ((uint32_t)index >= column.capacity)
+            return;
+        pool[column.offset + index] = color;
+        column.mask |= bit;
+    }
+
+    // make room for one more color in a full column
+    void grow(ColorColumn &column, int count)
+    {
+        // compacting leaves no room in any column, so it has to happen
+        // before the column is given room for the new color
+        if (unused > pool.size() / 2)
+            compact();
+        if (column.offset + column.capacity == pool.size())
+        {
+            // the last column in the pool can grow in place, which is what
+            // happens when a map is loaded column by column
+            pool.resize(pool.size() + 1);
+            column.capacity++;
+            return;
+        }
+        uint32_t capacity = std::min(std::max(column.capacity * 2, 4u),
+                                     (uint32_t)MAP_Z);
+        uint32_t offset = (uint32_t)pool.size();
+        pool.resize(offset + capacity);
+        std::copy(pool.begin() + column.offset,
+                  pool.begin() + column.offset + count,
+                  pool.begin() + offset);
+        unused += column.capacity;
+        column.offset = offset;
+        column.capacity = capacity;
+    }
+
+    // remove the unused slots from the pool
+    void compact()
+    {
+        std::vector<int> new_pool;
+        new_pool.reserve(pool.size() - unused);
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            ColorColumn &column = columns[i];
+            int count = popcount64(column.mask);
+            uint32_t offset = (uint32_t)new_pool.size();
+            new_pool.insert(new_pool.end(), pool.begin() + column.offset,
+                            pool.begin() + column.offset + count);
+            column.offset = offset;
+            column.capacity = count;
+        }
+        pool.swap(new_pool);
+        unused = 0;
+    }
+
+    // call func(x, y, z, color) for every colored voxel of the chunk and
+    // store the returned color
+    template <typename Func>
+    void update_all(int chunk, Func func)
+    {
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            ColorColumn &column = columns[i];
+            int *colors = pool.empty() ? NULL : &pool[column.offset];
+            int x = i % MAP_X;
+            int y = chunk * CHUNK_ROWS + i / MAP_X;
+            for (int z = 0; z < MAP_Z; z++)
+            {
+                if (!(column.mask & ((uint64_t)1 << z)))
+                    continue;
+                *colors = func(x, y, z, *colors);
+                colors++;
+            }
+        }
+    }
+
+    // the colors of the chunk in column and z order, and the mask of each
+    // column, for the map cache
+    void save_columns(int chunk, uint64_t *masks,
+                      std::vector<int> &colors) const
+    {
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            const ColorColumn &column = columns[i];
+            masks[i] = column.mask;
+            colors.insert(colors.end(), pool.begin() + column.offset,
+                          pool.begin() + column.offset +
+                              popcount64(column.mask));
+        }
+    }
+
+    // the reverse of save_columns. colors holds as many colors as the masks
+    // have bits set, and does not have to be aligned.
+    void load_columns(int chunk, const uint64_t *masks,
+                      const unsigned char *colors)
+    {
+        uint32_t offset = 0;
+        for (int i = 0; i < CHUNK_COLUMNS; i++)
+        {
+            uint32_t count = popcount64(masks[i]);
+            columns[i].mask = masks[i];
+            columns[i].offset = offset;
+            columns[i].capacity = count;
+            offset += count;
+        }
+        pool.resize(offset);
+        if (offset > 0)
+            memcpy(&pool[0], colors, offset * sizeof(int));
+        unused = 0;
+    }
 };
 
+#endif
+
+// the colors of the map, indexed by get_pos()
+struct ColorStore : SharedChunks<ColorChunk>
+{
+    inline bool get(int i, int *color) const
+    {
+        return get_chunk(chunk_of(i)).get(i, color);
+    }
+
+    inline void set(int i, int color)
+    {
+        edit_chunk(chunk_of(i)).set(i, color);
+    }
+
+    inline void erase(int i)
+    {
+        edit_chunk(chunk_of(i)).erase(i);
+    }
+
+    // lay out the chunks for a map that is about to be loaded, with room
+    // for counts[i] colors in column i
+    void reserve_columns(const uint32_t *counts)
+    {
+        for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+            edit_chunk(chunk).reserve_columns(counts + chunk * CHUNK_COLUMNS);
+    }
+
+    // see ColorChunk::append. The chunks of a map that is being loaded are
+    // not shared, so this can be called from several threads.
+    inline void append(int i, int color)
+    {
+        chunks[chunk_of(i)]->append(i, color);
+    }
+
+    template <typename Func>
+    void update_all(Func func)
+    {
+        for (int chunk = 0; chunk < CHUNK_COUNT; chunk++)
+            edit_chunk(chunk).update_all(chunk, func);
+    }
+};
+
+// the map is serialized in bands of rows, so that bands that did not change
+// since they were last serialized can be reused
+#define BAND_ROWS 8
+#define BAND_COUNT (MAP_Y / BAND_ROWS)
+
+// versions start at a new multiple of 2^32 for every map, so that they are
+// unique between maps. Only the vxl module creates maps, so the counter does
+// not have to be shared with the other modules that include this header.
+// Maps are loaded without the GIL in several threads at once, so the counter
+// is atomic.
+inline uint64_t new_map_version()
+{
+    static std::atomic<uint64_t> maps(0);
+    return (maps.fetch_add(1, std::memory_order_relaxed) + 1) << 32;
+}
+
+// the serialized columns of a map. Column i is stored from offsets[i] to
+// offsets[i + 1] in data. Never changed once it is created, so it can be
+// shared between maps and read from other threads.
+struct EncodedColumns
+{
+    std::vector<char> data;
+    std::vector<uint32_t> offsets;
+};
+
+struct MapData
+{
+    Geometry geometry;
+    ColorStore colors;
+    // the columns as they were last serialized, and which columns changed
+    // since, see encode_map
+    std::shared_ptr<const EncodedColumns> encoded;
+    std::bitset<COLUMN_COUNT> dirty;
+    // the version the last snapshot was taken at, and which columns changed
+    // since, see create_map_snapshot
+    uint64_t snapshot_version;
+    std::bitset<COLUMN_COUNT> snapshot_dirty;
+    // increased on every change. band_versions holds the version each band
+    // was last changed at, so equal band versions mean equal contents, also
+    // between a map and its copies.
+    uint64_t version;
+    uint64_t band_versions[BAND_COUNT];
+
+    MapData() : snapshot_version(0), version(new_map_version())
+    {
+        std::fill(band_versions, band_versions + BAND_COUNT, version);
+    }
+
+    MapData(const MapData &other)
+        : geometry(other.geometry), colors(other.colors),
+          encoded(other.encoded), dirty(other.dirty), snapshot_version(0),
+          version(new_map_version())
+    {
+        std::copy(other.band_versions, other.band_versions + BAND_COUNT,
+                  band_versions);
+    }
+};
+
+inline void mark_column(std::bitset<COLUMN_COUNT> &dirty, int x, int y)
+{
+    int column = x + y * MAP_X;
+    dirty.set(column);
+    if (x > 0)
+        dirty.set(column - 1);
+    if (x < MAP_X - 1)
+        dirty.set(column + 1);
+    if (y > 0)
+        dirty.set(column - MAP_X);
+    if (y < MAP_Y - 1)
+        dirty.set(column + MAP_X);
+}
+
+// note that column x, y changed. Changing a voxel can change which of the
+// voxels next to it are on the surface, so the columns next to it change too.
+inline void touch_column(MapData *map, int x, int y)
+{
+    mark_column(map->dirty, x, y);
+    mark_column(map->snapshot_dirty, x, y);
+    uint64_t version = ++map->version;
+    int first = (y > 0 ? y - 1 : 0) / BAND_ROWS;
+    int last = (y < MAP_Y - 1 ? y + 1 : MAP_Y - 1) / BAND_ROWS;
+    for (int band = first; band <= last; band++)
+        map->band_versions[band] = version;
+}
+
+inline void touch_all(MapData *map)
+{
+    map->dirty.set();
+    map->snapshot_dirty.set();
+    uint64_t version = ++map->version;
+    std::fill(map->band_versions, map->band_versions + BAND_COUNT, version);
+}
+
 void inline get_xyz(int pos, int *x, int *y, int *z)
 {
     *x = pos % MAP_Y;
@@ -49,46 +666,57 @@ int inline get_solid_wrap(int x, int y, int z, MapData *map)
     return map->geometry[get_pos(x & 511, y & 511, z)];
 }
 
+// the first solid z of column x, y from start down, or 0 if there is none
+int inline get_z(int x, int y, int start, MapData *map)
+{
+    if (!is_valid_position(x, y, 0) || start >= MAP_Z)
+        return 0;
+    uint64_t solid = map->geometry.get_column(get_pos(x, y, 0)) &
+                     bit_range64(std::max(start, 0), MAP_Z);
+    return solid ? lowest_bit64(solid) : 0;
+}
+
+// one below the lowest air voxel of column x, y, or 0 if it is solid all the
+// way up
+int inline get_height(int x, int y, MapData *map)
+{
+    if (!is_valid_position(x, y, 0))
+        return MAP_Z;
+    uint64_t air = ~map->geometry.get_column(get_pos(x, y, 0));
+    return air ? highest_bit64(air) + 1 : 0;
+}
+
 int inline get_color(int x, int y, int z, MapData *map)
 {
-    map_type<int, int>::const_iterator iter = map->colors.find(
-        get_pos(x, y, z));
-    if (iter == map->colors.end())
+    int color;
+    if (!map->colors.get(get_pos(x, y, z), &color))
         return 0;
-    return iter->second;
+    return color;
 }
 
 void inline set_point(int x, int y, int z, MapData *map, bool solid, int color)
 {
     int i = get_pos(x, y, z);
-    map->geometry[i] = solid;
+    touch_column(map, x, y);
+    map->geometry.set(i, solid);
     if (!solid)
         map->colors.erase(i);
     else
-        map->colors[i] = color;
+        map->colors.set(i, color);
 }
 
 void inline set_column_solid(int x, int y, int z_start, int z_end,
                              MapData *map, bool solid)
 {
-    int i = get_pos(x, y, z_start);
-    int i_end = get_pos(x, y, z_end);
-    if (!solid)
-    {
-        while (i <= i_end)
-        {
-            map->geometry[i] = solid;
-            i += MAP_X * MAP_Y;
-        }
-    }
+    int column = get_pos(x, y, 0);
+    uint64_t mask = bit_range64(z_start, z_end + 1);
+    touch_column(map, x, y);
+    if (solid)
+        map->geometry.set_column(column,
+                                 map->geometry.get_column(column) | mask);
     else
-    {
-        while (i <= i_end)
-        {
-            map->geometry[i] = solid;
-            i += MAP_X * MAP_Y;
-        }
-    }
+        map->geometry.set_column(column,
+                                 map->geometry.get_column(column) & ~mask);
 }
 
 void inline set_column_color(int x, int y, int z_start, int z_end,
@@ -96,9 +724,10 @@ void inline set_column_color(int x, int y, int z_start, int z_end,
 {
     int i = get_pos(x, y, z_start);
     int i_end = get_pos(x, y, z_end);
+    touch_column(map, x, y);
     while (i <= i_end)
     {
-        map->colors[i] = color;
+        map->colors.set(i, color);
         i += MAP_X * MAP_Y;
     }
 }
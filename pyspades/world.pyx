@@ -20,7 +20,8 @@ import time
 from pyspades.vxl cimport VXLData, MapData
 from pyspades.common cimport Vertex3, create_proxy_vector
 from libc.math cimport sqrt, sin, cos, acos, fabs
-from pyspades.constants import TORSO, HEAD, ARMS, LEGS, MELEE
+from libc.string cimport memset, memcpy
+from pyspades.constants import TORSO, HEAD, ARMS, LEGS, MELEE, FOG_DISTANCE
 
 cdef extern from "common_c.h":
     struct LongVector:
@@ -31,6 +32,9 @@ cdef extern from "common_c.h":
 cdef extern from "world_c.cpp":
     enum:
         CUBE_ARRAY_LENGTH
+        WORLD_UPDATE_SLOTS
+        WORLD_UPDATE_SLOT_SIZE
+        WORLD_UPDATE_SIZE
     int c_validate_hit "validate_hit" (
         float shooter_x, float shooter_y, float shooter_z,
         float orientation_x, float orientation_y, float orientation_z,
@@ -59,6 +63,10 @@ cdef extern from "world_c.cpp":
     int try_uncrouch(PlayerType * p)
     GrenadeType * create_grenade(Vector * p, Vector * v)
     int move_grenade(GrenadeType * grenade)
+    void write_world_update_slot(char * data, PlayerType * p)
+    void clear_world_update_slot(char * data)
+    void compute_visibility(MapData * map, PlayerType ** players, int * teams,
+                            float fog_distance, unsigned int * visibility)
 
 from libc.math cimport sqrt
 
@@ -107,22 +115,40 @@ cdef class Character(Object):
     the world"""
     cdef:
         PlayerType * player
+        int slot, team
+        bint visible
     cdef public:
         Vertex3 position, orientation, velocity
         object fall_callback
 
     def initialize(self, Vertex3 position, Vertex3 orientation,
-                   fall_callback = None):
+                   fall_callback = None, int network_slot = -1):
         self.name = 'character'
         self.player = create_player()
         self.fall_callback = fall_callback
         self.position = create_proxy_vector(&self.player.p)
         self.orientation = create_proxy_vector(&self.player.f)
         self.velocity = create_proxy_vector(&self.player.v)
+        self.slot = -1
+        self.team = -1
+        self.visible = True
         if position is not None:
             self.set_position(*position.get())
         if orientation is not None:
             self.orientation.set_vector(orientation)
+        self.network_slot = network_slot
+
+    cdef void write_network(self):
+        """write the position and orientation into this character's slot of
+        the world's WorldUpdate buffer"""
+        if self.slot < 0:
+            return
+        cdef char * data = (self.world.network_data +
+                            self.slot * WORLD_UPDATE_SLOT_SIZE)
+        if self.visible:
+            write_world_update_slot(data, self.player)
+        else:
+            clear_world_update_slot(data)
 
     def set_crouch(self, bint value):
         """set if the player is crouching"""
@@ -133,6 +159,7 @@ cdef class Character(Object):
         else:
             self.player.p.z -= 0.9
         self.player.crouch = value
+        self.write_network()
 
     def set_animation(self, jump, crouch, sneak, sprint):
         """set all of the player's movement statuses: jump, crouch, sneak and
@@ -165,12 +192,14 @@ cdef class Character(Object):
             self.primary_fire = self.secondary_fire = False
             self.jump = self.crouch = False
             self.up = self.down = self.left = self.right = False
+        self.write_network()
 
     def set_orientation(self, x, y, z):
         """set the current orientation of the Player"""
         cdef Vertex3 v = Vertex3(x, y, z)
         v.normalize()
         reorient_player(self.player, v.value)
+        self.write_network()
 
     cpdef int can_see(self, float x, float y, float z):
         """return if the player can see a given coordinate. This only considers
@@ -233,10 +262,53 @@ cdef class Character(Object):
 
     cdef int update(self, double dt) except -1:
         cdef long ret = move_player(self.player)
+        self.write_network()
         if ret > 0:
             self.fall_callback(ret)
         return 0
 
+    def delete(self):
+        self.network_slot = -1
+        Object.delete(self)
+
+    property network_slot:
+        """the WorldUpdate slot (usually the player id) this character keeps
+        up to date, or -1 if it is not sent to clients"""
+        def __get__(self):
+            return self.slot
+        def __set__(self, int value):
+            if value >= WORLD_UPDATE_SLOTS:
+                raise ValueError('invalid WorldUpdate slot %s' % value)
+            if self.slot >= 0:
+                clear_world_update_slot(self.world.network_data +
+                                        self.slot * WORLD_UPDATE_SLOT_SIZE)
+                self.world.network_players[self.slot] = NULL
+            self.slot = max(value, -1)
+            if self.slot >= 0:
+                self.world.network_players[self.slot] = self.player
+                self.world.network_teams[self.slot] = self.team
+            self.write_network()
+
+    property network_team:
+        """the team id used for interest management. Characters on the same
+        team are always visible to each other"""
+        def __get__(self):
+            return self.team
+        def __set__(self, int value):
+            self.team = value
+            if self.slot >= 0:
+                self.world.network_teams[self.slot] = value
+
+    property network_visible:
+        """if False, this character's slot in the WorldUpdate is zeroed"""
+        def __get__(self):
+            return self.visible
+        def __set__(self, bint value):
+            if value == self.visible:
+                return
+            self.visible = value
+            self.write_network()
+
     # properties
     property up:
         def __get__(self):
@@ -404,10 +476,18 @@ cdef class World(object):
         VXLData map
         list objects
         float time
+    cdef char network_data[WORLD_UPDATE_SIZE]
+    cdef PlayerType * network_players[WORLD_UPDATE_SLOTS]
+    cdef int network_teams[WORLD_UPDATE_SLOTS]
+    cdef unsigned int visibility[WORLD_UPDATE_SLOTS]
 
     def __init__(self):
         self.objects = []
         self.time = 0
+        memset(self.network_data, 0, WORLD_UPDATE_SIZE)
+        memset(self.network_players, 0, sizeof(self.network_players))
+        memset(self.network_teams, 0, sizeof(self.network_teams))
+        memset(self.visibility, 0xFF, sizeof(self.visibility))
 
     def update(self, double dt):
         if self.map is None:
@@ -426,6 +506,59 @@ cdef class World(object):
         self.objects.append(new_object)
         return new_object
 
+    cpdef bytes get_network_data(self, int count = WORLD_UPDATE_SLOTS):
+        """return the WorldUpdate payload for the first ``count`` slots.
+
+        Characters write their position and orientation into this buffer
+        whenever they change, so this is a single copy.
+        """
+        if count < 0:
+            count = 0
+        elif count > WORLD_UPDATE_SLOTS:
+            count = WORLD_UPDATE_SLOTS
+        return self.network_data[:count * WORLD_UPDATE_SLOT_SIZE]
+
+    cpdef update_visibility(self, float fog_distance = FOG_DISTANCE):
+        """recompute which characters may be visible to which other
+        characters, taking into account fog distance and map geometry.
+
+        This is a single native pass over all pairs of WorldUpdate slots.
+        """
+        if self.map is None:
+            memset(self.visibility, 0xFF, sizeof(self.visibility))
+            return
+        compute_visibility(self.map.map, self.network_players,
+                           self.network_teams, fog_distance, self.visibility)
+
+    cpdef bint is_visible(self, int viewer, int target):
+        """return if the character in slot ``target`` was visible to the
+        character in slot ``viewer`` at the last ``update_visibility``"""
+        if not 0 <= viewer < WORLD_UPDATE_SLOTS:
+            return True
+        if not 0 <= target < WORLD_UPDATE_SLOTS:
+            return False
+        return (self.visibility[viewer] >> target) & 1
+
+    cpdef bytes get_network_data_for(self, int viewer,
+                                     int count = WORLD_UPDATE_SLOTS):
+        """like ``get_network_data``, but with the slots that are not
+        visible to slot ``viewer`` zeroed out. A negative ``viewer`` gets the
+        unfiltered data."""
+        if not 0 <= viewer < WORLD_UPDATE_SLOTS:
+            return self.get_network_data(count)
+        cdef unsigned int mask = self.visibility[viewer]
+        if count < 0:
+            count = 0
+        elif count > WORLD_UPDATE_SLOTS:
+            count = WORLD_UPDATE_SLOTS
+        cdef char data[WORLD_UPDATE_SIZE]
+        memcpy(data, self.network_data, count * WORLD_UPDATE_SLOT_SIZE)
+        cdef int i
+        for i in range(count):
+            if not (mask >> i) & 1:
+                clear_world_update_slot(data + i * WORLD_UPDATE_SLOT_SIZE)
+        return data[:count * WORLD_UPDATE_SLOT_SIZE]
+
 # utility functions
 
 cpdef cube_line(x1, y1, z1, x2, y2, z2):
@@ -32,9 +32,16 @@
 #define CUBE_ARRAY_LENGTH 64
 #include "common_c.h"
 #include <cmath>
+#include <cstring>
+#include <stdint.h>
 
 #define FOG_DISTANCE 128
 
+// WorldUpdate payload: 32 slots of position + orientation as float32 LE
+#define WORLD_UPDATE_SLOTS 32
+#define WORLD_UPDATE_SLOT_SIZE 24
+#define WORLD_UPDATE_SIZE (WORLD_UPDATE_SLOTS * WORLD_UPDATE_SLOT_SIZE)
+
 enum damage_index
 {
     BODY_TORSO,
@@ -844,3 +851,75 @@ void set_globals(MapData *map, float time, float dt)
     ftotclk = time;
     fsynctics = dt;
 }
+
+inline void write_float_le(char *out, float value)
+{
+    uint32_t bits;
+    memcpy(&bits, &value, 4);
+    out[0] = (char)bits;
+    out[1] = (char)(bits >> 8);
+    out[2] = (char)(bits >> 16);
+    out[3] = (char)(bits >> 24);
+}
+
+void write_world_update_slot(char *data, PlayerType *p)
+{
+    write_float_le(data, p->p.x);
+    write_float_le(data + 4, p->p.y);
+    write_float_le(data + 8, p->p.z);
+    write_float_le(data + 12, p->f.x);
+    write_float_le(data + 16, p->f.y);
+    write_float_le(data + 20, p->f.z);
+}
+
+void clear_world_update_slot(char *data)
+{
+    memset(data, 0, WORLD_UPDATE_SLOT_SIZE);
+}
+
+inline int can_see_character(MapData *map, PlayerType *a, PlayerType *b)
+{
+    // eye to head, then eye to legs, as seen from either side
+    return can_see(map, a->p.x, a->p.y, a->p.z, b->p.x, b->p.y, b->p.z) ||
+           can_see(map, a->p.x, a->p.y, a->p.z, b->p.x, b->p.y,
+                   b->p.z + 1.8f);
+}
+
+// visibility[i] has bit j set if the character in slot j may be visible to
+// the character in slot i. Empty slots and dead viewers see everything, as do
+// members of the same team. The test is symmetric, so each pair is only
+// checked once.
+void compute_visibility(MapData *map, PlayerType **players, int *teams,
+                        float fog_distance, uint32_t *visibility)
+{
+    global_map = map;
+    float max_distance = fog_distance * fog_distance;
+    for (int i = 0; i < WORLD_UPDATE_SLOTS; i++)
+        visibility[i] = 0xFFFFFFFF;
+    for (int i = 0; i < WORLD_UPDATE_SLOTS; i++)
+    {
+        PlayerType *a = players[i];
+        if (a == NULL)
+            continue;
+        for (int j = i + 1; j < WORLD_UPDATE_SLOTS; j++)
+        {
+            PlayerType *b = players[j];
+            if (b == NULL || teams[i] == teams[j])
+                continue;
+            float dx = a->p.x - b->p.x;
+            float dy = a->p.y - b->p.y;
+            if (dx * dx + dy * dy <= max_distance &&
+                (can_see_character(map, a, b) ||
+                 can_see_character(map, b, a)))
+                continue;
+            visibility[i] &= ~(1u << j);
+            visibility[j] &= ~(1u << i);
+        }
+    }
+    // dead players are following the action, don't hide anything from them
+    for (int i = 0; i < WORLD_UPDATE_SLOTS; i++)
+    {
+        if (players[i] != NULL && !players[i]->alive)
+            visibility[i] = 0xFFFFFFFF;
+    }
+}
@@ -15,11 +15,17 @@ use_static = (os.environ.get('STDCPP_STATIC') == '1')
 use_asan = (os.environ.get('USE_ASAN') == '1')
 use_ubsan = (os.environ.get('USE_UBSAN') == '1')
 use_linetrace = (os.environ.get('CYTHON_TRACE') == '1')
+use_hash_colors = (os.environ.get('VXL_HASH_COLORS') == '1')
 
 compile_flags: List[str] = []
 link_flags: List[str] = []
 macros: Dict[str, str] = {}
 
+# maps are parsed with several threads
+if os.name != 'nt':
+    compile_flags += ['-pthread']
+    link_flags += ['-pthread']
+
 if use_static:
     link_flags += ['-static-libstdc++', '-static-libgcc']
 
@@ -37,6 +43,10 @@ if use_linetrace:
     macros['CYTHON_TRACE'] = '1'
     Options.generate_cleanup_code = True
 
+# Store map colors in the old hash map layout, for comparing the two
+if use_hash_colors:
+    macros['VXL_HASH_COLORS'] = '1'
+
 extension_descriptors = [
     Descriptor('pyspades.world',
                sources=['pyspades/world.pyx'],
@@ -0,0 +1,76 @@
+"""
+test piqueserver/map.py
+"""
+
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+from piqueserver.map import load_map_file, warm_map_cache
+from pyspades.vxl import VXLData
+
+
+def write_map(filename, z):
+    map_ = VXLData()
+    map_.set_column_fast(10, 20, z, 63, z, 0x808080)
+    data = map_.generate()
+    with open(filename, 'wb') as fp:
+        fp.write(data)
+    return data
+
+
+class TestMapCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.maps_dir = os.path.join(self.dir, 'maps')
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        os.mkdir(self.maps_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_load(self):
+        filename = os.path.join(self.maps_dir, 'a.vxl')
+        data = write_map(filename, 30)
+        self.assertEqual(load_map_file(filename).generate(), data)
+        self.assertFalse(os.path.exists(self.cache_dir))
+        self.assertEqual(load_map_file(filename, self.cache_dir).generate(),
+                         data)
+        cached = os.listdir(self.cache_dir)
+        self.assertEqual(len(cached), 1)
+        self.assertEqual(load_map_file(filename, self.cache_dir).generate(),
+                         data)
+
+        # a broken cache file is replaced
+        with open(os.path.join(self.cache_dir, cached[0]), 'wb') as fp:
+            fp.write(b'broken')
+        self.assertEqual(load_map_file(filename, self.cache_dir).generate(),
+                         data)
+        self.assertEqual(os.listdir(self.cache_dir), cached)
+
+        # the cache is keyed by the contents of the map
+        data = write_map(filename, 40)
+        self.assertEqual(load_map_file(filename, self.cache_dir).generate(),
+                         data)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_warm(self):
+        for name, z in (('a', 30), ('b', 40)):
+            write_map(os.path.join(self.maps_dir, name + '.vxl'), z)
+        with open(os.path.join(self.maps_dir, 'broken.vxl'), 'wb') as fp:
+            fp.write(b'broken')
+        with open(os.path.join(self.maps_dir, 'a.txt'), 'w') as fp:
+            fp.write('name = "a"\n')
+
+        results = warm_map_cache(self.maps_dir, self.cache_dir, 2)
+        self.assertEqual(sorted(results), ['a', 'b', 'broken'])
+        self.assertIs(results['a'], True)
+        self.assertIs(results['b'], True)
+        self.assertIsInstance(results['broken'], ValueError)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+        results = warm_map_cache(self.maps_dir, self.cache_dir)
+        self.assertIs(results['a'], False)
+        self.assertIs(results['b'], False)
@@ -0,0 +1,127 @@
+"""
+test piqueserver/replay.py
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+import enet
+from twisted.trial import unittest
+
+from piqueserver import replay
+from pyspades import capture
+from pyspades.constants import UPDATE_FREQUENCY
+from pyspades.protocol import BaseProtocol
+
+# (time, event type, payload) of the recorded events
+EVENTS = [
+    (0.0, enet.EVENT_TYPE_CONNECT, capture.ADDRESS.pack(1234) + b"10.0.0.1"),
+    (0.1, enet.EVENT_TYPE_RECEIVE, b"a"),
+    (0.2, enet.EVENT_TYPE_RECEIVE, b"b"),
+    (0.3, enet.EVENT_TYPE_RECEIVE, b"c"),
+    (0.4, enet.EVENT_TYPE_DISCONNECT, b""),
+]
+
+
+class RecordingProtocol(BaseProtocol):
+    """a protocol that records the events it is given, with an update loop
+    like the one of pyspades.server.ServerProtocol"""
+
+    def __init__(self):
+        self.received = []
+        self.loop_count = 0
+        self.simulation_time = 0.0
+        BaseProtocol.__init__(self)
+
+    def _post_init(self):
+        pass
+
+    def record(self, name):
+        # the replay clock of the host, and the real time
+        self.received.append((name, self.host.clock(), time.monotonic()))
+
+    def on_connect(self, peer):
+        self.record('connect')
+
+    def on_disconnect(self, peer):
+        self.record('disconnect')
+
+    def data_received(self, peer, packet):
+        self.record(packet.data)
+
+    async def update(self):
+        while True:
+            BaseProtocol.update(self)
+            self.loop_count += 1
+            await self.sleep(UPDATE_FREQUENCY)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'capture.bin')
+        self.now = 0.0
+        with open(self.path, 'wb') as fp:
+            writer = capture.CaptureWriter(fp, lambda: self.now)
+            for recorded, event_type, payload in EVENTS:
+                self.now = recorded
+                writer.write(3, event_type, payload=payload)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def replay(self, speed):
+        try:
+            old_loop = asyncio.get_event_loop_policy().get_event_loop()
+        except RuntimeError:
+            # an earlier test may have left no event loop set
+            old_loop = None
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            protocol_class = replay.make_replay_protocol(
+                RecordingProtocol, self.path, speed)
+            protocol = protocol_class()
+            protocol._post_init()
+
+            async def wait():
+                while not protocol.replay_done:
+                    await asyncio.sleep(0.001)
+
+            with patch.object(replay, 'reactor') as reactor:
+                loop.run_until_complete(asyncio.wait_for(wait(), 10))
+            reactor.stop.assert_called_once_with()
+            protocol.update_loop.cancel()
+            loop.run_until_complete(asyncio.gather(protocol.update_loop,
+                                                   return_exceptions=True))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(old_loop)
+        self.assertEqual(protocol.host.events, len(EVENTS))
+        self.assertEqual([name for name, _, _ in protocol.received],
+                         ['connect', b"a", b"b", b"c", 'disconnect'])
+        return protocol.received
+
+    def test_max_speed(self):
+        received = self.replay(0)
+        for (recorded, _, _), (_, replayed, _) in zip(EVENTS, received):
+            # every tick advances the clock by one update interval
+            self.assertGreaterEqual(replayed, recorded)
+            self.assertLess(replayed, recorded + UPDATE_FREQUENCY * 1.5)
+
+    def test_speed(self):
+        for speed in (2.0, 8.0):
+            received = self.replay(speed)
+            start = received[0][2]
+            for (recorded, _, _), (_, replayed, real) in zip(EVENTS,
+                                                              received):
+                self.assertGreaterEqual(replayed, recorded)
+                # the clock runs at speed times real time, so the events
+                # arrive after recorded / speed seconds, plus up to a tick
+                self.assertGreaterEqual(real - start, recorded / speed - 0.01)
+                self.assertLess(real - start,
+                                recorded / speed + UPDATE_FREQUENCY + 0.05)
@@ -78,4 +78,92 @@ class TestByteReader(unittest.TestCase):
             self.assertEqual(reader.readFloat(False), 2.2132692287005784e-38)
             self.assertEqual(reader.readFloat(True), -6.384869180745487e+29)
 
+    def test_buffer_input(self):
+        data = bytearray(b"\x01\x02abc\x00def")
+        for i in (memoryview(data), memoryview(data)[0:]):
+            reader = ByteReader(i)
+            self.assertEqual(reader.readByte(True), 1)
+            sub = reader.readReader(4)
+            self.assertEqual(sub.readByte(True), 2)
+            self.assertEqual(sub.read(), b"abc")
+            self.assertEqual(reader.readString(), b"")
+            self.assertEqual(reader.read(), b"def")
+
+    def test_readview(self):
+        data = bytearray(b"abcdef")
+        reader = ByteReader(data, 1)
+        view = reader.readView(3)
+        self.assertEqual(view.tobytes(), b"bcd")
+        # views share memory with the input
+        data[1] = ord("x")
+        self.assertEqual(view.tobytes(), b"xcd")
+        self.assertEqual(reader.readView().tobytes(), b"ef")
+
+    def test_readstring(self):
+        reader = ByteReader(b"ab\x00cd\x00\x00efgh")
+        self.assertEqual(reader.readString(), b"ab")
+        self.assertEqual(reader.readString(4), b"cd")
+        # unterminated strings stop at the end of the field
+        self.assertEqual(reader.readString(2), b"ef")
+        # ... or at the end of the data
+        self.assertEqual(reader.readString(), b"gh")
+        self.assertEqual(reader.dataLeft(), 0)
+
     # TODO: test rest of bytes.pyx, moving on to more useful modules for now
+
+
+class TestByteWriter(unittest.TestCase):
+    """tests for ByteWriter"""
+
+    def test_write(self):
+        writer = ByteWriter()
+        writer.writeByte(-15)
+        writer.writeByte(241, True)
+        writer.writeShort(241, False, False)
+        writer.writeInt(15794417, True, False)
+        writer.writeFloat(2.2132692287005784e-38, False)
+        writer.writeString(b"abc", 6)
+        self.assertEqual(bytes(writer),
+                         b"\xF1\xF1\xF1\x00\xF1\x00\xF1\x00\xF1\x00\xF1\x00"
+                         b"abc\x00\x00\x00")
+        self.assertEqual(len(writer), 18)
+        self.assertEqual(writer.tell(), 18)
+
+    def test_rewind(self):
+        writer = ByteWriter()
+        writer.write(b"abcdef")
+        writer.rewind(4)
+        self.assertEqual(writer.tell(), 2)
+        writer.write(b"X")
+        self.assertEqual(bytes(writer), b"abXdef")
+        writer.rewind(100)
+        self.assertEqual(writer.tell(), 0)
+
+    def test_grow(self):
+        writer = ByteWriter()
+        data = bytes(range(256)) * 300
+        writer.write(data)
+        writer.pad(10)
+        self.assertEqual(bytes(writer), data + bytes(10))
+
+    def test_memoryview(self):
+        writer = ByteWriter()
+        writer.write(b"abc")
+        view = memoryview(writer)
+        self.assertEqual(view.tobytes(), b"abc")
+        self.assertTrue(view.readonly)
+        # growing would move the memory under the view
+        with self.assertRaises(RuntimeError):
+            writer.write(bytes(100000))
+        view.release()
+        writer.write(bytes(100000))
+        self.assertEqual(len(writer), 100003)
+
+    def test_pool(self):
+        writer = ByteWriter()
+        writer.write(b"some data")
+        del writer
+        # buffers taken from the pool start out empty
+        writer = ByteWriter()
+        self.assertEqual(bytes(writer), b"")
+        self.assertEqual(writer.tell(), 0)
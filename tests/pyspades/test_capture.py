@@ -0,0 +1,74 @@
+"""
+test pyspades/capture.py
+"""
+
+import io
+
+import enet
+from twisted.trial import unittest
+
+from pyspades import capture
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CaptureTest(unittest.TestCase):
+    def write_capture(self):
+        clock = FakeClock()
+        fp = io.BytesIO()
+        writer = capture.CaptureWriter(fp, clock)
+        writer.write(3, enet.EVENT_TYPE_CONNECT, 0, 3,
+                     capture.ADDRESS.pack(1234) + b"10.0.0.1")
+        clock.now = 0.5
+        writer.write(3, enet.EVENT_TYPE_RECEIVE, 0, 0, b"\x01\x02")
+        clock.now = 1.0
+        writer.write(3, enet.EVENT_TYPE_DISCONNECT)
+        self.assertEqual(writer.count, 3)
+        fp.seek(0)
+        return list(capture.read_capture(fp))
+
+    def test_roundtrip(self):
+        records = self.write_capture()
+        self.assertEqual(
+            [(r.time, r.peer_id, r.type) for r in records],
+            [(0.0, 3, enet.EVENT_TYPE_CONNECT),
+             (0.5, 3, enet.EVENT_TYPE_RECEIVE),
+             (1.0, 3, enet.EVENT_TYPE_DISCONNECT)])
+        self.assertEqual(records[1].payload, b"\x01\x02")
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            list(capture.read_capture(io.BytesIO(b"nope")))
+        data = capture.MAGIC + capture.RECORD.pack(0, 0, 0, 0, 0, 10) + b"a"
+        with self.assertRaises(ValueError):
+            list(capture.read_capture(io.BytesIO(data)))
+
+    def test_replay(self):
+        clock = FakeClock()
+        host = capture.ReplayHost(self.write_capture(), clock)
+        event = host.service(0)
+        peer = event.peer
+        self.assertEqual(event.type, enet.EVENT_TYPE_CONNECT)
+        self.assertEqual((peer.address.host, peer.address.port),
+                         ("10.0.0.1", 1234))
+        self.assertEqual(peer.eventData, 3)
+        # the next event is not due yet
+        self.assertIsNone(host.service(0))
+
+        clock.now = 0.5
+        event = host.service(0)
+        self.assertIs(event.peer, peer)
+        self.assertEqual(event.packet.data, b"\x01\x02")
+
+        # events for peers the server dropped are skipped
+        peer.disconnect()
+        clock.now = 2.0
+        self.assertIsNone(host.service(0))
+        self.assertTrue(host.finished)
+        self.assertEqual(host.events, 2)
@@ -0,0 +1,134 @@
+"""
+tests for pyspades/client.py
+"""
+
+import zlib
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades import world
+from pyspades.bytes import ByteReader
+from pyspades.capture import FakePacket
+from pyspades.client import ClientConnection, ClientProtocol
+from pyspades.packet import load_client_packet, load_server_packet
+from pyspades.vxl import VXLData
+
+
+def make_protocol():
+    protocol = ClientProtocol.__new__(ClientProtocol)
+    protocol.name = 'Bot'
+    protocol.map = None
+    protocol.world = world.World()
+    protocol.bots = []
+    return protocol
+
+
+def sent(peer):
+    return [bytes(call.args[1].data) for call in peer.send.call_args_list]
+
+
+class ClientConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = make_protocol()
+        self.peer = Mock()
+        self.connection = ClientConnection(self.protocol, self.peer)
+        self.protocol.bots.append(self.connection)
+
+    def receive(self, contained):
+        self.connection.loader_received(FakePacket(bytes(contained.generate())))
+
+    def test_handshake(self):
+        self.receive(loaders.HandShakeInit())
+        self.receive(loaders.VersionRequest())
+        handshake, version = sent(self.peer)
+        handshake_return = load_client_packet(ByteReader(handshake))
+        self.assertIsInstance(handshake_return, loaders.HandShakeReturn)
+        self.assertTrue(handshake_return.success)
+        version_response = load_client_packet(ByteReader(version))
+        self.assertEqual(version_response.client, 'p')
+        self.assertEqual(self.connection.packets_received, 2)
+        self.assertEqual(self.connection.bytes_sent, len(handshake + version))
+
+    def test_join(self):
+        data = zlib.compress(bytes(VXLData().generate()))
+        map_start = loaders.MapStart()
+        map_start.size = len(data)
+        self.receive(map_start)
+        for index in range(0, len(data), 1024):
+            chunk = loaders.MapChunk()
+            chunk.data = data[index:index + 1024]
+            self.receive(chunk)
+        self.assertEqual(self.connection.map_received, len(data))
+        self.assertIsNone(self.protocol.map)
+
+        self.connection.on_state_data(SimpleNamespace(player_id=5))
+        self.assertIsNotNone(self.protocol.map)
+        self.assertIs(self.protocol.world.map, self.protocol.map)
+        self.assertIsNotNone(self.connection.map_time)
+        existing_player = load_server_packet(ByteReader(sent(self.peer)[0]))
+        self.assertIsInstance(existing_player, loaders.ExistingPlayer)
+        self.assertEqual(existing_player.player_id, 5)
+        self.assertEqual(existing_player.name, 'Bot')
+
+        create_player = loaders.CreatePlayer()
+        create_player.player_id = 5
+        create_player.weapon = create_player.team = 0
+        create_player.x, create_player.y, create_player.z = 256, 256, 30
+        create_player.name = 'Bot'
+        self.receive(create_player)
+        self.assertIsNotNone(self.connection.world_object)
+
+        self.protocol.world.update(0.01)
+        self.connection.update(100.0)
+        self.assertGreater(self.peer.send.call_count, 1)
+
+        stats = self.protocol.get_stats()
+        self.assertEqual(stats['joined'], 1)
+        self.assertEqual(stats['maps'], 1)
+        self.assertEqual(stats['map_bytes'], len(data))
+
+        kill_action = loaders.KillAction()
+        kill_action.player_id = 5
+        kill_action.killer_id = 5
+        kill_action.kill_type = kill_action.respawn_time = 0
+        self.receive(kill_action)
+        self.assertIsNone(self.connection.world_object)
+        self.assertEqual(self.protocol.world.objects, [])
+
+    def send_map(self, map_):
+        data = zlib.compress(bytes(map_.generate()))
+        map_start = loaders.MapStart()
+        map_start.size = len(data)
+        self.receive(map_start)
+        for index in range(0, len(data), 1024):
+            chunk = loaders.MapChunk()
+            chunk.data = data[index:index + 1024]
+            self.receive(chunk)
+        self.connection.on_state_data(SimpleNamespace(player_id=5))
+
+    def test_map_change(self):
+        first = VXLData()
+        self.send_map(first)
+        map_ = self.protocol.map
+        # the same map again, e.g. for another bot, is not decoded again
+        self.send_map(first)
+        self.assertIs(self.protocol.map, map_)
+
+        second = VXLData()
+        second.set_point(10, 20, 30, (1, 2, 3))
+        self.send_map(second)
+        self.assertIsNot(self.protocol.map, map_)
+        self.assertEqual(self.protocol.map.get_color(10, 20, 30), (1, 2, 3))
+        self.assertIs(self.protocol.world.map, self.protocol.map)
+
+    def test_world_update(self):
+        # the server only sends the slots up to the highest player id
+        world_update = loaders.WorldUpdate()
+        world_update.items = [((1, 2, 3), (1, 0, 0))] * 3
+        packet = load_server_packet(ByteReader(
+            bytes(world_update.generate())))
+        self.assertEqual(len(packet.items), 3)
+        self.assertEqual(packet.items[0], ((1, 2, 3), (1, 0, 0)))
@@ -1,11 +1,126 @@
 """
-test pyspades/protocol.py
+test pyspades/mapgenerator.py
 """
 
+import random
+import threading
+import zlib
+from unittest.mock import patch
+
 from pyspades import mapgenerator
+from pyspades.vxl import VXLData
 
 from twisted.trial import unittest
 
+
+def make_map():
+    rng = random.Random(1)
+    map_ = VXLData()
+    for _ in range(2000):
+        x, y = rng.randrange(512), rng.randrange(512)
+        z = rng.randrange(1, 63)
+        map_.set_column_fast(x, y, z, 63, z + 2, rng.randrange(0xFFFFFF))
+    return map_
+
+
+def read_all(generator, size=8192):
+    chunks = []
+    while generator.data_left():
+        chunks.append(generator.read(size))
+    return b''.join(chunks)
+
+
 class TestMapGenerator(unittest.TestCase):
-    def test_dummy(self):
-        pass
+    def test_progressive(self):
+        map_ = make_map()
+        data = read_all(mapgenerator.ProgressiveMapGenerator(map_))
+        self.assertEqual(zlib.decompress(data), map_.generate())
+
+    def test_adler32_combine(self):
+        first, second = b'pyspades' * 1000, b'piqueserver' * 3000
+        self.assertEqual(
+            mapgenerator.adler32_combine(zlib.adler32(first),
+                                         zlib.adler32(second), len(second)),
+            zlib.adler32(first + second))
+
+
+class TestMapCache(unittest.TestCase):
+    def test_data(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        data = read_all(cache.get_generator())
+        self.assertEqual(zlib.decompress(data), map_.generate())
+
+    def test_reuse(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        data = cache.get_data()
+        self.assertIs(cache.get_data(), data)
+        stats = cache.get_stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_changes(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        cache.get_data()
+        compressed = cache.bands_compressed
+        # on the border of two bands
+        map_.set_point(100, 16, 30, (1, 2, 3))
+        self.assertEqual(zlib.decompress(cache.get_data()), map_.generate())
+        self.assertEqual(cache.bands_compressed, compressed + 2)
+        map_.destroy_point(100, 16, 30)
+        map_.update_shadows()
+        self.assertEqual(zlib.decompress(cache.get_data()), map_.generate())
+
+    def test_copy(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        data = cache.get_data()
+        # a copy has the same contents, but changes to either of them are
+        # not mixed up
+        copy = map_.copy()
+        cache.map = copy
+        self.assertIs(cache.get_data(), data)
+        copy.set_point(10, 10, 10, (1, 2, 3))
+        map_.set_point(10, 10, 11, (1, 2, 3))
+        self.assertEqual(zlib.decompress(cache.get_data()), copy.generate())
+        cache.map = map_
+        self.assertEqual(zlib.decompress(cache.get_data()), map_.generate())
+
+    def test_background(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        # keep the build thread busy, so the data is not ready yet
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+        mapgenerator.get_build_executor().submit(block)
+        started.wait()
+        generator = cache.get_generator()
+        self.assertFalse(cache.get_stats()['ready'])
+        self.assertTrue(generator.data_left())
+        self.assertEqual(generator.read(8192), b'')
+        # the map changes after the snapshot was taken
+        expected = map_.copy().generate()
+        map_.set_point(10, 10, 10, (1, 2, 3))
+        release.set()
+        self.assertEqual(zlib.decompress(read_all(generator)), expected)
+        self.assertEqual(zlib.decompress(cache.get_data()), map_.generate())
+
+    def test_failed(self):
+        map_ = make_map()
+        cache = mapgenerator.MapCache(map_)
+        with patch.object(cache, 'build', side_effect=MemoryError):
+            generator = cache.get_generator()
+            # the player gets the map anyway
+            data = read_all(generator)
+        self.assertEqual(zlib.decompress(data), map_.generate())
+        self.assertEqual(len(self.flushLoggedErrors(MemoryError)), 1)
+        self.assertIsNone(cache.versions)
+        # the next player gets the cached data
+        data = read_all(cache.get_generator())
+        self.assertEqual(zlib.decompress(data), map_.generate())
+        self.assertTrue(cache.get_stats()['ready'])
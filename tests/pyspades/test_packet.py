@@ -0,0 +1,47 @@
+"""
+tests for pyspades/packet.pyx
+"""
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader
+from pyspades.packet import LoaderCache, load_client_packet
+
+
+def make_position(x, y, z):
+    position = loaders.PositionData()
+    position.x, position.y, position.z = x, y, z
+    return bytes(position.generate())
+
+
+class LoaderCacheTest(unittest.TestCase):
+    def test_load(self):
+        packet = load_client_packet(ByteReader(make_position(1, 2, 3)))
+        self.assertIsInstance(packet, loaders.PositionData)
+        self.assertEqual((packet.x, packet.y, packet.z), (1, 2, 3))
+
+    def test_unknown(self):
+        self.assertIsNone(load_client_packet(ByteReader(b"\xFE")))
+
+    def test_reuse(self):
+        cache = LoaderCache([loaders.PositionData.id])
+        first = load_client_packet(ByteReader(make_position(1, 2, 3)), cache)
+        self.assertIs(first, cache.get(loaders.PositionData.id))
+        self.assertEqual((first.x, first.y, first.z), (1, 2, 3))
+        second = load_client_packet(ByteReader(make_position(4, 5, 6)), cache)
+        self.assertIs(first, second)
+        self.assertEqual((second.x, second.y, second.z), (4, 5, 6))
+
+        # packets not in the cache are still allocated
+        chat = loaders.ChatMessage()
+        chat.player_id = 1
+        chat.chat_type = 0
+        chat.value = "hi"
+        packet = load_client_packet(ByteReader(bytes(chat.generate())), cache)
+        self.assertIsInstance(packet, loaders.ChatMessage)
+        self.assertIsNone(cache.get(loaders.ChatMessage.id))
+
+    def test_invalid_id(self):
+        with self.assertRaises(KeyError):
+            LoaderCache([0xFE])
@@ -27,3 +27,35 @@ class BaseConnectionTest(unittest.TestCase):
             ply.on_new_player_recieved(ex_ply)
 
             self.assertEqual(ply.team, team)
+
+    def test_congestion(self):
+        peer = Mock(reliableDataInTransit=0, packetLoss=0, roundTripTime=40,
+                    lowestRoundTripTime=30)
+        ply = player.ServerConnection(Mock(), peer)
+        ply.saved_loaders = []
+        self.assertFalse(ply.send_world_update())
+        self.assertEqual(ply.congestion, 'loading')
+
+        ply.saved_loaders = None
+        self.assertTrue(ply.send_world_update())
+        self.assertIsNone(ply.congestion)
+
+        peer.packetLoss = 1 << 15
+        self.assertFalse(ply.send_world_update())
+        self.assertEqual(ply.congestion, 'loss')
+        self.assertEqual(ply.world_update_throttle.interval, 2)
+
+    def test_network_rate(self):
+        peer = Mock(roundTripTime=20, packetThrottle=32)
+        ply = player.ServerConnection(Mock(), peer)
+        self.assertEqual(ply.get_network_fps(), 30)
+        peer.roundTripTime = 100
+        self.assertAlmostEqual(ply.get_network_fps(), 10)
+        peer.packetThrottle = 8
+        self.assertEqual(ply.get_network_fps(), 5)
+
+        peer.packetThrottle = 32
+        self.assertTrue(ply.network_update_due(10.0))
+        self.assertAlmostEqual(ply.next_network_update, 10.1)
+        self.assertFalse(ply.network_update_due(10.05))
+        self.assertTrue(ply.network_update_due(10.1))
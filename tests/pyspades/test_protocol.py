@@ -2,9 +2,111 @@
 test pyspades/protocol.py
 """
 
+import collections
+from unittest.mock import Mock
+
 from twisted.trial import unittest
 from pyspades import protocol
+from pyspades import contained as loaders
+
+import enet
+
 
 class BaseConnectionTest(unittest.TestCase):
     def test_test(self):
         pass
+
+
+class OutboundTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = protocol.BaseProtocol.__new__(protocol.BaseProtocol)
+        self.protocol.host = Mock()
+        self.protocol.outbound_packets = {}
+        self.peer = Mock()
+        self.connection = protocol.BaseConnection(self.protocol, self.peer)
+        self.protocol.connections = {self.peer: self.connection}
+
+    def test_flush(self):
+        self.connection.queue_packet("a")
+        self.connection.queue_packet("b")
+        self.protocol.outbound_packets[b"a"] = "a"
+        self.peer.send.assert_not_called()
+
+        self.protocol.flush_outbound()
+        self.assertEqual([call.args for call in self.peer.send.call_args_list],
+                         [(0, "a"), (0, "b")])
+        self.assertEqual(self.protocol.packets_flushed, 2)
+        self.assertEqual(self.protocol.outbound_packets, {})
+        self.protocol.host.flush.assert_called_once_with()
+
+        # nothing left to send
+        self.protocol.flush_outbound()
+        self.assertEqual(self.peer.send.call_count, 2)
+
+    def test_order(self):
+        self.connection.queue_packet("a")
+        self.connection.send_contained(loaders.PlayerLeft())
+        self.assertEqual(self.peer.send.call_count, 2)
+        self.assertEqual(self.peer.send.call_args_list[0].args, (0, "a"))
+        self.assertIsNone(self.connection.outbound)
+
+
+class ServiceBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = protocol.BaseProtocol.__new__(protocol.BaseProtocol)
+        self.protocol.host = Mock()
+        self.protocol.connections = {}
+        self.protocol.clients = {}
+        self.protocol.service_stats = protocol.ServiceStats()
+        self.protocol.pending_events = collections.deque()
+        self.protocol.data_received = Mock()
+        event = Mock(type=enet.EVENT_TYPE_RECEIVE)
+        self.events = [event] * 5
+        self.protocol.host.service.side_effect = (
+            lambda timeout: self.events.pop() if self.events else None)
+        self.protocol.host.check_events.side_effect = (
+            lambda: self.events.pop() if self.events else None)
+
+    def test_unlimited(self):
+        self.protocol.update()
+        stats = self.protocol.service_stats
+        self.assertEqual(self.protocol.data_received.call_count, 5)
+        self.assertEqual((stats.receive, stats.last_events), (5, 5))
+        self.assertEqual((stats.deferred, stats.backlog), (0, 0))
+
+    def test_event_budget(self):
+        self.protocol.service_event_budget = 2
+        stats = self.protocol.service_stats
+        self.protocol.update()
+        self.assertEqual(self.protocol.data_received.call_count, 2)
+        # the events left over are queued for the next tick
+        self.assertEqual(len(self.events), 0)
+        self.assertEqual(stats.queue_depth, 3)
+        self.assertEqual(self.protocol.host.flush.call_count, 1)
+        service_calls = self.protocol.host.service.call_count
+        self.protocol.update()
+        # the host is not serviced, but the packets queued are still sent
+        self.assertEqual(self.protocol.host.service.call_count,
+                         service_calls)
+        self.assertEqual(self.protocol.host.flush.call_count, 2)
+        self.assertEqual((stats.deferred, stats.backlog), (2, 2))
+        self.assertEqual(stats.queue_depth, 1)
+        self.protocol.update()
+        self.assertEqual(stats.receive, 5)
+        self.assertEqual(stats.backlog, 0)
+        self.assertEqual((stats.queue_depth, stats.max_queue_depth), (0, 3))
+        self.assertEqual(stats.ticks, 3)
+        self.assertEqual(stats.as_dict()['maxQueueDepth'], 3)
+
+    def test_max_pending_events(self):
+        self.protocol.service_event_budget = 1
+        self.protocol.max_pending_events = 2
+        stats = self.protocol.service_stats
+        self.protocol.update()
+        # the other events stay in enet
+        self.assertEqual(len(self.events), 2)
+        self.assertEqual(stats.queue_depth, 2)
+        for _ in range(4):
+            self.protocol.update()
+        self.assertEqual(self.protocol.data_received.call_count, 5)
+        self.assertEqual(len(self.events), 0)
@@ -0,0 +1,114 @@
+"""
+tests for pyspades/schema.py
+"""
+
+from types import SimpleNamespace
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader, ByteWriter, NoDataLeft
+from pyspades.schema import (
+    compile_schema, SchemaLoader, Flags, FixedString, BYTE, UBYTE, INT, UINT,
+    FLOAT, USHORT_BE, COLOR, RGB, STRING, BYTES)
+
+SAMPLES = {
+    BYTE: -3,
+    UBYTE: 200,
+    INT: -70000,
+    UINT: 70000,
+    FLOAT: 1.5,
+    COLOR: 0x123456,
+    STRING: "name",
+    BYTES: b"\x01\x02\x03",
+}
+
+
+def schema_packets():
+    for value in vars(loaders).values():
+        if isinstance(value, type) and 'fields' in vars(value):
+            yield value
+
+
+def fill(packet, fields):
+    for name, field_type in fields:
+        if isinstance(field_type, Flags):
+            for bit, flag in enumerate(field_type.names):
+                setattr(packet, flag, bit % 2 == 0)
+        else:
+            setattr(packet, name, SAMPLES[field_type])
+
+
+def generate(packet, write):
+    writer = ByteWriter()
+    write(packet, writer)
+    return bytes(writer)
+
+
+class ContainedSchemaTest(unittest.TestCase):
+    def test_packets(self):
+        self.assertGreater(len(list(schema_packets())), 20)
+
+    def test_write(self):
+        for packet_class in schema_packets():
+            _, write = compile_schema(packet_class.fields, packet_class.id)
+            packet = packet_class()
+            fill(packet, packet_class.fields)
+            self.assertEqual(generate(packet, write),
+                             bytes(packet.generate()), packet_class.__name__)
+
+    def test_read(self):
+        for packet_class in schema_packets():
+            read, _ = compile_schema(packet_class.fields)
+            packet = packet_class()
+            fill(packet, packet_class.fields)
+            data = bytes(packet.generate())[1:]
+
+            expected = packet_class()
+            expected.read(ByteReader(data))
+            result = SimpleNamespace()
+            read(result, ByteReader(data))
+            for name, value in vars(result).items():
+                self.assertEqual(value, getattr(expected, name),
+                                 (packet_class.__name__, name))
+
+
+class ExamplePacket(SchemaLoader):
+    id = 0x70
+    fields = [
+        ('player_id', UBYTE),
+        ('port', USHORT_BE),
+        ('color', RGB),
+        ('tag', FixedString(8)),
+        ('name', STRING),
+    ]
+
+
+class SchemaLoaderTest(unittest.TestCase):
+    def test_roundtrip(self):
+        packet = ExamplePacket()
+        packet.player_id = 3
+        packet.port = 32887
+        packet.color = (1, 2, 3)
+        packet.tag = "abc"
+        packet.name = "deuce"
+        data = bytes(packet.generate())
+        self.assertEqual(
+            data, b"\x70\x03\x80\x77\x03\x02\x01abc\0\0\0\0\0deuce\0")
+
+        result = ExamplePacket(ByteReader(data[1:]))
+        self.assertEqual(result.player_id, 3)
+        self.assertEqual(result.port, 32887)
+        self.assertEqual(result.color, (1, 2, 3))
+        self.assertEqual(result.tag, "abc")
+        self.assertEqual(result.name, "deuce")
+
+    def test_short(self):
+        with self.assertRaises(NoDataLeft):
+            ExamplePacket(ByteReader(b"\x03\x80"))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            compile_schema([('name', STRING), ('x', FLOAT)])
+        with self.assertRaises(TypeError):
+            compile_schema([('x', float)])
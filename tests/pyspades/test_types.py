@@ -1,4 +1,4 @@
-from pyspades.types import IDPool, AttributeSet
+from pyspades.types import IDPool, AttributeSet, UpdateThrottle
 import unittest
 
 
@@ -30,3 +30,27 @@ class TestAttributeSet(unittest.TestCase):
         self.assertTrue(atset.new)
         atset.new = 0
         self.assertFalse(atset.new)
+
+
+class TestUpdateThrottle(unittest.TestCase):
+    def test_backoff(self):
+        throttle = UpdateThrottle(max_interval=4)
+        self.assertTrue(throttle.update(congested=False))
+        self.assertEqual(throttle.interval, 1)
+        sent = [throttle.update(congested=True) for _ in range(16)]
+        self.assertEqual(throttle.interval, 4)
+        self.assertEqual(sent[-8:].count(True), 2)
+
+        # recovers one step per update sent
+        calls = 17
+        while throttle.interval > 1:
+            throttle.update(congested=False)
+            calls += 1
+        self.assertTrue(throttle.update(congested=False))
+        self.assertEqual(throttle.sent + throttle.skipped, calls + 1)
+
+    def test_skip(self):
+        throttle = UpdateThrottle()
+        throttle.skip()
+        self.assertEqual((throttle.sent, throttle.skipped), (0, 1))
+        self.assertEqual(throttle.interval, 1)
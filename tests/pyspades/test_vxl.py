@@ -0,0 +1,570 @@
+"""
+tests for pyspades/vxl.pyx
+"""
+
+import io
+import os
+import random
+import struct
+import tempfile
+from unittest.mock import patch
+
+from twisted.trial import unittest
+
+from pyspades import vxl
+from pyspades.vxl import VXLData
+
+
+def random_map(seed, columns=2000):
+    rng = random.Random(seed)
+    map_ = VXLData()
+    for _ in range(columns):
+        x, y = rng.randrange(512), rng.randrange(512)
+        z = rng.randrange(1, 63)
+        map_.set_column_fast(x, y, z, 63, z + 2, rng.randrange(0xFFFFFF))
+    return map_
+
+
+def to_float(value):
+    """round value to a C float"""
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def band_data(map_):
+    return b''.join([map_.get_band_data(band) for band in range(64)])
+
+
+class ColorStoreTest(unittest.TestCase):
+    def test_column(self):
+        map_ = VXLData()
+        # out of order, so colors have to be inserted in between
+        for z in (40, 10, 63, 0, 20, 30):
+            map_.set_point(5, 7, z, (z, 1, 2))
+        for z in (0, 10, 20, 30, 40, 63):
+            self.assertEqual(map_.get_color(5, 7, z), (z, 1, 2))
+        self.assertIsNone(map_.get_color(5, 7, 11))
+
+        map_.remove_point(5, 7, 20)
+        self.assertIsNone(map_.get_color(5, 7, 20))
+        self.assertEqual(map_.get_color(5, 7, 10), (10, 1, 2))
+        self.assertEqual(map_.get_color(5, 7, 30), (30, 1, 2))
+
+        map_.set_point(5, 7, 30, (9, 9, 9))
+        self.assertEqual(map_.get_color(5, 7, 30), (9, 9, 9))
+        # neighbouring columns are untouched
+        self.assertIsNone(map_.get_color(6, 7, 30))
+        self.assertIsNone(map_.get_color(5, 8, 30))
+
+    def test_random_edits(self):
+        rng = random.Random(1)
+        map_ = random_map(1)
+        expected = {}
+        columns = [(rng.randrange(512), rng.randrange(512))
+                   for _ in range(50)]
+        # enough edits to move columns around in the color pool
+        for _ in range(20000):
+            x, y = rng.choice(columns)
+            z = rng.randrange(64)
+            if rng.random() < 0.7:
+                color = (rng.randrange(256), rng.randrange(256),
+                         rng.randrange(256))
+                map_.set_point(x, y, z, color)
+                expected[x, y, z] = color
+            else:
+                map_.remove_point(x, y, z)
+                expected[x, y, z] = None
+        for (x, y, z), color in expected.items():
+            self.assertEqual(map_.get_color(x, y, z), color)
+
+    def test_neighbouring_columns(self):
+        # columns of one chunk that grow past 32 colors in turn, so that the
+        # pool is compacted while a column is growing
+        rng = random.Random(1)
+        map_ = VXLData()
+        expected = {}
+        points = [(x, 0, z) for z in range(64) for x in range(4)]
+        rng.shuffle(points)
+        for point in points:
+            color = (rng.randrange(256), rng.randrange(256),
+                     rng.randrange(256))
+            map_.set_point(*point, color)
+            expected[point] = color
+        for (x, y, z), color in expected.items():
+            self.assertEqual(map_.get_color(x, y, z), color)
+
+    def test_copy(self):
+        map_ = random_map(2)
+        copy = map_.copy()
+        self.assertEqual(copy.generate(), map_.generate())
+        copy.set_point(1, 1, 1, (1, 2, 3))
+        self.assertIsNone(map_.get_color(1, 1, 1))
+
+    def test_copy_on_write(self):
+        rng = random.Random(12)
+        map_ = random_map(12)
+        copies = []
+        for _ in range(5):
+            copy = map_.copy()
+            copies.append((copy, map_.generate()))
+            # changes to a copy do not show up in the map, or the other way
+            # around
+            copy.set_point(0, 0, 0, (1, 2, 3))
+            for _ in range(50):
+                x, y, z = (rng.randrange(512), rng.randrange(512),
+                           rng.randrange(64))
+                if rng.random() < 0.5:
+                    map_.set_point(x, y, z, (rng.randrange(256), 0, 0))
+                else:
+                    map_.destroy_point(x, y, z)
+        map_.update_shadows()
+        self.assertFalse(map_.get_solid(0, 0, 0))
+        for copy, data in copies:
+            self.assertEqual(copy.get_color(0, 0, 0), (1, 2, 3))
+            copy.remove_point(0, 0, 0)
+            self.assertEqual(copy.generate(), data)
+            self.assertEqual(VXLData(io.BytesIO(data)).generate(), data)
+
+    def test_save_load(self):
+        map_ = random_map(3)
+        data = map_.generate()
+        loaded = VXLData(io.BytesIO(data))
+        self.assertEqual(loaded.generate(), data)
+        generator = loaded.get_generator()
+        chunks = []
+        while True:
+            chunk = generator.get_data(8192)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), data)
+
+    def test_save_edits(self):
+        rng = random.Random(9)
+        map_ = random_map(9)
+        map_.generate()
+        generator = map_.get_generator()
+        before = map_.copy().generate()
+        for step in range(400):
+            x, y = rng.randrange(512), rng.randrange(512)
+            z = rng.randrange(64)
+            if step % 4 == 0:
+                map_.destroy_point(x, y, z)
+            elif step % 4 == 1:
+                map_.remove_point(x, y, z)
+            else:
+                map_.set_point(x, y, z, (step % 256, 1, 2))
+            # only the changed columns are serialized again
+            if step % 100 == 0:
+                data = map_.generate()
+                self.assertEqual(VXLData(io.BytesIO(data)).generate(), data)
+                self.assertEqual(data, band_data(map_))
+        map_.set_column_fast(0, 511, 0, 63, 0, 0x123456)
+        data = map_.generate()
+        self.assertEqual(
+            data, VXLData(io.BytesIO(data)).copy().generate())
+        self.assertEqual(VXLData(io.BytesIO(data)).generate(), data)
+        # generators keep the map as it was when they were created
+        chunks = []
+        while True:
+            chunk = generator.get_data(8192)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), before)
+
+    def test_snapshot(self):
+        map_ = random_map(10)
+        expected = map_.copy().generate()
+        # never serialized, so the snapshot takes a copy of the map
+        snapshot = map_.get_snapshot()
+        map_.set_point(300, 300, 30, (4, 5, 6))
+        self.assertEqual(band_data(snapshot), expected)
+        # a few changes are serialized right away
+        map_.generate()
+        map_.set_point(1, 1, 10, (1, 2, 3))
+        expected = map_.copy().generate()
+        snapshot = map_.get_snapshot()
+        self.assertEqual(snapshot.band_versions, map_.get_band_versions())
+        map_.set_point(300, 300, 31, (4, 5, 6))
+        self.assertEqual(band_data(snapshot), expected)
+
+    def test_reuse_snapshot(self):
+        map_, same = random_map(11), random_map(11)
+        snapshot = map_.get_snapshot()
+        snapshot.encode()
+        map_.reuse_snapshot(snapshot)
+        self.assertEqual(map_.generate(), same.generate())
+        # changes made after the snapshot are serialized again
+        map_.update_shadows()
+        same.update_shadows()
+        snapshot = map_.get_snapshot()
+        map_.set_point(1, 1, 10, (1, 2, 3))
+        same.set_point(1, 1, 10, (1, 2, 3))
+        snapshot.encode()
+        map_.reuse_snapshot(snapshot)
+        self.assertEqual(map_.generate(), same.generate())
+        # only the last snapshot is reused
+        old = map_.get_snapshot()
+        map_.set_point(2, 2, 10, (1, 2, 3))
+        same.set_point(2, 2, 10, (1, 2, 3))
+        map_.get_snapshot()
+        old.encode()
+        map_.reuse_snapshot(old)
+        map_.set_point(3, 3, 10, (1, 2, 3))
+        same.set_point(3, 3, 10, (1, 2, 3))
+        self.assertEqual(map_.generate(), same.generate())
+
+    def test_load_file(self):
+        data = random_map(6).generate()
+        fd, path = tempfile.mkstemp(suffix='.vxl')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        with open(path, 'rb') as fp:
+            self.assertEqual(VXLData(fp).generate(), data)
+
+    def test_load_threads(self):
+        data = random_map(7).generate()
+        self.patch(vxl, 'LOAD_THREADS', 1)
+        single = VXLData(io.BytesIO(data)).generate()
+        self.patch(vxl, 'LOAD_THREADS', 7)
+        self.assertEqual(VXLData(io.BytesIO(data)).generate(), single)
+        self.assertEqual(single, data)
+
+    def test_cache(self):
+        map_ = random_map(16)
+        map_.set_point(5, 6, 7, (1, 2, 3))
+        map_.remove_point(8, 9, 63)
+        data = map_.generate()
+        with tempfile.TemporaryFile() as fp:
+            fp.write(map_.get_cache_data())
+            fp.seek(0)
+            loaded = vxl.load_cache(fp)
+        self.assertEqual(loaded.generate(), data)
+        self.assertEqual(loaded.get_color(5, 6, 7), (1, 2, 3))
+        self.assertEqual(loaded.count_land(0, 0, 512, 512),
+                         map_.count_land(0, 0, 512, 512))
+        loaded.set_point(5, 6, 6, (4, 5, 6))
+        self.assertEqual(loaded.get_color(5, 6, 6), (4, 5, 6))
+        self.assertEqual(
+            vxl.load_cache(io.BytesIO(loaded.get_cache_data())).generate(),
+            loaded.generate())
+
+    def test_cache_invalid(self):
+        data = random_map(17).get_cache_data()
+        # a color for a voxel that is not solid, in the first column
+        air_color = bytearray(data)
+        air_color[16 + 4096 * 8] |= 1
+        for invalid in (b'', b'VXLCACHE', data[:-4], data + b'\0',
+                        data[:8] + b'\2' + data[9:], bytes(air_color)):
+            self.assertRaises(ValueError, vxl.load_cache, io.BytesIO(invalid))
+
+    def test_load_invalid(self):
+        data = random_map(8).generate()
+        for invalid in (b'', data[:-1], data[:len(data) // 2],
+                        b'\x00\x00\xff\x00' * 10):
+            self.assertRaises(ValueError, VXLData, io.BytesIO(invalid))
+
+    def test_update_shadows(self):
+        map_ = VXLData()
+        map_.set_column_fast(10, 10, 40, 63, 41, 0x123456)
+        map_.update_shadows()
+        # shadows only change the alpha channel
+        self.assertEqual(map_.get_color(10, 10, 40), (0x12, 0x34, 0x56))
+        self.assertEqual(map_.get_color(10, 10, 41), (0x12, 0x34, 0x56))
+
+
+class ColumnQueryTest(unittest.TestCase):
+    def test_get_z(self):
+        map_ = random_map(15)
+        map_.set_point(1, 1, 0, (1, 2, 3))
+        map_.remove_point(2, 2, 63)
+        columns = [(1, 1), (2, 2), (-1, 5), (5, 512)] + [
+            (x, y) for x in range(0, 512, 37) for y in range(0, 512, 41)]
+        for x, y in columns:
+            for start in (-5, 0, 1, 30, 62, 63, 64, 70):
+                expected = 0
+                for z in range(start, 64):
+                    if map_.get_solid(x, y, z):
+                        expected = z
+                        break
+                self.assertEqual(map_.get_z(x, y, start), expected)
+            expected = 0
+            for z in range(63, -1, -1):
+                if not map_.get_solid(x, y, z):
+                    expected = z + 1
+                    break
+            self.assertEqual(map_.get_height(x, y), expected)
+
+    def test_changes(self):
+        map_ = VXLData()
+        map_.set_column_fast(7, 8, 20, 63, 20, 0x808080)
+        self.assertEqual(map_.get_z(7, 8), 20)
+        self.assertEqual(map_.get_z(7, 8, 21), 21)
+        map_.set_point(7, 8, 5, (1, 2, 3))
+        self.assertEqual(map_.get_z(7, 8), 5)
+        self.assertEqual(map_.destroy_point(7, 8, 5), 1)
+        self.assertEqual(map_.get_z(7, 8), 20)
+        map_.remove_point(7, 8, 30)
+        self.assertEqual(map_.get_height(7, 8), 31)
+        self.assertEqual(map_.get_z(7, 8, 30), 31)
+
+
+def island_map():
+    map_ = VXLData()
+    for x1, y1, x2, y2 in ((3, 5, 9, 70), (60, 100, 130, 103),
+                           (500, 500, 512, 512)):
+        for x in range(x1, x2):
+            for y in range(y1, y2):
+                map_.set_column_fast(x, y, 60, 63, 60, 0x808080)
+    return map_
+
+
+class LandTest(unittest.TestCase):
+    def assertLandCount(self, map_, x1, y1, x2, y2):
+        mask = map_.get_solid_mask(62)
+        expected = sum(mask[y, x] for x in range(max(x1, 0), min(x2, 512))
+                       for y in range(max(y1, 0), min(y2, 512)))
+        self.assertEqual(map_.count_land(x1, y1, x2, y2), expected)
+
+    def test_count_land(self):
+        map_ = island_map()
+        for rect in ((0, 0, 512, 512), (4, 6, 8, 60), (0, 0, 65, 130),
+                     (63, 101, 129, 102), (-10, -10, 5, 600),
+                     (100, 0, 50, 512), (200, 200, 300, 300)):
+            self.assertLandCount(map_, *rect)
+        self.assertEqual(map_.count_land(0, 0, 512, 512),
+                         6 * 65 + 70 * 3 + 12 * 12)
+
+    def test_changes(self):
+        map_ = island_map()
+        copy = map_.copy()
+        map_.remove_point(5, 10, 62)
+        map_.set_point(300, 300, 62, (1, 2, 3))
+        map_.set_column_fast(0, 0, 62, 62, 62, 0x808080)
+        for x in range(60, 130):
+            map_.remove_point(x, 101, 62)
+        self.assertEqual(map_.count_land(0, 0, 512, 512),
+                         copy.count_land(0, 0, 512, 512) - 70 - 1 + 2)
+        self.assertEqual(map_.count_land(60, 100, 130, 103), 140)
+        self.assertEqual(copy.count_land(60, 100, 130, 103), 210)
+        self.assertLandCount(map_, 0, 0, 512, 512)
+        self.assertLandCount(copy, 0, 0, 512, 512)
+
+    def test_random_point(self):
+        random.seed(0)
+        map_ = island_map()
+        map_.remove_point(100, 101, 62)
+        expected = {(x, y) for x in range(60, 130) for y in range(100, 103)
+                    if (x, y) != (100, 101)}
+        seen = set()
+        for _ in range(3000):
+            point = map_.get_random_point(50, 90, 140, 120)
+            self.assertIn(point, expected)
+            seen.add(point)
+        self.assertEqual(seen, expected)
+        for _ in range(100):
+            x, y = map_.get_random_point(0, 0, 512, 512)
+            self.assertTrue(map_.get_solid(x, y, 62))
+
+    def test_random_point_order(self):
+        # the land columns are picked from in the order of a scan by x and
+        # then by y, so a seeded random gives the same points as before the
+        # land index
+        map_ = random_map(3)
+        mask = map_.get_solid_mask(62)
+        for x1, y1, x2, y2 in ((0, 0, 511, 511), (30, 40, 200, 90)):
+            land = [(x, y) for x in range(x1, x2) for y in range(y1, y2)
+                    if mask[y, x]]
+            rng = random.Random(5)
+            with patch.object(random, 'random', rng.random):
+                points = [map_.get_random_point(x1, y1, x2, y2)
+                          for _ in range(200)]
+            rng = random.Random(5)
+            expected = []
+            for _ in range(200):
+                # the random numbers are passed and scaled as floats
+                index = int(to_float(to_float(rng.random()) * len(land)))
+                expected.append(land[min(index, len(land) - 1)])
+                rng.random()
+            self.assertEqual(points, expected)
+
+    def test_random_point_no_land(self):
+        map_ = island_map()
+        for _ in range(100):
+            x, y = map_.get_random_point(200, 210, 300, 220)
+            self.assertTrue(200 <= x < 300 and 210 <= y < 220)
+
+
+class ViewTest(unittest.TestCase):
+    def test_solid_mask(self):
+        map_ = random_map(13)
+        for z in (0, 20, 62, 63):
+            mask = map_.get_solid_mask(z)
+            self.assertEqual(mask.shape, (512, 512))
+            for y in range(0, 512, 7):
+                for x in range(512):
+                    self.assertEqual(mask[y, x], map_.get_solid(x, y, z))
+        self.assertRaises(IndexError, map_.get_solid_mask, 64)
+
+    def test_top_surface(self):
+        map_ = random_map(14)
+        map_.set_point(3, 4, 10, (1, 2, 3))
+        map_.remove_point(5, 6, 63)
+        heights = map_.get_height_map()
+        colors = map_.get_color_map()
+        self.assertEqual(heights[4, 3], 10)
+        self.assertEqual(colors[4, 3] & 0xFFFFFF, 0x010203)
+        for y in range(0, 512, 3):
+            for x in range(512):
+                z = map_.get_z(x, y)
+                self.assertEqual(heights[y, x], z)
+                color = map_.get_color(x, y, z)
+                if color is None:
+                    self.assertEqual(colors[y, x], 0)
+                else:
+                    self.assertEqual(colors[y, x] & 0xFFFFFF,
+                                     color[0] << 16 | color[1] << 8 |
+                                     color[2])
+
+
+def reference_check_node(map_, x, y, z):
+    # plain flood fill to compare VXLData.check_node against
+    if z >= 62:
+        return 0
+    marked = {(x, y, z)}
+    stack = [(x, y, z)]
+    while stack:
+        x, y, z = stack.pop()
+        for node in ((x, y, z + 1), (x, y - 1, z), (x, y + 1, z),
+                     (x - 1, y, z), (x + 1, y, z), (x, y, z - 1)):
+            if node in marked or not map_.get_solid(*node):
+                continue
+            if node[2] >= 62:
+                return 0
+            marked.add(node)
+            stack.append(node)
+    return len(marked)
+
+
+class CheckNodeTest(unittest.TestCase):
+    def test_random_structures(self):
+        rng = random.Random(4)
+        map_ = VXLData()
+        # ground in part of the area, so some structures are connected to it
+        for x in range(100, 110):
+            for y in range(100, 120):
+                map_.set_column_fast(x, y, 62, 63, 62, 0x808080)
+        for _ in range(3000):
+            map_.set_point(rng.randrange(100, 120), rng.randrange(100, 120),
+                           rng.randrange(40, 62), (1, 2, 3))
+        for x in range(99, 121):
+            for y in range(99, 121):
+                for z in range(40, 62):
+                    self.assertEqual(map_.check_node(x, y, z),
+                                     reference_check_node(map_, x, y, z),
+                                     (x, y, z))
+
+    def test_tower(self):
+        map_ = VXLData()
+        map_.set_column_fast(10, 10, 0, 63, 0, 0x808080)
+        for z in range(62):
+            self.assertEqual(map_.check_node(10, 10, z), 0)
+        self.assertEqual(map_.destroy_point(10, 10, 40), 41)
+        self.assertFalse(map_.get_solid(10, 10, 0))
+        self.assertTrue(map_.get_solid(10, 10, 41))
+        self.assertEqual(map_.check_node(10, 10, 41), 0)
+
+    def test_bridge(self):
+        map_ = VXLData()
+        for x in (10, 60):
+            map_.set_column_fast(x, 10, 20, 63, 20, 0x808080)
+        for x in range(11, 60):
+            map_.set_point(x, 10, 20, (1, 2, 3))
+        self.assertEqual(map_.check_node(35, 10, 20), 0)
+        # cutting the bridge leaves both halves standing
+        self.assertEqual(map_.destroy_point(35, 10, 20), 1)
+        self.assertEqual(map_.check_node(34, 10, 20), 0)
+        self.assertEqual(map_.check_node(36, 10, 20), 0)
+        # cutting a tower drops its half of the bridge
+        self.assertEqual(map_.destroy_point(10, 10, 21), 1 + 1 + 24)
+        self.assertFalse(map_.get_solid(34, 10, 20))
+        self.assertTrue(map_.get_solid(36, 10, 20))
+
+    def test_floating(self):
+        map_ = VXLData()
+        for x in range(32):
+            for y in range(32):
+                map_.set_point(x, y, 5, (1, 2, 3))
+        # checking without destroying leaves no state behind
+        self.assertEqual(map_.check_node(0, 0, 5), 32 * 32)
+        self.assertEqual(map_.check_node(31, 31, 5), 32 * 32)
+        self.assertEqual(map_.check_node(0, 0, 5, True), 32 * 32)
+        self.assertFalse(map_.get_solid(31, 31, 5))
+        self.assertIsNone(map_.get_color(31, 31, 5))
+
+
+class ConnectivityIndexTest(unittest.TestCase):
+    def make_maps(self, seed):
+        rng = random.Random(seed)
+        map_ = VXLData()
+        for x in range(100, 110):
+            for y in range(100, 120):
+                map_.set_column_fast(x, y, 62, 63, 62, 0x808080)
+        for _ in range(4000):
+            map_.set_point(rng.randrange(100, 120), rng.randrange(100, 120),
+                           rng.randrange(40, 62), (1, 2, 3))
+        indexed = map_.copy()
+        indexed.enable_connectivity_index()
+        return map_, indexed
+
+    def assert_same(self, map_, indexed):
+        self.assertEqual(map_.generate(), indexed.generate())
+
+    def test_random_edits(self):
+        rng = random.Random(5)
+        map_, indexed = self.make_maps(5)
+        for step in range(3000):
+            x, y = rng.randrange(99, 121), rng.randrange(99, 121)
+            z = rng.randrange(38, 64)
+            action = rng.random()
+            if action < 0.6:
+                self.assertEqual(bool(map_.destroy_point(x, y, z)),
+                                 bool(indexed.destroy_point(x, y, z)))
+            elif action < 0.9:
+                self.assertEqual(map_.build_point(x, y, z, (3, 2, 1)),
+                                 indexed.build_point(x, y, z, (3, 2, 1)))
+            elif action < 0.95:
+                map_.set_point(x, y, z, (3, 2, 1))
+                indexed.set_point(x, y, z, (3, 2, 1))
+            else:
+                map_.remove_point(x, y, z)
+                indexed.remove_point(x, y, z)
+            if step % 500 == 0:
+                self.assert_same(map_, indexed)
+        self.assert_same(map_, indexed)
+
+    def test_floating_count(self):
+        map_ = VXLData()
+        map_.enable_connectivity_index()
+        map_.set_column_fast(10, 10, 20, 63, 20, 0x808080)
+        for x in range(11, 20):
+            map_.set_point(x, 10, 20, (1, 2, 3))
+        # the bridge and the top of the tower fall down
+        self.assertEqual(map_.destroy_point(10, 10, 21), 1 + 10)
+        self.assertFalse(map_.get_solid(19, 10, 20))
+
+    def test_remove_point(self):
+        map_ = VXLData()
+        map_.enable_connectivity_index()
+        map_.set_column_fast(10, 10, 20, 63, 20, 0x808080)
+        # floating blocks stay, but are no longer connected
+        map_.remove_point(10, 10, 30)
+        self.assertTrue(map_.get_solid(10, 10, 20))
+        self.assertEqual(map_.destroy_point(10, 10, 25), 1 + 4 + 5)
+        # and are connected again once the gap is filled
+        map_.set_column_fast(10, 10, 20, 63, 20, 0x808080)
+        self.assertEqual(map_.destroy_point(10, 10, 20), 1)
+        map_.remove_point(10, 10, 40)
+        map_.set_point(10, 10, 40, (1, 2, 3))
+        self.assertEqual(map_.destroy_point(10, 10, 21), 1)
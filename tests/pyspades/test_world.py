@@ -3,6 +3,11 @@ from twisted.trial import unittest
 from unittest.mock import Mock
 
 from pyspades import world
+from pyspades import contained as loaders
+from pyspades.common import Vertex3
+from pyspades.vxl import VXLData
+
+import struct
 
 import colorsys
 
@@ -27,3 +32,68 @@ class WorldTest(unittest.TestCase):
                        (18, 17, 11), (18, 17, 12), (19, 17, 12), (19, 18, 12),
                        (20, 18, 12), (20, 19, 12), (21, 19, 12)]
         self.assertEqual(line, line_should)
+
+    def test_world_update_buffer(self):
+        w = world.World()
+        character = w.create_object(world.Character, Vertex3(1, 2, 3),
+                                    None, None, 3)
+        character.set_orientation(1, 0, 0)
+        data = w.get_network_data(4)
+        self.assertEqual(len(data), 4 * 24)
+        self.assertEqual(data[:3 * 24], bytes(3 * 24))
+        self.assertEqual(struct.unpack('<6f', data[3 * 24:]),
+                         (1.0, 2.0, 3.0, 1.0, 0.0, 0.0))
+
+        character.network_visible = False
+        self.assertEqual(w.get_network_data(4), bytes(4 * 24))
+        character.network_visible = True
+        character.delete()
+        self.assertEqual(w.get_network_data(), bytes(32 * 24))
+
+    def test_world_update_encoding(self):
+        w = world.World()
+        w.create_object(world.Character, Vertex3(10.5, 20.25, 30),
+                        Vertex3(0, 1, 0), None, 1)
+        items = [((0.0, 0.0, 0.0), (0.0, 0.0, 0.0)),
+                 ((10.5, 20.25, 30.0), (0.0, 1.0, 0.0))]
+        legacy = loaders.WorldUpdate()
+        legacy.items = items
+        buffered = loaders.WorldUpdate()
+        buffered.data = w.get_network_data(2)
+        self.assertEqual(bytes(legacy.generate()),
+                         bytes(buffered.generate()))
+
+    def test_visibility(self):
+        w = world.World()
+        w.map = VXLData()
+        a = w.create_object(world.Character, Vertex3(100, 100, 30),
+                            None, None, 0)
+        b = w.create_object(world.Character, Vertex3(110, 100, 30),
+                            None, None, 1)
+        a.network_team = 0
+        b.network_team = 1
+        w.update_visibility()
+        self.assertTrue(w.is_visible(0, 1))
+        self.assertTrue(w.is_visible(1, 0))
+
+        for y in range(80, 121):
+            for z in range(10, 50):
+                w.map.set_point(105, y, z, (255, 0, 0))
+        w.update_visibility()
+        self.assertFalse(w.is_visible(0, 1))
+        self.assertFalse(w.is_visible(1, 0))
+        self.assertEqual(w.get_network_data_for(0, 2)[24:], bytes(24))
+        self.assertEqual(w.get_network_data_for(0, 2)[:24],
+                         w.get_network_data(1))
+        self.assertEqual(w.get_network_data_for(-1, 2),
+                         w.get_network_data(2))
+
+        b.network_team = 0
+        w.update_visibility()
+        self.assertTrue(w.is_visible(0, 1))
+
+        b.network_team = 1
+        b.set_position(100, 300, 30)
+        w.map = VXLData()
+        w.update_visibility()
+        self.assertFalse(w.is_visible(0, 1))